@@ -3,6 +3,8 @@ import os
 import pandas as pd
 
 from utils import *
+from set_io import ColumnarSets, load_sets_columnar
+from dataset_preview import preview_head, preview_sample, dataset_summary
 
 
 class DataLoader:
@@ -150,6 +152,51 @@ class DataLoader:
 
 
 
+    def load_columnar_sets(self, data_path: str) -> ColumnarSets:
+        """
+        Memory-map a set collection in the columnar binary layout (see 
+        set_io.py). Only the accessed sets are decoded and slices are views.
+
+        Args:
+            data_path (str): Path to the columnar set directory.
+
+        Returns:
+            ColumnarSets: Lazily decoded sets.
+        """
+        return load_sets_columnar(data_path)
+
+    def preview_sets(self, data_path: str, n: int = 50, sample: bool = False, seed: int = 0) -> list:
+        """
+        Preview of a JSON set collection without loading the whole file (see
+        dataset_preview.py).
+
+        Args:
+            data_path (str): Path to the JSON file.
+            n (int): Number of sets.
+            sample (bool): Seeded random sample instead of the first n sets.
+            seed (int): Seed of the sample.
+
+        Returns:
+            list: The first or sampled n sets.
+        """
+        if sample:
+            return preview_sample(data_path, n, seed)
+        return preview_head(data_path, n)
+
+    def summarize_sets(self, data_path: str, refresh: bool = False) -> dict:
+        """
+        Set size and element length histograms of a JSON set collection from
+        one streaming pass, cached next to the dataset.
+
+        Args:
+            data_path (str): Path to the JSON file.
+            refresh (bool): Recompute the cached summary.
+
+        Returns:
+            dict: Summary statistics (see dataset_preview.compute_summary).
+        """
+        return dataset_summary(data_path, refresh)
+
     def load_dblp_titles(self, data_path: str) -> list:
         """
         Load DBLP paper titles from a CSV file.
@@ -0,0 +1,127 @@
+import json
+import os
+import random
+from collections import Counter
+
+from set_io import iter_json_array
+
+# Element lengths above this are counted in one bucket, so summaries stay small
+MAX_ELEMENT_LENGTH = 200
+
+SUMMARY_SUFFIX = ".summary.json"
+
+
+def preview_head(data_path: str, n: int = 50) -> list:
+    """
+    Gives the first n sets of a JSON dataset, only the beginning of the file is read.
+
+    Args:
+        data_path (str): Path to the JSON file.
+        n (int): Number of sets.
+
+    Returns:
+        list: The first n sets.
+    """
+    sets = []
+    for record in iter_json_array(data_path):
+        if len(sets) >= n:
+            break
+        sets.append(record)
+    return sets
+
+
+def preview_sample(data_path: str, n: int = 50, seed: int = 0) -> list:
+    """
+    Gives a uniform random sample of n sets of a JSON dataset (reservoir sampling).
+    The file is streamed once, only the sample is kept in memory.
+
+    Args:
+        data_path (str): Path to the JSON file.
+        n (int): Sample size.
+        seed (int): Seed of the sample, the same seed gives the same sample.
+
+    Returns:
+        list: The sampled sets in file order.
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    for i, record in enumerate(iter_json_array(data_path)):
+        if i < n:
+            reservoir.append((i, record))
+        else:
+            j = rng.randint(0, i)
+            if j < n:
+                reservoir[j] = (i, record)
+    return [record for _, record in sorted(reservoir, key=lambda item: item[0])]
+
+
+def _summary_path(data_path: str) -> str:
+    return data_path + SUMMARY_SUFFIX
+
+
+def compute_summary(data_path: str) -> dict:
+    """
+    Computes summary statistics of a JSON dataset in one streaming pass.
+
+    Args:
+        data_path (str): Path to the JSON file.
+
+    Returns:
+        dict: Number of sets and elements, and the histograms of set sizes and
+              element lengths (value -> count, lengths above MAX_ELEMENT_LENGTH
+              are counted as MAX_ELEMENT_LENGTH).
+    """
+    set_sizes = Counter()
+    element_lengths = Counter()
+    set_amount = 0
+    for record in iter_json_array(data_path):
+        set_amount += 1
+        set_sizes[len(record)] += 1
+        for element in record:
+            element_lengths[min(len(str(element)), MAX_ELEMENT_LENGTH)] += 1
+
+    return {
+        "set_amount": set_amount,
+        "element_amount": sum(element_lengths.values()),
+        "set_size_histogram": dict(sorted(set_sizes.items())),
+        "element_length_histogram": dict(sorted(element_lengths.items())),
+    }
+
+
+def dataset_summary(data_path: str, refresh: bool = False) -> dict:
+    """
+    Gives the summary statistics of a JSON dataset (see compute_summary). They are
+    cached in a file next to the dataset and recomputed when the dataset changes.
+
+    Args:
+        data_path (str): Path to the JSON file.
+        refresh (bool): Recompute the summary even if it is cached.
+
+    Returns:
+        dict: Summary statistics.
+    """
+    stat = os.stat(data_path)
+    source = {"size": stat.st_size, "mtime": stat.st_mtime}
+    summary_path = _summary_path(data_path)
+
+    if not refresh and os.path.exists(summary_path):
+        try:
+            with open(summary_path, "r", encoding="utf-8") as file:
+                cached = json.load(file)
+            if cached.get("source") == source:
+                summary = cached["summary"]
+                # JSON object keys are strings
+                for histogram in ("set_size_histogram", "element_length_histogram"):
+                    summary[histogram] = {int(k): v for k, v in summary[histogram].items()}
+                return summary
+        except (OSError, ValueError, KeyError):
+            pass
+
+    summary = compute_summary(data_path)
+    try:
+        with open(summary_path, "w", encoding="utf-8") as file:
+            json.dump({"source": source, "summary": summary}, file)
+    except OSError:
+        # read-only data folder, the summary is still returned
+        pass
+    return summary
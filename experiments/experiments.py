@@ -1,4 +1,5 @@
 import time
+from contextlib import nullcontext
 from math import floor
 
 from silkmoth.silkmoth_engine import SilkMothEngine
@@ -8,10 +9,60 @@ from silkmoth.tokenizer import Tokenizer
 from src.silkmoth.silkmoth_engine import SilkMothEngine
 from src.silkmoth.utils import SigType, edit_similarity
 from utils import *
+from profiling import PeakMemorySampler, StageProfiler, profile_engine
+
+
+def build_engine(source_sets, sim_metric, sim_func, sim_thresh=0, profiler=None, **engine_args):
+    """
+    Builds a SilkMothEngine and measures the index creation. The RAM usage is the peak
+    RSS increase during the build, so transient allocations are included.
+
+    Parameters
+    ----------
+    profiler : StageProfiler, optional
+        Profiler for the index build, the later pipeline stages are profiled with
+        profiling.profile_engine.
+
+    Returns
+    -------
+    tuple
+        The engine, the index creation time in seconds and its RAM usage in MB.
+    """
+    in_index_time_start = time.time()
+
+    index_stage = profiler.stage("index") if profiler is not None else nullcontext()
+    with PeakMemorySampler() as sampler, index_stage:
+        silk_moth_engine = SilkMothEngine(
+            related_thresh=0,
+            source_sets=source_sets,
+            sim_metric=sim_metric,
+            sim_func=sim_func,
+            sim_thresh=sim_thresh,
+            is_check_filter=False,
+            is_nn_filter=False,
+            **engine_args
+        )
+
+    in_index_elapsed_time = time.time() - in_index_time_start
+    in_index_ram_usage = sampler.peak_increase_mb
+    print(f"Inverted Index created in {in_index_elapsed_time:.2f} seconds.")
+    return silk_moth_engine, in_index_elapsed_time, in_index_ram_usage
+
+
+def reset_engine(silk_moth_engine, sim_thresh):
+    """
+    Resets the settings of a shared engine, which a previous experiment might have changed.
+    """
+    silk_moth_engine.set_alpha(sim_thresh)
+    silk_moth_engine.set_signature_type(SigType.WEIGHTED)
+    silk_moth_engine.set_reduction(False)
+    silk_moth_engine.set_check_filter(False)
+    silk_moth_engine.set_nn_filter(False)
 
 
 def run_experiment_filter_schemes(related_thresholds, similarity_thresholds, labels, source_sets, reference_sets,
-                          sim_metric, sim_func, is_search, file_name_prefix, folder_path):
+                          sim_metric, sim_func, is_search, file_name_prefix, folder_path, shared_engine=None,
+                          profile_memory=False, multi_threshold=False):
     """
     Parameters
     ----------
@@ -35,141 +86,226 @@ def run_experiment_filter_schemes(related_thresholds, similarity_thresholds, lab
         Prefix for naming output files generated during the experiment.
     folder_path: str
         Path to the folder where results will be saved.
+    shared_engine : tuple, optional
+        Already built engine with its index creation time and RAM usage (see build_engine),
+        e.g. shared by the scheduler between experiments on the same dataset.
+    profile_memory : bool
+        Record time, peak RSS, tracemalloc peak and top allocation sites of every pipeline stage
+        in the result CSV (see profiling.StageProfiler). Slows down the runs.
+    multi_threshold : bool
+        Additionally run all related thresholds of a label in one pass with search_sets_multi /
+        discover_sets_multi. The pass is written to {file_name_prefix}_sweep_results.csv, one
+        row per threshold with its related sets and the time (sweep_time) and candidate counts
+        of the whole pass, which uses the candidates of the smallest threshold. The per
+        threshold results and plots are not affected.
     """
 
-    # Calculate index time and RAM usage for the SilkMothEngine
-    in_index_time_start = time.time()
-    initial_ram = measure_ram_usage()
-
-    # Initialize and run the SilkMothEngine
-    silk_moth_engine = SilkMothEngine(
-        related_thresh=0,
-        source_sets=source_sets,
-        sim_metric=sim_metric,
-        sim_func=sim_func,
-        sim_thresh=0,
-        is_check_filter=False,
-        is_nn_filter=False,
-    )
-
-    in_index_time_end = time.time()
-    final_ram = measure_ram_usage()
-
-    in_index_elapsed_time = in_index_time_end - in_index_time_start
-    in_index_ram_usage = final_ram - initial_ram
-
-    print(f"Inverted Index created in {in_index_elapsed_time:.2f} seconds.")
-
-    for sim_thresh in similarity_thresholds:
-
-        # Check if the similarity function is edit similarity
-        if sim_func == edit_similarity:
-            # calc the maximum possible q-gram size based on sim_thresh
-            upper_bound_q = sim_thresh/(1 - sim_thresh)
-            q = floor(upper_bound_q)
-
-            print(f"Using q = {q} for edit similarity with sim_thresh = {sim_thresh}")
-            print(f"Rebuilding Inverted Index with q = {q}...")
-            silk_moth_engine.set_q(q)
+    profiler = StageProfiler().start() if profile_memory else None
+    try:
+        if shared_engine is None:
+            # keep the q-gram indexes of earlier alphas for set_q
+            shared_engine = build_engine(source_sets, sim_metric, sim_func, profiler=profiler, index_cache_budget=2048)
+        else:
+            reset_engine(shared_engine[0], 0)
+        silk_moth_engine, in_index_elapsed_time, in_index_ram_usage = shared_engine
+
+        with profile_engine(silk_moth_engine, profiler):
+            for sim_thresh in similarity_thresholds:
+
+                # Check if the similarity function is edit similarity
+                if sim_func == edit_similarity:
+                    # calc the maximum possible q-gram size based on sim_thresh
+                    upper_bound_q = sim_thresh/(1 - sim_thresh)
+                    q = floor(upper_bound_q)
+
+                    print(f"Using q = {q} for edit similarity with sim_thresh = {sim_thresh}")
+                    print(f"Rebuilding Inverted Index with q = {q}...")
+                    silk_moth_engine.set_q(q)
+
+
+
+                elapsed_times_final = []
+                silk_moth_engine.set_alpha(sim_thresh)
+                for label in labels:
+
+                    # checks for filter runs
+                    if label == "CHECK FILTER":
+                        silk_moth_engine.is_check_filter = True
+                        silk_moth_engine.is_nn_filter = False
+                    elif label == "NN FILTER":
+                        silk_moth_engine.is_check_filter = False
+                        silk_moth_engine.is_nn_filter = True
+                    else:  # NO FILTER
+                        silk_moth_engine.is_check_filter = False
+                        silk_moth_engine.is_nn_filter = False
+
+                    # checks for signature scheme runs
+                    if label == SigType.WEIGHTED:
+                        silk_moth_engine.set_signature_type(SigType.WEIGHTED)
+                    elif label == SigType.SKYLINE:
+                        silk_moth_engine.set_signature_type(SigType.SKYLINE)
+                    elif label == SigType.DICHOTOMY:
+                        silk_moth_engine.set_signature_type(SigType.DICHOTOMY)
+
+                    runs = []
+                    for related_thresh in related_thresholds:
+                        print(
+                            f"\nRunning SilkMoth {file_name_prefix} with α = {sim_thresh}, θ = {related_thresh}, label = {label}")
+                        runs.append(_run_single_threshold(silk_moth_engine, related_thresh, source_sets, reference_sets,
+                                                          is_search, profiler))
+
+                    elapsed_times = []
+                    for related_thresh, (elapsed_time, candidates_amount, candidates_after, related_sets_found,
+                                         profile) in zip(related_thresholds, runs):
+                        elapsed_times.append(elapsed_time)
+
+                        # Create a new data dictionary for each iteration
+                        if is_search:
+                            data_overall = {
+                                "similarity_threshold": sim_thresh,
+                                "related_threshold": related_thresh,
+                                "reference_set_amount": len(reference_sets),
+                                "source_set_amount": len(source_sets),
+                                "label": label,
+                                "elapsed_time": round(elapsed_time, 3),
+                                "inverted_index_time": round(in_index_elapsed_time, 3),
+                                "inverted_index_ram_usage": round(in_index_ram_usage, 3),
+                                "candidates_amount": candidates_amount,
+                                "candidates_amount_after_filtering": candidates_after,
+                                "related_sets_found": related_sets_found,
+                            }
+                        else:
+                            data_overall = {
+                                "similarity_threshold": sim_thresh,
+                                "related_threshold": related_thresh,
+                                "source_set_amount": len(source_sets),
+                                "label": label,
+                                "elapsed_time": round(elapsed_time, 3),
+                                "inverted_index_time": round(in_index_elapsed_time, 3),
+                                "inverted_index_ram_usage": round(in_index_ram_usage, 3),
+                            }
+                        data_overall.update(profile)
+                        # Save results to a CSV file
+                        save_experiment_results_to_csv(
+                            results=data_overall,
+                            file_name=f"{folder_path}{file_name_prefix}_experiment_results.csv"
+                        )
+
+                    elapsed_times_final.append(elapsed_times)
+
+                    if multi_threshold:
+                        print(f"\nRunning SilkMoth {file_name_prefix} with α = {sim_thresh}, θ = {related_thresholds}, "
+                              f"label = {label} in one pass")
+                        sweep_time, candidates_amount, candidates_after, related_sets_found, profile = \
+                            _run_multi_threshold(silk_moth_engine, related_thresholds, source_sets, reference_sets,
+                                                 is_search, profiler)
+                        for related_thresh in related_thresholds:
+                            data_sweep = {
+                                "similarity_threshold": sim_thresh,
+                                "related_threshold": related_thresh,
+                                "source_set_amount": len(source_sets),
+                                "label": label,
+                                "sweep_time": round(sweep_time, 3),
+                            }
+                            if is_search:
+                                data_sweep.update({
+                                    "reference_set_amount": len(reference_sets),
+                                    "sweep_candidates_amount": candidates_amount,
+                                    "sweep_candidates_amount_after_filtering": candidates_after,
+                                    "related_sets_found": related_sets_found[related_thresh],
+                                })
+                            data_sweep.update(profile)
+                            save_experiment_results_to_csv(
+                                results=data_sweep,
+                                file_name=f"{folder_path}{file_name_prefix}_sweep_results.csv"
+                            )
+                _ = plot_elapsed_times(
+                    related_thresholds=related_thresholds,
+                    elapsed_times_list=elapsed_times_final,
+                    fig_text=f"{file_name_prefix} (α = {sim_thresh})",
+                    legend_labels=labels,
+                    file_name=f"{folder_path}{file_name_prefix}_experiment_α={sim_thresh}.png"
+                )
 
+    finally:
+        if profiler is not None:
+            profiler.stop()
 
 
-        elapsed_times_final = []
-        silk_moth_engine.set_alpha(sim_thresh)
-        for label in labels:
+def _run_single_threshold(silk_moth_engine, related_thresh, source_sets, reference_sets, is_search, profiler):
+    """
+    Runs the search or discovery for one related threshold.
 
-            elapsed_times = []
-            for idx, related_thresh in enumerate(related_thresholds):
-
-                print(
-                    f"\nRunning SilkMoth {file_name_prefix} with α = {sim_thresh}, θ = {related_thresh}, label = {label}")
-
-                # checks for filter runs
-                if label == "CHECK FILTER":
-                    silk_moth_engine.is_check_filter = True
-                    silk_moth_engine.is_nn_filter = False
-                elif label == "NN FILTER":
-                    silk_moth_engine.is_check_filter = False
-                    silk_moth_engine.is_nn_filter = True
-                else:  # NO FILTER
-                    silk_moth_engine.is_check_filter = False
-                    silk_moth_engine.is_nn_filter = False
-
-                # checks for signature scheme runs
-                if label == SigType.WEIGHTED:
-                    silk_moth_engine.set_signature_type(SigType.WEIGHTED)
-                elif label == SigType.SKYLINE:
-                    silk_moth_engine.set_signature_type(SigType.SKYLINE)
-                elif label == SigType.DICHOTOMY:
-                    silk_moth_engine.set_signature_type(SigType.DICHOTOMY)
-
-                silk_moth_engine.set_related_threshold(related_thresh)
-                # Measure the time taken to search for related sets
-                time_start = time.time()
-
-                # Used for search to see how many candidates were found and how many were removed
-                candidates_amount = 0
-                candidates_after = 0
-                related_sets_found = 0
-                if is_search:
-                    for ref_id, ref_set in enumerate(reference_sets):
-                        related_sets_temp, candidates_amount_temp, candidates_removed_temp = silk_moth_engine.search_sets(
-                            ref_set)
-                        candidates_amount += candidates_amount_temp
-                        candidates_after += candidates_removed_temp
-                        related_sets_found += len(related_sets_temp)
-                else:
-                    # If not searching, we are discovering sets
-                    silk_moth_engine.discover_sets(source_sets)
-
-                time_end = time.time()
-                elapsed_time = time_end - time_start
-
-                elapsed_times.append(elapsed_time)
-
-                # Create a new data dictionary for each iteration
-                if is_search:
-                    data_overall = {
-                        "similarity_threshold": sim_thresh,
-                        "related_threshold": related_thresh,
-                        "reference_set_amount": len(reference_sets),
-                        "source_set_amount": len(source_sets),
-                        "label": label,
-                        "elapsed_time": round(elapsed_time, 3),
-                        "inverted_index_time": round(in_index_elapsed_time, 3),
-                        "inverted_index_ram_usage": round(in_index_ram_usage, 3),
-                        "candidates_amount": candidates_amount,
-                        "candidates_amount_after_filtering": candidates_after,
-                        "related_sets_found": related_sets_found,
-                    }
-                else:
-                    data_overall = {
-                        "similarity_threshold": sim_thresh,
-                        "related_threshold": related_thresh,
-                        "source_set_amount": len(source_sets),
-                        "label": label,
-                        "elapsed_time": round(elapsed_time, 3),
-                        "inverted_index_time": round(in_index_elapsed_time, 3),
-                        "inverted_index_ram_usage": round(in_index_ram_usage, 3),
-                    }
-                # Save results to a CSV file
-                save_experiment_results_to_csv(
-                    results=data_overall,
-                    file_name=f"{folder_path}{file_name_prefix}_experiment_results.csv"
-                )
+    Returns
+    -------
+    tuple
+        Elapsed time, candidates before and after filtering, related sets found and the stage
+        profile (empty without profiler).
+    """
+    silk_moth_engine.set_related_threshold(related_thresh)
+    if profiler is not None:
+        profiler.reset()
+    # Measure the time taken to search for related sets
+    time_start = time.time()
+
+    # Used for search to see how many candidates were found and how many were removed
+    candidates_amount = 0
+    candidates_after = 0
+    related_sets_found = 0
+    if is_search:
+        for ref_set in reference_sets:
+            related_sets_temp, candidates_amount_temp, candidates_removed_temp = silk_moth_engine.search_sets(
+                ref_set)
+            candidates_amount += candidates_amount_temp
+            candidates_after += candidates_removed_temp
+            related_sets_found += len(related_sets_temp)
+    else:
+        # If not searching, we are discovering sets
+        silk_moth_engine.discover_sets(source_sets)
+
+    elapsed_time = time.time() - time_start
+    profile = profiler.results() if profiler is not None else {}
+    return elapsed_time, candidates_amount, candidates_after, related_sets_found, profile
+
+
+def _run_multi_threshold(silk_moth_engine, related_thresholds, source_sets, reference_sets, is_search, profiler):
+    """
+    Runs the search or discovery for all related thresholds in one pass.
 
-            elapsed_times_final.append(elapsed_times)
-        _ = plot_elapsed_times(
-            related_thresholds=related_thresholds,
-            elapsed_times_list=elapsed_times_final,
-            fig_text=f"{file_name_prefix} (α = {sim_thresh})",
-            legend_labels=labels,
-            file_name=f"{folder_path}{file_name_prefix}_experiment_α={sim_thresh}.png"
-        )
+    Returns
+    -------
+    tuple
+        Elapsed time of the pass, candidates before and after filtering of the pass, related
+        sets found per threshold and the stage profile of the pass (empty without profiler).
+    """
+    # the candidates of the smallest threshold are valid for all thresholds
+    silk_moth_engine.set_related_threshold(min(related_thresholds))
+    if profiler is not None:
+        profiler.reset()
+    time_start = time.time()
+
+    candidates_amount = 0
+    candidates_after = 0
+    related_sets_found = {thresh: 0 for thresh in related_thresholds}
+    if is_search:
+        for ref_set in reference_sets:
+            related_sets_temp, candidates_amount_temp, candidates_removed_temp = silk_moth_engine.search_sets_multi(
+                ref_set, related_thresholds)
+            candidates_amount += candidates_amount_temp
+            candidates_after += candidates_removed_temp
+            for thresh, related_sets in related_sets_temp.items():
+                related_sets_found[thresh] += len(related_sets)
+    else:
+        silk_moth_engine.discover_sets_multi(source_sets, related_thresholds)
+
+    elapsed_time = time.time() - time_start
+    profile = profiler.results() if profiler is not None else {}
+    return elapsed_time, candidates_amount, candidates_after, related_sets_found, profile
 
 
 def run_reduction_experiment(related_thresholds, similarity_threshold, labels, source_sets, reference_sets,
-                          sim_metric, sim_func, is_search, file_name_prefix, folder_path):
+                          sim_metric, sim_func, is_search, file_name_prefix, folder_path, shared_engine=None,
+                          profile_memory=False):
     """
     Parameters
     ----------
@@ -193,100 +329,99 @@ def run_reduction_experiment(related_thresholds, similarity_threshold, labels, s
         Prefix for naming output files generated during the experiment.
     folder_path: str
         Path to the folder where results will be saved.
+    shared_engine : tuple, optional
+        Already built engine with its index creation time and RAM usage (see build_engine).
+    profile_memory : bool
+        Record time, peak RSS, tracemalloc peak and top allocation sites of every pipeline stage
+        in the result CSV (see profiling.StageProfiler). Slows down the runs.
     """
-    in_index_time_start = time.time()
-    initial_ram = measure_ram_usage()
-
-    # Initialize and run the SilkMothEngine
-    silk_moth_engine = SilkMothEngine(
-        related_thresh=0,
-        source_sets=source_sets,
-        sim_metric=sim_metric,
-        sim_func=sim_func,
-        sim_thresh=similarity_threshold,
-        is_check_filter=False,
-        is_nn_filter=False,
-    )
-    # use dichotomy signature scheme for this experiment
-    silk_moth_engine.set_signature_type(SigType.DICHOTOMY)
-
-    in_index_time_end = time.time()
-    final_ram = measure_ram_usage()
-
-    in_index_elapsed_time = in_index_time_end - in_index_time_start
-    in_index_ram_usage = final_ram - initial_ram
-
-    print(f"Inverted Index created in {in_index_elapsed_time:.2f} seconds.")
-
-    elapsed_times_final = []
-    for label in labels:
-
-        if label == "REDUCTION":
-            silk_moth_engine.set_reduction(True)
-        elif label == "NO REDUCTION":
-            silk_moth_engine.set_reduction(False)
-
-        elapsed_times = []
-        for idx, related_thresh in enumerate(related_thresholds):
-
-            print(
-                f"\nRunning SilkMoth {file_name_prefix} with α = {similarity_threshold}, θ = {related_thresh}, label = {label}")
-
-            silk_moth_engine.set_related_threshold(related_thresh)
-            # Measure the time taken to search for related sets
-            time_start = time.time()
-
-            # Used for search to see how many candidates were found and how many were removed
-            candidates_amount = 0
-            candidates_after = 0
-            if is_search:
-                for ref_id, ref_set in enumerate(reference_sets):
-                    related_sets_temp, candidates_amount_temp, candidates_removed_temp = silk_moth_engine.search_sets(
-                        ref_set)
-                    candidates_amount += candidates_amount_temp
-                    candidates_after += candidates_removed_temp
-            else:
-                # If not searching, we are discovering sets
-                silk_moth_engine.discover_sets(source_sets)
-
-            time_end = time.time()
-            elapsed_time = time_end - time_start
-
-            elapsed_times.append(elapsed_time)
-
-            # Create a new data dictionary for each iteration
-            if is_search:
-                data_overall = {
-                    "similarity_threshold": similarity_threshold,
-                    "related_threshold": related_thresh,
-                    "reference_set_amount": len(reference_sets),
-                    "source_set_amount": len(source_sets),
-                    "label": label,
-                    "elapsed_time": round(elapsed_time, 3),
-                    "inverted_index_time": round(in_index_elapsed_time, 3),
-                    "inverted_index_ram_usage": round(in_index_ram_usage, 3),
-                    "candidates_amount": candidates_amount,
-                    "candidates_amount_after_filtering": candidates_after,
-                }
-            else:
-                data_overall = {
-                    "similarity_threshold": similarity_threshold,
-                    "related_threshold": related_thresh,
-                    "source_set_amount": len(source_sets),
-                    "label": label,
-                    "elapsed_time": round(elapsed_time, 3),
-                    "inverted_index_time": round(in_index_elapsed_time, 3),
-                    "inverted_index_ram_usage": round(in_index_ram_usage, 3),
-                }
-
-            # Save results to a CSV file
-            save_experiment_results_to_csv(
-                results=data_overall,
-                file_name=f"{folder_path}{file_name_prefix}_experiment_results.csv"
-            )
-
-
-        elapsed_times_final.append(elapsed_times)
+    profiler = StageProfiler().start() if profile_memory else None
+    try:
+        if shared_engine is None:
+            shared_engine = build_engine(source_sets, sim_metric, sim_func, similarity_threshold, profiler=profiler)
+        else:
+            reset_engine(shared_engine[0], similarity_threshold)
+        silk_moth_engine, in_index_elapsed_time, in_index_ram_usage = shared_engine
+        # use dichotomy signature scheme for this experiment
+        silk_moth_engine.set_signature_type(SigType.DICHOTOMY)
+
+        with profile_engine(silk_moth_engine, profiler):
+            elapsed_times_final = []
+            for label in labels:
+
+                if label == "REDUCTION":
+                    silk_moth_engine.set_reduction(True)
+                elif label == "NO REDUCTION":
+                    silk_moth_engine.set_reduction(False)
+
+                elapsed_times = []
+                for idx, related_thresh in enumerate(related_thresholds):
+
+                    print(
+                        f"\nRunning SilkMoth {file_name_prefix} with α = {similarity_threshold}, θ = {related_thresh}, label = {label}")
+
+                    silk_moth_engine.set_related_threshold(related_thresh)
+                    if profiler is not None:
+                        profiler.reset()
+                    # Measure the time taken to search for related sets
+                    time_start = time.time()
+
+                    # Used for search to see how many candidates were found and how many were removed
+                    candidates_amount = 0
+                    candidates_after = 0
+                    if is_search:
+                        for ref_id, ref_set in enumerate(reference_sets):
+                            related_sets_temp, candidates_amount_temp, candidates_removed_temp = silk_moth_engine.search_sets(
+                                ref_set)
+                            candidates_amount += candidates_amount_temp
+                            candidates_after += candidates_removed_temp
+                    else:
+                        # If not searching, we are discovering sets
+                        silk_moth_engine.discover_sets(source_sets)
+
+                    time_end = time.time()
+                    elapsed_time = time_end - time_start
+
+                    elapsed_times.append(elapsed_time)
+
+                    # Create a new data dictionary for each iteration
+                    if is_search:
+                        data_overall = {
+                            "similarity_threshold": similarity_threshold,
+                            "related_threshold": related_thresh,
+                            "reference_set_amount": len(reference_sets),
+                            "source_set_amount": len(source_sets),
+                            "label": label,
+                            "elapsed_time": round(elapsed_time, 3),
+                            "inverted_index_time": round(in_index_elapsed_time, 3),
+                            "inverted_index_ram_usage": round(in_index_ram_usage, 3),
+                            "candidates_amount": candidates_amount,
+                            "candidates_amount_after_filtering": candidates_after,
+                        }
+                    else:
+                        data_overall = {
+                            "similarity_threshold": similarity_threshold,
+                            "related_threshold": related_thresh,
+                            "source_set_amount": len(source_sets),
+                            "label": label,
+                            "elapsed_time": round(elapsed_time, 3),
+                            "inverted_index_time": round(in_index_elapsed_time, 3),
+                            "inverted_index_ram_usage": round(in_index_ram_usage, 3),
+                        }
+                    if profiler is not None:
+                        data_overall.update(profiler.results())
+
+                    # Save results to a CSV file
+                    save_experiment_results_to_csv(
+                        results=data_overall,
+                        file_name=f"{folder_path}{file_name_prefix}_experiment_results.csv"
+                    )
+
+
+                elapsed_times_final.append(elapsed_times)
+    finally:
+        if profiler is not None:
+            profiler.stop()
     _ = plot_elapsed_times(
         related_thresholds=related_thresholds,
         elapsed_times_list=elapsed_times_final,
@@ -297,7 +432,7 @@ def run_reduction_experiment(related_thresholds, similarity_threshold, labels, s
 
 
 def run_scalability_experiment(related_thresholds, similarity_threshold, set_sizes, source_sets, reference_sets,
-                          sim_metric, sim_func, is_search, file_name_prefix, folder_path):
+                          sim_metric, sim_func, is_search, file_name_prefix, folder_path, profile_memory=False):
     """
     Parameters
     ----------
@@ -321,100 +456,99 @@ def run_scalability_experiment(related_thresholds, similarity_threshold, set_siz
         Prefix for naming output files generated during the experiment.
     folder_path: str
         Path to the folder where results will be saved.
+    profile_memory : bool
+        Record time, peak RSS, tracemalloc peak and top allocation sites of every pipeline stage
+        in the result CSV (see profiling.StageProfiler). Slows down the runs.
     """
-    elapsed_times_final = []
-    for idx, related_thresh in enumerate(related_thresholds):
-        elapsed_times = []
-        for size in set_sizes:
-            in_index_time_start = time.time()
-            initial_ram = measure_ram_usage()
-
-            # Initialize and run the SilkMothEngine
-            silk_moth_engine = SilkMothEngine(
-                related_thresh=0,
-                source_sets=source_sets[:size],
-                sim_metric=sim_metric,
-                sim_func=sim_func,
-                sim_thresh=similarity_threshold,
-                is_check_filter=True,
-                is_nn_filter=True,
-            )
-            in_index_time_end = time.time()
-            final_ram = measure_ram_usage()
-
-            in_index_elapsed_time = in_index_time_end - in_index_time_start
-            in_index_ram_usage = final_ram - initial_ram
-
-            print(f"Inverted Index created in {in_index_elapsed_time:.2f} seconds.")
-
-
-            print(
-                f"\nRunning SilkMoth {file_name_prefix} with α = {similarity_threshold}, θ = {related_thresh}, set_size = {size}")
-
-            silk_moth_engine.set_related_threshold(related_thresh)
-            # Measure the time taken to search for related sets
-            time_start = time.time()
-
-            if sim_func == edit_similarity:
-                # calc the maximum possible q-gram size based on sim_thresh
-                upper_bound_q = similarity_threshold / (1 - similarity_threshold)
-                q = floor(upper_bound_q)
-
-                print(f"Using q = {q} for edit similarity with sim_thresh = {similarity_threshold}")
-                print(f"Rebuilding Inverted Index with q = {q}...")
-                silk_moth_engine.set_q(q)
-
-            # Used for search to see how many candidates were found and how many were removed
-            candidates_amount = 0
-            candidates_after = 0
-            if is_search:
-                for ref_id, ref_set in enumerate(reference_sets):
-                    related_sets_temp, candidates_amount_temp, candidates_removed_temp = silk_moth_engine.search_sets(
-                        ref_set)
-                    candidates_amount += candidates_amount_temp
-                    candidates_after += candidates_removed_temp
-            else:
-                # If not searching, we are discovering sets
-                silk_moth_engine.discover_sets(source_sets[:size])
-
-            time_end = time.time()
-            elapsed_time = time_end - time_start
-
-            elapsed_times.append(elapsed_time)
-
-            # Create a new data dictionary for each iteration
-            if is_search:
-                data_overall = {
-                    "similarity_threshold": similarity_threshold,
-                    "related_threshold": related_thresh,
-                    "reference_set_amount": len(reference_sets),
-                    "source_set_amount": len(source_sets[:size]),
-                    "set_size": size,
-                    "elapsed_time": round(elapsed_time, 3),
-                    "inverted_index_time": round(in_index_elapsed_time, 3),
-                    "inverted_index_ram_usage": round(in_index_ram_usage, 3),
-                    "candidates_amount": candidates_amount,
-                    "candidates_amount_after_filtering": candidates_after,
-                }
-            else:
-                data_overall = {
-                    "similarity_threshold": similarity_threshold,
-                    "related_threshold": related_thresh,
-                    "source_set_amount": len(source_sets[:size]),
-                    "set_size": size,
-                    "elapsed_time": round(elapsed_time, 3),
-                    "inverted_index_time": round(in_index_elapsed_time, 3),
-                    "inverted_index_ram_usage": round(in_index_ram_usage, 3),
-                }
-
-            # Save results to a CSV file
-            save_experiment_results_to_csv(
-                results=data_overall,
-                file_name=f"{folder_path}{file_name_prefix}_experiment_results.csv"
-            )
-        del silk_moth_engine
-
-        elapsed_times_final.append(elapsed_times)
+    profiler = StageProfiler().start() if profile_memory else None
+    try:
+        elapsed_times_final = []
+        for idx, related_thresh in enumerate(related_thresholds):
+            elapsed_times = []
+            for size in set_sizes:
+                if profiler is not None:
+                    profiler.reset(keep=())
+
+                # Initialize and run the SilkMothEngine
+                silk_moth_engine, in_index_elapsed_time, in_index_ram_usage = build_engine(
+                    source_sets[:size], sim_metric, sim_func, similarity_threshold, profiler=profiler
+                )
+                with profile_engine(silk_moth_engine, profiler):
+                    silk_moth_engine.set_check_filter(True)
+                    silk_moth_engine.set_nn_filter(True)
+
+                    print(
+                        f"\nRunning SilkMoth {file_name_prefix} with α = {similarity_threshold}, θ = {related_thresh}, set_size = {size}")
+
+                    silk_moth_engine.set_related_threshold(related_thresh)
+                    # Measure the time taken to search for related sets
+                    time_start = time.time()
+
+                    if sim_func == edit_similarity:
+                        # calc the maximum possible q-gram size based on sim_thresh
+                        upper_bound_q = similarity_threshold / (1 - similarity_threshold)
+                        q = floor(upper_bound_q)
+
+                        print(f"Using q = {q} for edit similarity with sim_thresh = {similarity_threshold}")
+                        print(f"Rebuilding Inverted Index with q = {q}...")
+                        silk_moth_engine.set_q(q)
+
+                    # Used for search to see how many candidates were found and how many were removed
+                    candidates_amount = 0
+                    candidates_after = 0
+                    if is_search:
+                        for ref_id, ref_set in enumerate(reference_sets):
+                            related_sets_temp, candidates_amount_temp, candidates_removed_temp = silk_moth_engine.search_sets(
+                                ref_set)
+                            candidates_amount += candidates_amount_temp
+                            candidates_after += candidates_removed_temp
+                    else:
+                        # If not searching, we are discovering sets
+                        silk_moth_engine.discover_sets(source_sets[:size])
+
+                    time_end = time.time()
+                    elapsed_time = time_end - time_start
+
+                    elapsed_times.append(elapsed_time)
+
+                    # Create a new data dictionary for each iteration
+                    if is_search:
+                        data_overall = {
+                            "similarity_threshold": similarity_threshold,
+                            "related_threshold": related_thresh,
+                            "reference_set_amount": len(reference_sets),
+                            "source_set_amount": len(source_sets[:size]),
+                            "set_size": size,
+                            "elapsed_time": round(elapsed_time, 3),
+                            "inverted_index_time": round(in_index_elapsed_time, 3),
+                            "inverted_index_ram_usage": round(in_index_ram_usage, 3),
+                            "candidates_amount": candidates_amount,
+                            "candidates_amount_after_filtering": candidates_after,
+                        }
+                    else:
+                        data_overall = {
+                            "similarity_threshold": similarity_threshold,
+                            "related_threshold": related_thresh,
+                            "source_set_amount": len(source_sets[:size]),
+                            "set_size": size,
+                            "elapsed_time": round(elapsed_time, 3),
+                            "inverted_index_time": round(in_index_elapsed_time, 3),
+                            "inverted_index_ram_usage": round(in_index_ram_usage, 3),
+                        }
+                    if profiler is not None:
+                        data_overall.update(profiler.results())
+
+                    # Save results to a CSV file
+                    save_experiment_results_to_csv(
+                        results=data_overall,
+                        file_name=f"{folder_path}{file_name_prefix}_experiment_results.csv"
+                    )
+            del silk_moth_engine
+
+            elapsed_times_final.append(elapsed_times)
+    finally:
+        if profiler is not None:
+            profiler.stop()
 
     # create legend labels based on set sizes
     adjusted_legend_labels = [f"θ = {rt}" for rt in related_thresholds]
@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import psutil
+
+MB = 1024 * 1024
+
+# Allocations of the profiling itself are not reported as top sites
+_SITE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "*/linecache.py"),
+    tracemalloc.Filter(False, "*/threading.py"),
+    tracemalloc.Filter(False, "*/psutil/*"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+# Stages of the SilkMoth pipeline, they always get columns so the CSV rows line up
+PIPELINE_STAGES = ("index", "signature", "candidates", "filters", "verify")
+
+
+class PeakMemorySampler:
+    """
+    Samples the RSS of the current process in a background thread and keeps its peak.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start = self.peak = self.process.memory_info().rss
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    @property
+    def peak_mb(self):
+        return self.peak / MB
+
+    @property
+    def peak_increase_mb(self):
+        """
+        Peak RSS above the RSS at the start in MB. Unlike the RSS difference before and
+        after, this includes transient allocations that are freed again.
+        """
+        return (self.peak - self.start) / MB
+
+
+class StageProfiler:
+    """
+    Records time, peak RSS and tracemalloc peak of the pipeline stages (index build,
+    signature, candidates, filters, verify) over many calls.
+
+    For every stage it keeps
+
+    - the number of calls and the total time,
+    - the peak RSS increase over the RSS at the start of a call (max over all calls),
+      sampled by a background thread and at the start and end of every call,
+    - the tracemalloc peak of a call (max over all calls), i.e. the largest amount of
+      memory allocated at once,
+    - the top allocation sites (net allocated size by line) of the first
+      `snapshot_calls` calls, since snapshots are too expensive for every query.
+
+    Stages must not be nested. tracemalloc slows Python allocations down, so timings
+    taken while allocations are traced are not comparable with unprofiled runs.
+    """
+
+    def __init__(self, trace_allocations=True, top_n=3, snapshot_calls=1, interval=0.01):
+        self.trace_allocations = trace_allocations
+        self.top_n = top_n
+        self.snapshot_calls = snapshot_calls
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+        self.stats = {}
+        self._current_peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_tracing = False
+
+    def start(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._current_peak = max(self._current_peak, self.process.memory_info().rss)
+
+    def reset(self, keep=("index",)):
+        """
+        Drops the statistics of all stages except the ones in keep, e.g. before the next
+        threshold of an experiment.
+        """
+        self.stats = {stage: stats for stage, stats in self.stats.items() if stage in keep}
+
+    @contextmanager
+    def stage(self, name):
+        stats = self.stats.setdefault(name, {
+            "calls": 0, "time": 0.0, "peak_rss": 0.0, "alloc_peak": 0.0, "top_sites": []
+        })
+        tracing = tracemalloc.is_tracing()
+        snapshot = tracing and stats["calls"] < self.snapshot_calls
+        if tracing:
+            tracemalloc.reset_peak()
+            alloc_start = tracemalloc.get_traced_memory()[0]
+            start_snapshot = tracemalloc.take_snapshot().filter_traces(_SITE_FILTERS) if snapshot else None
+        rss_start = self.process.memory_info().rss
+        self._current_peak = rss_start
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - time_start
+            rss_peak = max(self._current_peak, self.process.memory_info().rss)
+            stats["calls"] += 1
+            stats["time"] += elapsed
+            stats["peak_rss"] = max(stats["peak_rss"], (rss_peak - rss_start) / MB)
+            if tracing:
+                alloc_peak = tracemalloc.get_traced_memory()[1] - alloc_start
+                stats["alloc_peak"] = max(stats["alloc_peak"], alloc_peak / MB)
+            if snapshot:
+                end_snapshot = tracemalloc.take_snapshot().filter_traces(_SITE_FILTERS)
+                diff = end_snapshot.compare_to(start_snapshot, "lineno")
+                sites = [d for d in diff if d.size_diff > 0][:self.top_n]
+                stats["top_sites"] = [
+                    (f"{os.path.basename(d.traceback[0].filename)}:{d.traceback[0].lineno}", d.size_diff / MB)
+                    for d in sites
+                ]
+
+    def wrap(self, name, func):
+        """
+        Wraps a function so that every call is profiled as the given stage.
+        """
+        def profiled(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return profiled
+
+    def results(self) -> dict:
+        """
+        Flat statistics of all stages for the experiment CSVs. Memory values are in MB.
+        """
+        results = {}
+        empty = {"time": 0.0, "peak_rss": 0.0, "alloc_peak": 0.0, "top_sites": []}
+        stages = list(PIPELINE_STAGES) + [name for name in self.stats if name not in PIPELINE_STAGES]
+        for name in stages:
+            stats = self.stats.get(name, empty)
+            results[f"{name}_time"] = round(stats["time"], 3)
+            results[f"{name}_peak_rss"] = round(stats["peak_rss"], 3)
+            results[f"{name}_alloc_peak"] = round(stats["alloc_peak"], 3)
+            results[f"{name}_top_sites"] = "; ".join(f"{site} ({size:.3f})" for site, size in stats["top_sites"])
+        return results
+
+
+# Public methods of the engine components that are profiled as stages
+_STAGES = {
+    "signature_gen": {"get_signature": "signature"},
+    "candidate_selector": {"get_candidates": "candidates"},
+    "verifier": {"get_related_sets": "verify"},
+}
+
+# Public engine methods that start a query, the current components are wrapped before each
+_ENTRY_POINTS = ("search_sets", "search_sets_multi", "search_with_signature")
+
+
+@contextmanager
+def profile_engine(engine, profiler):
+    """
+    Profiles the pipeline stages of a SilkMothEngine with the given profiler inside the
+    context, None profiles nothing.
+
+    The public stage methods of the engine's components (signature generator, candidate
+    selector, filters of the filter chain, verifier) are wrapped on the instances, also of
+    components the engine's setters create later, and all wrappers are removed on exit,
+    even if the experiment fails. Stages must not overlap, so profiling needs the
+    verification in the calling thread (verify_workers=1).
+    """
+    if profiler is None:
+        yield
+        return
+    if getattr(engine, "verify_workers", 1) > 1:
+        raise ValueError("Profiling needs verify_workers=1, the stages of verification threads would overlap")
+
+    wrapped = []
+
+    def wrap(component, method, stage):
+        # instance attributes are wrappers of this context
+        if method not in vars(component):
+            setattr(component, method, profiler.wrap(stage, getattr(component, method)))
+            wrapped.append((component, method))
+
+    def wrap_components():
+        for attribute, methods in _STAGES.items():
+            for method, stage in methods.items():
+                wrap(getattr(engine, attribute), method, stage)
+        for candidate_filter in engine.filter_chain.filters:
+            wrap(candidate_filter, "apply", "filters")
+
+    def entry_point(func):
+        def profiled(*args, **kwargs):
+            wrap_components()
+            return func(*args, **kwargs)
+        return profiled
+
+    try:
+        for method in _ENTRY_POINTS:
+            setattr(engine, method, entry_point(getattr(engine, method)))
+            wrapped.append((engine, method))
+        yield
+    finally:
+        for component, method in wrapped:
+            delattr(component, method)
@@ -0,0 +1,324 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from experiments import run_experiment_filter_schemes, run_reduction_experiment, run_scalability_experiment
+from src.silkmoth.silkmoth_engine import SilkMothEngine
+from src.silkmoth.utils import jaccard_similarity, contain, similar, SigType, edit_similarity
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "regression_baseline.json")
+
+# Relative and absolute tolerances, a metric fails if it is worse (higher) than
+# baseline * (1 + relative) + absolute. Times are relative to the calibration
+# workload (see calibrate), so the baseline can be checked on other machines.
+# Candidate counts are deterministic, fewer candidates pass. Exact metrics fail on
+# any change, a different number of related sets means the results changed. The
+# index memory is the tracemalloc peak of the index build in MB, which only varies
+# slightly between runs.
+DEFAULT_TOLERANCES = {
+    "relative_time": {"relative": 0.5, "absolute": 0.5},
+    "candidates_amount": {"relative": 0.0, "absolute": 0},
+    "candidates_amount_after_filtering": {"relative": 0.0, "absolute": 0},
+    "related_sets_found": {"relative": 0.0, "absolute": 0, "exact": True},
+    "index_alloc_peak": {"relative": 0.1, "absolute": 0.1},
+}
+
+# Metric taken from the profiled run instead of the timed runs
+MEMORY_METRIC = "index_alloc_peak"
+
+# Time metric, the elapsed_time of a run divided by the calibration time
+TIME_METRIC = "relative_time"
+
+# Columns of the experiment CSVs that identify a run
+KEY_COLUMNS = ["label", "similarity_threshold", "related_threshold", "set_size"]
+
+
+def _vocabulary(rng, size):
+    return [f"{''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(3, 8)))}{i}" for i in range(size)]
+
+
+def make_set_collection(seed, num_sets, vocabulary_size=1_500, elements=(2, 8), words=(1, 4)):
+    """
+    Seeded synthetic sets of multi-word elements with a skewed (Zipf-like) word
+    distribution, similar to webtable columns and schemas.
+    """
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng, vocabulary_size)
+    weights = [1 / (i + 1) for i in range(vocabulary_size)]
+    return [
+        [" ".join(rng.choices(vocabulary, weights, k=rng.randint(*words))) for _ in range(rng.randint(*elements))]
+        for _ in range(num_sets)
+    ]
+
+
+def make_reference_sets(seed, source_sets, num_sets):
+    """
+    Reference sets derived from source sets by dropping and replacing some elements.
+    """
+    rng = random.Random(seed)
+    reference_sets = []
+    for source_set in rng.sample(source_sets, num_sets):
+        reference_set = [e for e in source_set if rng.random() > 0.2] or source_set[:1]
+        if rng.random() < 0.5:
+            reference_set[rng.randrange(len(reference_set))] = rng.choice(rng.choice(source_sets))
+        reference_sets.append(reference_set)
+    return reference_sets
+
+
+def make_titles(seed, num_sets):
+    """
+    Seeded synthetic "titles" as sets of words for the string matching experiments.
+    """
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng, 800)
+    weights = [1 / (i + 1) ** 0.8 for i in range(len(vocabulary))]
+    return [rng.choices(vocabulary, weights, k=rng.randint(4, 10)) for _ in range(num_sets)]
+
+
+def make_scenarios(seed=0):
+    """
+    The fixed subset of experiments that is compared with the baselines.
+    """
+    sets = make_set_collection(seed, 2_000)
+    references = make_reference_sets(seed + 1, sets, 30)
+    titles = make_titles(seed + 2, 400)
+    thresholds = [0.7, 0.8]
+    labels_filter = ["NO FILTER", "CHECK FILTER", "NN FILTER"]
+    labels_sig = [SigType.WEIGHTED, SigType.SKYLINE, SigType.DICHOTOMY]
+
+    return {
+        "inclusion_filter": (run_experiment_filter_schemes, [
+            thresholds, [0.0, 0.5], labels_filter, sets, references, contain, jaccard_similarity, True
+        ]),
+        "inclusion_sig": (run_experiment_filter_schemes, [
+            thresholds, [0.5], labels_sig, sets, references, contain, jaccard_similarity, True
+        ]),
+        "schema_filter": (run_experiment_filter_schemes, [
+            thresholds, [0.0], labels_filter, sets[:500], None, similar, jaccard_similarity, False
+        ]),
+        "string_filter": (run_experiment_filter_schemes, [
+            thresholds, [0.8], labels_filter, titles, titles[:20], similar, edit_similarity, True
+        ]),
+        "inclusion_reduction": (run_reduction_experiment, [
+            thresholds, 0.0, ["REDUCTION", "NO REDUCTION"], sets, references, contain, jaccard_similarity, True
+        ]),
+        "inclusion_scalability": (run_scalability_experiment, [
+            thresholds, 0.5, [500, 1_000, 2_000], sets, references, contain, jaccard_similarity, True
+        ]),
+    }
+
+
+def calibrate(seed=0, repeats=5):
+    """
+    Times a fixed small workload (index build and searches with both filters) on
+    this machine. The experiment times are stored as multiples of it, so they can
+    be compared with a baseline recorded on a faster or slower machine.
+
+    Returns
+    -------
+    float
+        Best time of the workload in seconds.
+    """
+    sets = make_set_collection(seed + 3, 2_000)
+    references = make_reference_sets(seed + 4, sets, 50)
+    best = float("inf")
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        engine = SilkMothEngine(0.7, sets, contain, jaccard_similarity, is_check_filter=True, is_nn_filter=True)
+        for reference_set in references:
+            engine.search_sets(reference_set)
+        best = min(best, time.perf_counter() - time_start)
+    return best
+
+
+def _run_key(name, row):
+    parts = [name]
+    for column in KEY_COLUMNS:
+        if column in row and not pd.isna(row[column]):
+            parts.append(f"{column}={row[column]}")
+    return "|".join(parts)
+
+
+def run_scenarios(seed=0, repeats=3, only=None, calibration=None):
+    """
+    Runs all scenarios and collects their metrics. Times are the minimum over the
+    repeats to reduce noise, divided by the calibration time. The index memory is
+    the tracemalloc peak of the index build (see profiling.StageProfiler) in one
+    extra profiled run. Unlike the RSS increase, it doesn't depend on memory the
+    process already holds from earlier scenarios or repeats, and the allocation
+    tracing doesn't slow down the timed runs.
+
+    Parameters
+    ----------
+    calibration : float, optional
+        Time of the calibration workload in seconds, measured if not given.
+
+    Returns
+    -------
+    dict
+        Run key to metrics.
+    """
+    if calibration is None:
+        calibration = calibrate(seed)
+    results = {}
+    for name, (method, args) in make_scenarios(seed).items():
+        if only and name not in only:
+            continue
+        print(f"[regression] {name}")
+        rows = _run_scenario(name, method, args, repeats)
+        profiled_rows = _run_scenario(name, method, args, 1, profile_memory=True)
+
+        for _, row in rows.iterrows():
+            key = _run_key(name, row)
+            metrics = {
+                m: float(row[m]) for m in DEFAULT_TOLERANCES
+                if m != MEMORY_METRIC and m in row and not pd.isna(row[m])
+            }
+            if "elapsed_time" in row and not pd.isna(row["elapsed_time"]):
+                metrics[TIME_METRIC] = round(float(row["elapsed_time"]) / calibration, 3)
+            if key in results:
+                for metric, value in metrics.items():
+                    results[key][metric] = min(results[key][metric], value)
+            else:
+                results[key] = metrics
+        for _, row in profiled_rows.iterrows():
+            key = _run_key(name, row)
+            if key in results and MEMORY_METRIC in row:
+                results[key][MEMORY_METRIC] = float(row[MEMORY_METRIC])
+    return results
+
+
+def _run_scenario(name, method, args, repeats, **kwargs):
+    with tempfile.TemporaryDirectory() as folder:
+        for _ in range(repeats):
+            # the experiments print every run
+            with contextlib.redirect_stdout(io.StringIO()):
+                method(*args, name, folder + os.sep, **kwargs)
+            plt.close("all")
+        return pd.read_csv(os.path.join(folder, f"{name}_experiment_results.csv"))
+
+
+def compare(baseline, current, tolerances):
+    """
+    Compares the current metrics with the baseline.
+
+    Returns
+    -------
+    list[dict]
+        One row per run and metric with the status "pass", "fail", "new" or "missing".
+    """
+    report = []
+    for key in sorted(set(baseline) | set(current)):
+        if key not in current:
+            report.append({"run": key, "metric": "", "baseline": None, "current": None, "limit": None, "status": "missing"})
+            continue
+        if key not in baseline:
+            report.append({"run": key, "metric": "", "baseline": None, "current": None, "limit": None, "status": "new"})
+            continue
+        for metric, value in current[key].items():
+            if metric not in baseline[key]:
+                continue
+            base = baseline[key][metric]
+            tolerance = tolerances.get(metric, {"relative": 0.0, "absolute": 0})
+            limit = base * (1 + tolerance["relative"]) + tolerance["absolute"]
+            passed = value == base if tolerance.get("exact") else value <= limit
+            report.append({
+                "run": key, "metric": metric, "baseline": base, "current": value, "limit": round(limit, 3),
+                "status": "pass" if passed else "fail",
+            })
+    return report
+
+
+def plot_diffs(baseline, current, folder):
+    """
+    Plots baseline and current value of every metric per scenario.
+    """
+    scenarios = sorted({key.split("|")[0] for key in current})
+    for scenario in scenarios:
+        keys = [key for key in sorted(current) if key.split("|")[0] == scenario and key in baseline]
+        if not keys:
+            continue
+        metrics = [m for m in DEFAULT_TOLERANCES if any(m in current[k] for k in keys)]
+        fig, axes = plt.subplots(len(metrics), 1, figsize=(max(8, len(keys) * 0.6), 2.5 * len(metrics) + 2),
+                                 sharex=True, squeeze=False)
+        x = range(len(keys))
+        for ax, metric in zip(axes[:, 0], metrics):
+            ax.bar([i - 0.2 for i in x], [baseline[k].get(metric, 0) for k in keys], width=0.4, label="baseline")
+            ax.bar([i + 0.2 for i in x], [current[k].get(metric, 0) for k in keys], width=0.4, label="current")
+            ax.set_ylabel(metric, fontsize=8)
+            ax.set_xticks(list(x))
+            ax.set_xticklabels([k.split("|", 1)[1] if "|" in k else k for k in keys], rotation=90, fontsize=6)
+            ax.grid(True, axis="y")
+        axes[0, 0].legend(fontsize=8)
+        axes[0, 0].set_title(scenario)
+        fig.savefig(os.path.join(folder, f"regression_{scenario}.png"), dpi=150, bbox_inches="tight")
+        plt.close(fig)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare a run of fixed experiments with the recorded baselines.")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline JSON file")
+    parser.add_argument("--update", action="store_true", help="Record the current run as new baseline")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic datasets")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats per scenario, the best run is used")
+    parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+    parser.add_argument("--output", default="results/regression", help="Folder for the report and diff plots")
+    args = parser.parse_args(argv)
+
+    calibration = calibrate(args.seed)
+    print(f"[regression] calibration workload took {calibration:.3f} s")
+    current = run_scenarios(args.seed, args.repeats, args.only, calibration)
+
+    if args.update:
+        runs = current
+        if args.only and os.path.exists(args.baseline):
+            # keep the recorded runs of the other scenarios
+            with open(args.baseline, "r", encoding="utf-8") as file:
+                recorded = json.load(file)
+            if recorded.get("seed") == args.seed:
+                runs = {k: v for k, v in recorded["runs"].items() if k.split("|")[0] not in args.only}
+                runs.update(current)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"seed": args.seed, "calibration_time": round(calibration, 3), "tolerances": DEFAULT_TOLERANCES,
+                       "runs": runs}, file, indent=2)
+        print(f"[regression] baseline with {len(runs)} runs written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"[regression] no baseline found at {args.baseline}, record one with --update")
+        return 1
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        recorded = json.load(file)
+    if recorded.get("seed") != args.seed:
+        print(f"[regression] baseline was recorded with seed {recorded.get('seed')}, not {args.seed}")
+        return 1
+    baseline = recorded["runs"]
+    if args.only:
+        baseline = {k: v for k, v in baseline.items() if k.split("|")[0] in args.only}
+
+    report = compare(baseline, current, recorded.get("tolerances", DEFAULT_TOLERANCES))
+    os.makedirs(args.output, exist_ok=True)
+    report_df = pd.DataFrame(report)
+    report_df.to_csv(os.path.join(args.output, "regression_report.csv"), index=False)
+    plot_diffs(baseline, current, args.output)
+
+    failed = report_df[report_df["status"].isin(["fail", "missing"])]
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(failed if len(failed) else "[regression] all metrics within tolerance")
+    print(f"[regression] {len(report_df[report_df['status'] == 'pass'])} passed, {len(failed)} failed, "
+          f"report and plots in {args.output}")
+    return 1 if len(failed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,77 @@
 # Python
-import multiprocessing
 from experiments import run_experiment_filter_schemes, run_reduction_experiment, run_scalability_experiment, run_matching_without_silkmoth_inc_dep
 import os
 from data_loader import DataLoader
+from scheduler import ExperimentJob, run_jobs, SOURCE, REFERENCE
 from utils import load_sets_from_files
 from src.silkmoth.utils import jaccard_similarity, contain, similar, SigType, edit_similarity
 
+WEBTABLES_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), "../experiments/data/webtables"))
 
-def run_experiment_multi(experiment_method, *args):
-    experiment_method(*args)
 
-
-if __name__ == "__main__":
+# Dataset loaders, they run in the scheduler's worker processes and return (source_sets, reference_sets)
+def load_string_matching():
     data_loader = DataLoader("/")
+    data_path = os.path.join(os.path.dirname(__file__), "data", "dblp", "DBLP_100k.csv")
+    columnar_path = os.path.join(os.path.dirname(__file__), "data", "dblp", "DBLP_100k.sets")
+    if os.path.isdir(columnar_path):
+        # created by: python set_io.py data/dblp/DBLP_100k.csv data/dblp/DBLP_100k.sets --split
+        return data_loader.load_columnar_sets(columnar_path), None
+    source_sets = data_loader.load_dblp_titles(data_path)
+    return [title.split() for title in source_sets], None
+
+
+def load_inclusion_dependency():
+    reference_sets, source_sets = load_sets_from_files(
+        folder_path=WEBTABLES_PATH,
+        reference_file="reference_sets_inclusion_dependency.json",
+        source_file="source_sets_inclusion_dependency.json"
+    )
+    return source_sets, reference_sets
+
+
+def load_schema_matching():
+    _, source_sets = load_sets_from_files(
+        folder_path=WEBTABLES_PATH,
+        reference_file="webtable_schemas_sets_500k.json",
+        source_file="webtable_schemas_sets_500k.json"
+    )
+    return source_sets, None
+
+
+def load_github_schema_matching():
+    source_sets, _ = load_schema_matching()
+    _, github_source_sets = load_sets_from_files(
+        folder_path=WEBTABLES_PATH,
+        reference_file="github_webtable_schemas_sets_500k.json",
+        source_file="github_webtable_schemas_sets_500k.json"
+    )
+    return source_sets, github_source_sets
+
+
+# Files of every dataset, a columnar copy (".sets" directory) next to a file counts as well
+DATASET_FILES = {
+    "string_matching": [os.path.join(os.path.dirname(__file__), "data", "dblp", "DBLP_100k.csv")],
+    "inclusion_dependency": [os.path.join(WEBTABLES_PATH, "reference_sets_inclusion_dependency.json"),
+                             os.path.join(WEBTABLES_PATH, "source_sets_inclusion_dependency.json")],
+    "schema_matching": [os.path.join(WEBTABLES_PATH, "webtable_schemas_sets_500k.json")],
+    "github_schema_matching": [os.path.join(WEBTABLES_PATH, "webtable_schemas_sets_500k.json"),
+                               os.path.join(WEBTABLES_PATH, "github_webtable_schemas_sets_500k.json")],
+}
+
+
+def dataset_available(dataset):
+    return all(os.path.exists(path) or os.path.isdir(os.path.splitext(path)[0] + ".sets")
+               for path in DATASET_FILES[dataset[0]])
 
+
+STRING_MATCHING = ("string_matching", load_string_matching)
+INCLUSION_DEPENDENCY = ("inclusion_dependency", load_inclusion_dependency)
+SCHEMA_MATCHING = ("schema_matching", load_schema_matching)
+GITHUB_SCHEMA_MATCHING = ("github_schema_matching", load_github_schema_matching)
+
+
+if __name__ == "__main__":
     # Labels for Filter Experiments
     labels_filter = ["NO FILTER", "CHECK FILTER", "NN FILTER"]
 
@@ -23,39 +81,6 @@ if __name__ == "__main__":
     # Labels for Reduction
     labels_reduction = ["REDUCTION", "NO REDUCTION"]
 
-    # Load the datasets for Experiments
-    data_path = os.path.join(os.path.dirname(__file__), "data", "dblp", "DBLP_100k.csv")
-    source_string_matching = data_loader.load_dblp_titles(data_path)
-    source_string_matching = [title.split() for title in source_string_matching]
-
-    try:
-        folder_path = os.path.join(os.path.dirname(__file__), "../experiments/data/webtables")
-        folder_path = os.path.normpath(folder_path)
-        reference_sets_in_dep, source_sets_in_dep = load_sets_from_files(
-            folder_path=folder_path,
-            reference_file="reference_sets_inclusion_dependency.json",
-            source_file="source_sets_inclusion_dependency.json"
-        )
-
-        reference_sets_schema_matching, source_sets_schema_matching = load_sets_from_files(
-            folder_path=folder_path,
-            reference_file="webtable_schemas_sets_500k.json",
-            source_file="webtable_schemas_sets_500k.json"
-        )
-        del reference_sets_schema_matching
-
-        _, github_source_sets_schema_matching = load_sets_from_files(
-            folder_path=folder_path,
-            reference_file="github_webtable_schemas_sets_500k.json",
-            source_file="github_webtable_schemas_sets_500k.json"
-        )
-
-    except FileNotFoundError:
-        print("Datasets not found. Skipping Experiments.")
-        reference_sets_in_dep, source_sets_in_dep, reference_sets_in_dep_reduction = [], [], []
-        source_sets_schema_matching = []
-        github_source_sets_schema_matching = []
-
     # Experiment configuration
     experiment_config = {
         "filter_runs": False,
@@ -66,111 +91,128 @@ if __name__ == "__main__":
         "inc_dep_without_silkmoth": True
     }
 
-    # Define experiments to run
+    # Resource budgets of the scheduler, None uses all cores and 80 % of the available memory
+    cpu_budget = None
+    memory_budget = None
+
+    # Shared engines, experiments with the same dataset subset and config reuse one index
+    string_engine = {"sim_metric": similar, "sim_func": edit_similarity, "index_cache_budget": 2048}
+    schema_engine = {"sim_metric": similar, "sim_func": jaccard_similarity}
+    in_dep_engine = {"sim_metric": contain, "sim_func": jaccard_similarity}
+
+    # Define experiments to run, cost is a rough relative runtime and memory the peak in MB
     experiments = []
 
     if experiment_config["filter_runs"]:
         # Filter runs
         # String Matching Experiment
-        experiments.append((
-            run_experiment_filter_schemes, [0.7, 0.75, 0.8, 0.85], [0.7, 0.75, 0.8, 0.85],
-            labels_filter, source_string_matching[:10_000], None, similar, edit_similarity , False,
-            "string_matching_filter", "results/string_matching/"
+        experiments.append(ExperimentJob(
+            "string_matching_filter", run_experiment_filter_schemes, [
+                [0.7, 0.75, 0.8, 0.85], [0.7, 0.75, 0.8, 0.85], labels_filter, SOURCE[:10_000], None,
+                similar, edit_similarity, False, "string_matching_filter", "results/string_matching/"
+            ], STRING_MATCHING, string_engine, cost=30, memory=2_000
         ))
 
         # Schema Matching Experiment
-        experiments.append((
-            run_experiment_filter_schemes, [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75],
-            labels_filter, source_sets_schema_matching[:60_000], None, similar, jaccard_similarity, False,
-            "schema_matching_filter", "results/schema_matching/"
+        experiments.append(ExperimentJob(
+            "schema_matching_filter", run_experiment_filter_schemes, [
+                [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75], labels_filter, SOURCE[:60_000], None,
+                similar, jaccard_similarity, False, "schema_matching_filter", "results/schema_matching/"
+            ], SCHEMA_MATCHING, schema_engine, cost=40, memory=4_000
         ))
 
         # Inclusion Dependency Experiment
-        experiments.append((
-            run_experiment_filter_schemes, [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75],
-            labels_filter, source_sets_in_dep, reference_sets_in_dep[:200], contain, jaccard_similarity, True,
-            "inclusion_dependency_filter", "results/inclusion_dependency/"
+        experiments.append(ExperimentJob(
+            "inclusion_dependency_filter", run_experiment_filter_schemes, [
+                [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75], labels_filter, SOURCE, REFERENCE[:200],
+                contain, jaccard_similarity, True, "inclusion_dependency_filter", "results/inclusion_dependency/"
+            ], INCLUSION_DEPENDENCY, in_dep_engine, cost=20, memory=8_000
         ))
 
-
-
     if experiment_config["signature_scheme_runs"]:
         # Signature Scheme Runs
         #String Matching Experiment
-        experiments.append((
-            run_experiment_filter_schemes, [0.7, 0.75, 0.8, 0.85], [0.7, 0.75, 0.8, 0.85],
-            labels_sig_schemes, source_string_matching[:10_000], None, similar, edit_similarity , False,
-            "string_matching_sig", "results/string_matching/"
+        experiments.append(ExperimentJob(
+            "string_matching_sig", run_experiment_filter_schemes, [
+                [0.7, 0.75, 0.8, 0.85], [0.7, 0.75, 0.8, 0.85], labels_sig_schemes, SOURCE[:10_000], None,
+                similar, edit_similarity, False, "string_matching_sig", "results/string_matching/"
+            ], STRING_MATCHING, string_engine, cost=30, memory=2_000
         ))
 
         # Schema Matching Experiment
-        experiments.append((
-            run_experiment_filter_schemes, [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75],
-            labels_sig_schemes, source_sets_schema_matching[:60_000], None, similar, jaccard_similarity, False,
-            "schema_matching_sig", "results/schema_matching/"
+        experiments.append(ExperimentJob(
+            "schema_matching_sig", run_experiment_filter_schemes, [
+                [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75], labels_sig_schemes, SOURCE[:60_000], None,
+                similar, jaccard_similarity, False, "schema_matching_sig", "results/schema_matching/"
+            ], SCHEMA_MATCHING, schema_engine, cost=40, memory=4_000
         ))
 
         # Inclusion Dependency Experiment
-        experiments.append((
-            run_experiment_filter_schemes, [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75],
-            labels_sig_schemes, source_sets_in_dep, reference_sets_in_dep[:200], contain, jaccard_similarity, True,
-            "inclusion_dependency_sig", "results/inclusion_dependency/"
+        experiments.append(ExperimentJob(
+            "inclusion_dependency_sig", run_experiment_filter_schemes, [
+                [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75], labels_sig_schemes, SOURCE, REFERENCE[:200],
+                contain, jaccard_similarity, True, "inclusion_dependency_sig", "results/inclusion_dependency/"
+            ], INCLUSION_DEPENDENCY, in_dep_engine, cost=20, memory=8_000
         ))
 
-
     if experiment_config["reduction_runs"]:
         # Reduction Runs
-        experiments.append((
-            run_reduction_experiment, [0.7, 0.75, 0.8, 0.85], 0.0,
-            labels_reduction, source_sets_in_dep, reference_sets_in_dep[:200], contain, jaccard_similarity, True,
-            "inclusion_dependency_reduction", "results/inclusion_dependency/"
+        experiments.append(ExperimentJob(
+            "inclusion_dependency_reduction", run_reduction_experiment, [
+                [0.7, 0.75, 0.8, 0.85], 0.0, labels_reduction, SOURCE, REFERENCE[:200],
+                contain, jaccard_similarity, True, "inclusion_dependency_reduction", "results/inclusion_dependency/"
+            ], INCLUSION_DEPENDENCY, in_dep_engine, cost=10, memory=8_000
         ))
 
     if experiment_config["scalability_runs"]:
-        # Scalability Runs
+        # Scalability Runs, they build one index per size themselves
         # String Matching
-        experiments.append((
-            run_scalability_experiment, [0.7, 0.75, 0.8, 0.85], 0.7, [1_000, 10_000, 100_000],
-            source_string_matching[:100_000], None, similar, edit_similarity, False,
-            "string_matching_scalability", "results/string_matching/"
+        experiments.append(ExperimentJob(
+            "string_matching_scalability", run_scalability_experiment, [
+                [0.7, 0.75, 0.8, 0.85], 0.7, [1_000, 10_000, 100_000], SOURCE[:100_000], None,
+                similar, edit_similarity, False, "string_matching_scalability", "results/string_matching/"
+            ], STRING_MATCHING, cost=100, memory=6_000
         ))
 
         # Inclusion Dependency
-        experiments.append((
-            run_scalability_experiment, [0.7, 0.75, 0.8, 0.85], 0.5, [100_000, 200_000, 300_000, 400_000, 500_000],
-            source_sets_in_dep, reference_sets_in_dep[:200], contain, jaccard_similarity, True,
-            "inclusion_dependency_scalability", "results/inclusion_dependency/"
+        experiments.append(ExperimentJob(
+            "inclusion_dependency_scalability", run_scalability_experiment, [
+                [0.7, 0.75, 0.8, 0.85], 0.5, [100_000, 200_000, 300_000, 400_000, 500_000], SOURCE, REFERENCE[:200],
+                contain, jaccard_similarity, True, "inclusion_dependency_scalability", "results/inclusion_dependency/"
+            ], INCLUSION_DEPENDENCY, cost=60, memory=10_000
         ))
 
         # Schema Matching
-        experiments.append((
-            run_scalability_experiment, [0.7, 0.75, 0.8, 0.85], 0.0, [12_000, 24_000, 36_000, 48_000, 60_000],
-            source_sets_schema_matching[:60_000], None, similar, jaccard_similarity, False,
-            "schema_matching_scalability", "results/schema_matching/"
+        experiments.append(ExperimentJob(
+            "schema_matching_scalability", run_scalability_experiment, [
+                [0.7, 0.75, 0.8, 0.85], 0.0, [12_000, 24_000, 36_000, 48_000, 60_000], SOURCE[:60_000], None,
+                similar, jaccard_similarity, False, "schema_matching_scalability", "results/schema_matching/"
+            ], SCHEMA_MATCHING, cost=80, memory=4_000
         ))
 
     if experiment_config["schema_github_webtable_runs"]:
         # Schema Matching with GitHub Webtable Schemas
-        experiments.append((
-            run_experiment_filter_schemes, [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75],
-            labels_filter, source_sets_schema_matching[:10_000], github_source_sets_schema_matching[:10_000], similar, jaccard_similarity, True,
-            "github_webtable_schema_matching", "results/schema_matching/"
+        experiments.append(ExperimentJob(
+            "github_webtable_schema_matching", run_experiment_filter_schemes, [
+                [0.7, 0.75, 0.8, 0.85], [0.0, 0.25, 0.5, 0.75], labels_filter, SOURCE[:10_000], REFERENCE[:10_000],
+                similar, jaccard_similarity, True, "github_webtable_schema_matching", "results/schema_matching/"
+            ], GITHUB_SCHEMA_MATCHING, schema_engine, cost=20, memory=3_000
         ))
 
     if experiment_config["inc_dep_without_silkmoth"]:
-        experiments.append((
-            run_matching_without_silkmoth_inc_dep, source_sets_in_dep[:500_000], reference_sets_in_dep[:200], [0.7, 0.75, 0.8, 0.85], 0.5, contain, jaccard_similarity,
-            "raw_matching", "results/inclusion_dependency/"
+        experiments.append(ExperimentJob(
+            "raw_matching", run_matching_without_silkmoth_inc_dep, [
+                SOURCE[:500_000], REFERENCE[:200], [0.7, 0.75, 0.8, 0.85], 0.5, contain, jaccard_similarity,
+                "raw_matching", "results/inclusion_dependency/"
+            ], INCLUSION_DEPENDENCY, cost=200, memory=8_000
         ))
 
-    # Create and start processes for each experiment
-    processes = []
-    for experiment in experiments:
-        method, *args = experiment
-        process = multiprocessing.Process(target=run_experiment_multi, args=(method, *args))
-        processes.append(process)
-        process.start()
-
-    # Wait for all processes to complete
-    for process in processes:
-        process.join()
+    # skip the experiments on datasets that are not downloaded instead of failing them
+    available = []
+    for job in experiments:
+        if dataset_available(job.dataset):
+            available.append(job)
+        else:
+            print(f"Dataset {job.dataset[0]} not found. Skipping {job.name}.")
+
+    run_jobs(available, cpu_budget=cpu_budget, memory_budget=memory_budget)
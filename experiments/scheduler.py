@@ -0,0 +1,256 @@
+import multiprocessing
+import os
+import queue
+import time
+from collections import defaultdict
+
+import psutil
+
+from profiling import PeakMemorySampler
+from utils import save_experiment_results_to_csv
+
+
+class Placeholder:
+    """
+    Stands for the source or reference sets of a job's dataset in its arguments.
+    The sets are only loaded in the worker process that runs the job.
+    """
+
+    def __init__(self, name, subset=None):
+        self.name = name
+        self.subset = subset
+
+    def __getitem__(self, subset):
+        return Placeholder(self.name, subset)
+
+    def resolve(self, source_sets, reference_sets):
+        sets = source_sets if self.name == "source" else reference_sets
+        if sets is None:
+            return None
+        return sets if self.subset is None else sets[self.subset]
+
+
+# e.g. SOURCE[:10_000] in the arguments of a job
+SOURCE = Placeholder("source")
+REFERENCE = Placeholder("reference")
+
+
+class ExperimentJob:
+    """
+    One experiment run by the scheduler.
+
+    Jobs on the same dataset run in one worker process, which loads the dataset once and
+    slices the source subsets of the jobs from it. Jobs with the same source subset and engine
+    configuration share one SilkMothEngine, which is passed to the experiment method as
+    shared_engine. Jobs on other datasets run in parallel processes within the budgets.
+    """
+
+    def __init__(self, name, method, args, dataset, engine_config=None, cost=1.0, memory=1024.0, cpus=1):
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the job in the log.
+        method : callable
+            Experiment method, e.g. run_experiment_filter_schemes.
+        args : list
+            Arguments of the method, SOURCE/REFERENCE placeholders are replaced by the sets.
+        dataset : tuple
+            Name of the dataset and a (module level) loader returning (source_sets, reference_sets).
+        engine_config : dict, optional
+            Arguments of build_engine for a shared engine (including q, if not the default),
+            None if the method builds its own.
+        cost : float
+            Estimated runtime, expensive jobs are started first.
+        memory : float
+            Estimated peak memory in MB including dataset and index.
+        cpus : int
+            Number of cores the job uses.
+        """
+        self.name = name
+        self.method = method
+        self.args = args
+        self.dataset = dataset
+        self.engine_config = engine_config
+        self.cost = cost
+        self.memory = memory
+        self.cpus = cpus
+
+    def group_key(self):
+        """
+        Jobs with the same key run in one worker process, which loads their dataset once.
+        """
+        return self.dataset[0]
+
+    def engine_key(self):
+        """
+        Jobs of a worker with the same key share one engine, None for jobs that build their own.
+        """
+        if self.engine_config is None:
+            return None
+        source = next((a for a in self.args if isinstance(a, Placeholder) and a.name == "source"), SOURCE)
+        subset = source.subset
+        if isinstance(subset, slice):
+            subset = (subset.start, subset.stop, subset.step)
+        return subset, tuple(sorted(self.engine_config.items(), key=lambda item: item[0]))
+
+
+def _run_group(dataset, jobs, reports):
+    """
+    Worker process: loads the dataset once and runs its jobs one after another. Jobs with
+    the same engine key run back to back, so every engine is built once and released before
+    the next one is built (see ExperimentJob.engine_key).
+    """
+    from experiments import build_engine
+
+    name, loader = dataset
+    try:
+        source_sets, reference_sets = loader()
+    except Exception as e:
+        for job in jobs:
+            reports.put({"job": job.name, "dataset": name, "status": f"failed: {e!r}",
+                         "elapsed_time": 0, "peak_ram_usage": 0, "estimated_ram_usage": job.memory})
+        return
+    engine_key, shared_engine = None, None
+
+    # in the order of the first (most expensive) job of every engine
+    engine_order = {}
+    for job in jobs:
+        engine_order.setdefault(job.engine_key(), len(engine_order))
+    jobs = sorted(jobs, key=lambda j: engine_order[j.engine_key()])
+
+    for job in jobs:
+        args = [a.resolve(source_sets, reference_sets) if isinstance(a, Placeholder) else a for a in job.args]
+        status = "done"
+        start = time.time()
+        with PeakMemorySampler() as sampler:
+            try:
+                if job.engine_config is None:
+                    job.method(*args)
+                else:
+                    if job.engine_key() != engine_key:
+                        engine_key, shared_engine = None, None
+                        job_source = next(a for a, p in zip(args, job.args)
+                                          if isinstance(p, Placeholder) and p.name == "source")
+                        shared_engine = build_engine(job_source, **job.engine_config)
+                        engine_key = job.engine_key()
+                    job.method(*args, shared_engine=shared_engine)
+            except Exception as e:
+                status = f"failed: {e!r}"
+        reports.put({
+            "job": job.name,
+            "dataset": name,
+            "status": status,
+            "elapsed_time": round(time.time() - start, 3),
+            "peak_ram_usage": round(sampler.peak_mb, 3),
+            "estimated_ram_usage": job.memory,
+        })
+
+
+def run_jobs(jobs, cpu_budget=None, memory_budget=None, log_file="results/scheduler_jobs.csv", max_overtakes=2):
+    """
+    Runs experiment jobs within CPU and memory budgets.
+
+    Jobs are grouped by dataset (see ExperimentJob.group_key), every group runs in its own
+    process, which loads its dataset once and runs the jobs one after another, sharing
+    engines between jobs with the same source subset and configuration. Groups are started in
+    order of their estimated cost (most expensive first) as long as their estimated cores
+    and memory fit into the budgets. Groups that fit may start before a waiting group
+    that doesn't, but only max_overtakes times: then no later group starts until the
+    waiting group fits, so large groups are not starved by small ones. A group that
+    exceeds the budgets on its own is started once nothing else runs.
+
+    Parameters
+    ----------
+    jobs : list[ExperimentJob]
+        Jobs to run.
+    cpu_budget : int, optional
+        Number of cores to use, defaults to all cores.
+    memory_budget : float, optional
+        Memory budget in MB, defaults to 80 % of the available memory.
+    log_file : str
+        CSV file for the per-job reports (status, time and peak memory).
+    max_overtakes : int
+        Number of later groups that may start while a group waits for resources.
+
+    Returns
+    -------
+    list[dict]
+        Reports of all jobs.
+    """
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    if memory_budget is None:
+        memory_budget = 0.8 * psutil.virtual_memory().available / (1024 * 1024)
+
+    by_key = defaultdict(list)
+    for job in jobs:
+        by_key[job.group_key()].append(job)
+
+    groups = []
+    for group_jobs in by_key.values():
+        # expensive jobs first
+        group_jobs.sort(key=lambda j: -j.cost)
+        groups.append({
+            "dataset": group_jobs[0].dataset,
+            "jobs": group_jobs,
+            "cost": sum(j.cost for j in group_jobs),
+            "memory": max(j.memory for j in group_jobs),
+            "cpus": max(j.cpus for j in group_jobs),
+            "overtaken": 0,
+        })
+    groups.sort(key=lambda g: -g["cost"])
+
+    reports = multiprocessing.Queue()
+    results = []
+    running = []
+    used_cpus, used_memory = 0, 0.0
+
+    def drain(timeout):
+        # wait for the first report, then take all that are ready
+        while True:
+            try:
+                report = reports.get(timeout=timeout) if timeout else reports.get_nowait()
+            except queue.Empty:
+                return
+            timeout = 0
+            print(f"[scheduler] {report['job']}: {report['status']}, "
+                  f"{report['elapsed_time']} s, peak {report['peak_ram_usage']} MB")
+            results.append(report)
+            if log_file:
+                save_experiment_results_to_csv(results=report, file_name=log_file)
+
+    while groups or running:
+        waiting = []
+        blocked = False
+        for group in list(groups):
+            fits = (used_cpus + group["cpus"] <= cpu_budget and used_memory + group["memory"] <= memory_budget)
+            if (fits and not blocked) or not running:
+                process = multiprocessing.Process(target=_run_group, args=(group["dataset"], group["jobs"], reports))
+                process.start()
+                print(f"[scheduler] started {len(group['jobs'])} job(s) on {group['dataset'][0]}")
+                running.append((process, group))
+                used_cpus += group["cpus"]
+                used_memory += group["memory"]
+                groups.remove(group)
+                for waiting_group in waiting:
+                    waiting_group["overtaken"] += 1
+            else:
+                waiting.append(group)
+                # keep the freed resources for a group that waited long enough
+                blocked = blocked or group["overtaken"] >= max_overtakes
+
+        drain(timeout=1.0)
+        for process, group in list(running):
+            if not process.is_alive():
+                process.join()
+                running.remove((process, group))
+                used_cpus -= group["cpus"]
+                used_memory -= group["memory"]
+
+    # reports sent right before a process ended
+    while True:
+        before = len(results)
+        drain(timeout=0.1)
+        if len(results) == before:
+            break
+    return results
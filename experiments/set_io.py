@@ -0,0 +1,257 @@
+import json
+import os
+import re
+from array import array
+
+import numpy as np
+
+# Whitespace and separators between the items of a JSON array
+_SEPARATORS = re.compile(r"[\s,]*")
+_WHITESPACE = re.compile(r"\s*")
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20):
+    """
+    Incrementally parses a file containing one JSON array and yields its items
+    one by one, so the whole file never has to be loaded into memory.
+
+    Args:
+        path (str): Path to the JSON file.
+        chunk_size (int): Number of characters read at once.
+
+    Yields:
+        object: The next item of the array.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as file:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def read_more():
+            nonlocal buffer, pos, eof
+            chunk = file.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        # find the opening bracket of the array
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos < len(buffer):
+                break
+            if eof:
+                raise ValueError(f"Empty JSON file: {path}")
+            read_more()
+        if buffer[pos] != "[":
+            raise ValueError(f"JSON file does not contain an array: {path}")
+        pos += 1
+
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError(f"Unexpected end of JSON array: {path}")
+                read_more()
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()
+                continue
+            # a value at the end of the buffer might be cut off, e.g. "1.5e" of the
+            # number "1.5e3" decodes as 1.5, so it is only complete if a separator follows
+            after = _WHITESPACE.match(buffer, end).end()
+            if not eof and (after == len(buffer) or buffer[after] not in ",]"):
+                read_more()
+                continue
+            pos = end
+            yield item
+
+
+def iter_jsonl(path: str):
+    """
+    Yields the items of a JSONL file, one JSON value per line.
+
+    Args:
+        path (str): Path to the JSONL file.
+
+    Yields:
+        object: The next item of the file.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_sets_from_file(path: str):
+    """
+    Streams the sets of a JSON array file or a JSONL file (".jsonl").
+
+    Args:
+        path (str): Path to the file.
+
+    Yields:
+        list: The next set of the file.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Set file not found: {path}")
+    if path.endswith(".jsonl"):
+        yield from iter_jsonl(path)
+    else:
+        yield from iter_json_array(path)
+
+
+def convert_json_to_jsonl(json_path: str, jsonl_path: str):
+    """
+    Converts a JSON array file of sets into a JSONL file with one set per line
+    without loading the whole file.
+
+    Args:
+        json_path (str): Path to the JSON array file.
+        jsonl_path (str): Path of the JSONL file to write.
+    """
+    with open(jsonl_path, "w", encoding="utf-8") as out_file:
+        for item in iter_json_array(json_path):
+            out_file.write(json.dumps(item, ensure_ascii=False))
+            out_file.write("\n")
+
+
+class ColumnarSets:
+    """
+    Read-only collection of sets of strings stored in a columnar binary layout:
+
+    - set_offsets.npy: int64 offsets of every set into the element offsets
+    - element_offsets.npy: int64 offsets of every element into the heap
+    - heap.bin: UTF-8 bytes of all elements
+
+    The arrays are memory-mapped, so loading is zero-copy and only the sets
+    that are accessed get decoded. Slicing returns a view without
+    materializing any set, e.g. source_sets[:60_000].
+    """
+
+    def __init__(self, set_offsets, element_offsets, heap, start=0, stop=None):
+        self.set_offsets = set_offsets
+        self.element_offsets = element_offsets
+        self.heap = heap
+        self.start = start
+        self.stop = len(set_offsets) - 1 if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return ColumnarSets(self.set_offsets, self.element_offsets, self.heap,
+                                self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("set index out of range")
+        return self._decode(self.start + index)
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self._decode(i)
+
+    def _decode(self, i: int) -> list:
+        first, last = int(self.set_offsets[i]), int(self.set_offsets[i + 1])
+        offsets = self.element_offsets[first:last + 1].tolist()
+        if not offsets or offsets[0] == offsets[-1]:
+            return [""] * (last - first)
+        data = self.heap[offsets[0]:offsets[-1]].tobytes()
+        base = offsets[0]
+        return [data[a - base:b - base].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+
+def save_sets_columnar(sets, directory: str):
+    """
+    Writes sets of strings in the columnar binary layout of ColumnarSets.
+    The sets are consumed one by one, so any iterable (e.g. iter_sets_from_file)
+    can be converted without loading it. Only string elements can be stored,
+    other elements would be read back as strings, so they raise a ValueError.
+
+    Args:
+        sets (iterable): Sets (lists) of string elements.
+        directory (str): Output directory, created if it does not exist.
+    """
+    os.makedirs(directory, exist_ok=True)
+    set_offsets = array("q", [0])
+    element_offsets = array("q", [0])
+    with open(os.path.join(directory, "heap.bin"), "wb") as heap_file:
+        heap_size = 0
+        for set_idx, s in enumerate(sets):
+            for element in s:
+                if not isinstance(element, str):
+                    raise ValueError(f"Set {set_idx} contains the non-string element {element!r}, "
+                                     f"convert the elements to str before saving")
+                encoded = element.encode("utf-8")
+                heap_file.write(encoded)
+                heap_size += len(encoded)
+                element_offsets.append(heap_size)
+            set_offsets.append(len(element_offsets) - 1)
+    np.save(os.path.join(directory, "set_offsets.npy"), np.frombuffer(set_offsets, dtype=np.int64))
+    np.save(os.path.join(directory, "element_offsets.npy"), np.frombuffer(element_offsets, dtype=np.int64))
+
+
+def load_sets_columnar(directory: str) -> ColumnarSets:
+    """
+    Memory-maps a set collection written by save_sets_columnar.
+
+    Args:
+        directory (str): Directory of the columnar set collection.
+
+    Returns:
+        ColumnarSets: Lazily decoded sets.
+    """
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"Columnar set directory not found: {directory}")
+    set_offsets = np.load(os.path.join(directory, "set_offsets.npy"), mmap_mode="r")
+    element_offsets = np.load(os.path.join(directory, "element_offsets.npy"), mmap_mode="r")
+    heap_path = os.path.join(directory, "heap.bin")
+    if os.path.getsize(heap_path) == 0:
+        heap = np.empty(0, dtype=np.uint8)
+    else:
+        heap = np.memmap(heap_path, dtype=np.uint8, mode="r")
+    return ColumnarSets(set_offsets, element_offsets, heap)
+
+
+def convert_to_columnar(input_path: str, directory: str, split_strings: bool = False):
+    """
+    Converts a JSON array / JSONL file of sets, or a CSV file with a 'title'
+    column (e.g. DBLP), into the columnar layout.
+
+    Args:
+        input_path (str): Path of the input file.
+        directory (str): Output directory.
+        split_strings (bool): Store every string as the set of its words, like
+            the DBLP titles in the string matching experiments.
+    """
+    if input_path.endswith(".csv"):
+        import pandas as pd
+        sets = pd.read_csv(input_path, usecols=["title"])["title"].dropna()
+    else:
+        sets = iter_sets_from_file(input_path)
+    # plain strings (e.g. titles) become a set of their words or a single element set
+    sets = ((s.split() if split_strings else [s]) if isinstance(s, str) else s for s in sets)
+    save_sets_columnar(sets, directory)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a set collection into the columnar binary layout.")
+    parser.add_argument("input", help="JSON array, JSONL or CSV ('title' column) file")
+    parser.add_argument("output", help="Output directory, e.g. data/dblp/DBLP_100k.sets")
+    parser.add_argument("--split", action="store_true", help="Split strings into sets of words")
+    args = parser.parse_args()
+    convert_to_columnar(args.input, args.output, args.split)
@@ -0,0 +1,98 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# the experiment modules are imported from the experiments folder, like in run.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dataset_preview import preview_head, preview_sample, compute_summary, dataset_summary, SUMMARY_SUFFIX
+from set_io import iter_json_array
+
+
+class TestDatasetPreview(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "sets.json")
+        self.sets = [["a", "bb"], ["ccc"], [], ["d", "e", "f"], ["gg", "h"], ["i"]]
+        self.write(self.sets)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, sets, path=None):
+        with open(path or self.path, "w", encoding="utf-8") as file:
+            json.dump(sets, file, indent=1)
+
+    def test_chunk_boundaries(self):
+        # numbers cut off at a chunk boundary can be valid numbers on their own
+        path = os.path.join(self.folder.name, "numbers.json")
+        text = '[1.5e3, 12345, [-0.25, 7], true, null, "x, y", 1E-2, [100], 2.5 ]'
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        for chunk_size in range(1, len(text) + 1):
+            self.assertEqual(list(iter_json_array(path, chunk_size)), json.loads(text), chunk_size)
+
+    def test_incomplete_array(self):
+        path = os.path.join(self.folder.name, "incomplete.json")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write('[["a"], ["b"')
+        with self.assertRaises(ValueError):
+            list(iter_json_array(path, 4))
+
+    def test_head(self):
+        self.assertEqual(preview_head(self.path, 2), self.sets[:2])
+        self.assertEqual(preview_head(self.path, 100), self.sets)
+
+    def test_sample(self):
+        sample = preview_sample(self.path, 3, seed=1)
+        self.assertEqual(sample, preview_sample(self.path, 3, seed=1))
+        self.assertEqual(len(sample), 3)
+        # sampled sets keep the file order
+        indices = [self.sets.index(s) for s in sample]
+        self.assertEqual(indices, sorted(indices))
+        self.assertEqual(preview_sample(self.path, 100), self.sets)
+
+        # every set can be sampled
+        sampled = {json.dumps(preview_sample(self.path, 1, seed=seed)[0]) for seed in range(200)}
+        self.assertEqual(sampled, {json.dumps(s) for s in self.sets})
+
+    def test_summary(self):
+        summary = compute_summary(self.path)
+        self.assertEqual(summary["set_amount"], 6)
+        self.assertEqual(summary["element_amount"], 9)
+        self.assertEqual(summary["set_size_histogram"], {0: 1, 1: 2, 2: 2, 3: 1})
+        self.assertEqual(summary["element_length_histogram"], {1: 6, 2: 2, 3: 1})
+
+    def test_summary_cache(self):
+        summary = dataset_summary(self.path)
+        self.assertTrue(os.path.exists(self.path + SUMMARY_SUFFIX))
+        # the cached summary has the same integer histogram keys
+        self.assertEqual(dataset_summary(self.path), summary)
+
+        # a changed dataset invalidates the cache
+        self.write(self.sets + [["j"]])
+        self.assertEqual(dataset_summary(self.path)["set_amount"], 7)
+
+        # also if only the modification time changes
+        with open(self.path + SUMMARY_SUFFIX, "r", encoding="utf-8") as file:
+            cached = json.load(file)
+        cached["summary"]["set_amount"] = -1
+        with open(self.path + SUMMARY_SUFFIX, "w", encoding="utf-8") as file:
+            json.dump(cached, file)
+        self.assertEqual(dataset_summary(self.path)["set_amount"], -1)
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(dataset_summary(self.path)["set_amount"], 7)
+
+        # refresh ignores the cache, a broken cache file is recomputed
+        with open(self.path + SUMMARY_SUFFIX, "w", encoding="utf-8") as file:
+            file.write("{")
+        self.assertEqual(dataset_summary(self.path)["set_amount"], 7)
+        self.assertEqual(dataset_summary(self.path, refresh=True)["set_amount"], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ import pandas as pd
 import psutil
 from src.silkmoth.utils import jaccard_similarity
 from src.silkmoth.tokenizer import Tokenizer
+from set_io import iter_sets_from_file, load_sets_columnar
 
 def is_convertible_to_number(value):
     try:
@@ -31,20 +32,46 @@ def save_sets_to_files(reference_sets, source_sets, reference_file="reference_se
     with open(source_file, 'w', encoding='utf-8') as src_file:
         json.dump(source_sets, src_file, ensure_ascii=False, indent=4)
 
-def load_sets_from_files(folder_path: str, reference_file: str = "reference_sets.json", source_file: str = "source_sets.json") -> tuple[list, list]:
-    source_path = os.path.join(folder_path, source_file)
-    reference_path = os.path.join(folder_path, reference_file)
+def _prefer_columnar(path: str) -> str:
+    # use a converted columnar copy next to the JSON file if there is one
+    columnar_path = os.path.splitext(path)[0] + ".sets"
+    return columnar_path if os.path.isdir(columnar_path) else path
+
+def load_sets_from_files(folder_path: str, reference_file: str = "reference_sets.json", source_file: str = "source_sets.json", stream_source: bool = False) -> tuple[list, list]:
+    """
+    Loads reference sets and source sets from JSON array or JSONL files, or
+    memory-maps them if they are columnar set directories (".sets"). A 
+    columnar copy next to a JSON file is preferred over the JSON file.
+
+    Args:
+        folder_path (str): Folder containing both files.
+        reference_file (str): The file name of the reference sets.
+        source_file (str): The file name of the source sets.
+        stream_source (bool): Return a generator streaming the source sets
+            instead of loading them, e.g. to build an index out-of-core.
+
+    Returns:
+        tuple: Reference sets and source sets (list or generator).
+    """
+    source_path = _prefer_columnar(os.path.join(folder_path, source_file))
+    reference_path = _prefer_columnar(os.path.join(folder_path, reference_file))
 
     # Check if the files exist
     if not os.path.exists(source_path) or not os.path.exists(reference_path):
         raise FileNotFoundError("One or both of the required files do not exist in the specified folder.")
 
     # Load the reference sets
-    with open(reference_path, 'r', encoding='utf-8') as ref_file:
-        reference_sets = json.load(ref_file)
+    if os.path.isdir(reference_path):
+        reference_sets = load_sets_columnar(reference_path)
+    else:
+        reference_sets = list(iter_sets_from_file(reference_path))
     # Load the source sets
-    with open(source_path, 'r', encoding='utf-8') as src_file:
-        source_sets = json.load(src_file)
+    if os.path.isdir(source_path):
+        source_sets = load_sets_columnar(source_path)
+    else:
+        source_sets = iter_sets_from_file(source_path)
+        if not stream_source:
+            source_sets = list(source_sets)
 
     return reference_sets, source_sets
 
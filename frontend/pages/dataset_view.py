@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
-import json
 import os
+import sys
+
+# dataset_preview lives next to the DataLoader of the experiments
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "experiments"))
+from dataset_preview import preview_head, preview_sample, dataset_summary
 
 # Directory containing the JSON files
 data_folder = "../experiments/data/webtables/"
@@ -35,30 +39,55 @@ st.markdown(
     """,
     unsafe_allow_html=True,
 )
+
+
+@st.cache_data(show_spinner="Loading preview ...")
+def load_preview(data_path, n, sample, seed):
+    """
+    First n or seeded random n sets, streamed from the file instead of loading all of it.
+    """
+    if sample:
+        return preview_sample(data_path, n, seed)
+    return preview_head(data_path, n)
+
+
+@st.cache_data(show_spinner="Computing summary ...")
+def load_summary(data_path):
+    # dataset_summary caches on disk, this only avoids re-reading the cache file
+    return dataset_summary(data_path)
+
+
+def show_dataset(data_path):
+    try:
+        st.dataframe(pd.DataFrame(load_preview(data_path, n, sample, seed)))
+        summary = load_summary(data_path)
+        st.write(f"{summary['set_amount']:,} sets with {summary['element_amount']:,} elements")
+        col_sizes, col_lengths = st.columns(2)
+        with col_sizes:
+            st.caption("Set sizes")
+            st.bar_chart(pd.Series(summary["set_size_histogram"], name="sets"))
+        with col_lengths:
+            st.caption("Element lengths")
+            st.bar_chart(pd.Series(summary["element_length_histogram"], name="elements"))
+    except Exception as e:
+        st.error(f"Error loading dataset {os.path.basename(data_path)}: {e}")
+
+
+# Preview settings
+n = st.number_input("Number of sets", min_value=1, max_value=1000, value=50, step=10)
+sample = st.checkbox("Random sample instead of the first sets", value=False)
+seed = st.number_input("Seed", min_value=0, value=0, step=1, disabled=not sample)
+
 st.divider()
 st.subheader("Schema Matching Dataset")
-
-# Load and display the schema matching dataset
-try:
-    with open(schema_matching_file_path, 'r', encoding='utf-8') as schema_file:
-        schema_data = json.load(schema_file)
-    schema_df = pd.DataFrame(schema_data).head(50)
-    st.dataframe(schema_df)
-except Exception as e:
-    st.error(f"Error loading schema matching dataset: {e}")
+show_dataset(schema_matching_file_path)
 
 
 st.divider()
 st.subheader("Inclusion Dependency Datasets")
 
-# Load and display the reference sets
-st.subheader("Reference/Source Sets")
-try:
-    with open(reference_file_path, 'r', encoding='utf-8') as ref_file:
-        reference_sets = json.load(ref_file)
-    ref_df = pd.DataFrame(reference_sets).head(50)
-    st.dataframe(ref_df)
-except Exception as e:
-    st.error(f"Error loading reference sets: {e}")
-
+st.subheader("Reference Sets")
+show_dataset(reference_file_path)
 
+st.subheader("Source Sets")
+show_dataset(source_file_path)
@@ -1,4 +1,5 @@
 import random
+import threading
 import time
 
 import streamlit as st
@@ -6,8 +7,13 @@ import streamlit as st
 from silkmoth.silkmoth_engine import SilkMothEngine
 from silkmoth.utils import jaccard_similarity, contain
 import os
-import json
+import sys
 from utils import *
+from search_worker import SearchJob
+
+# set_io lives next to the DataLoader of the experiments
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "experiments"))
+from set_io import iter_sets_from_file, load_sets_columnar
 
 
 # Streamlit app
@@ -42,93 +48,105 @@ source_file = "source_sets_inclusion_dependency.json"
 reference_file_path = os.path.join(data_folder, reference_file)
 source_file_path = os.path.join(data_folder, source_file)
 
-# Run the SilkMothEngine with progress animation and loading mask
-if st.button("Run SilkMoth Engine"):
-    if reference_file and source_file:
-        try:
-            # Create a placeholder for the loading animation
-            loading_placeholder = st.empty()
-            loading_placeholder.markdown("<div style='text-align: center; font-size: 20px;'>SilkMothEngine is running...</div>", unsafe_allow_html=True)
-
-            # Open and load reference and source sets from selected files
-            with open(reference_file_path, 'r', encoding='utf-8') as ref_file:
-                reference_sets = json.load(ref_file)
-            with open(source_file_path, 'r', encoding='utf-8') as src_file:
-                source_sets = json.load(src_file)
-
-
-
-            st.write(f"Create Inverted Index ...")
-            in_index_time_start = time.time()
-            # Initialize and run the SilkMothEngine
-            silk_moth_engine = SilkMothEngine(
-                related_thresh=0,
-                source_sets=source_sets,
-                sim_metric=contain,
-                sim_func=jaccard_similarity,
-                sim_thresh=0,
-                is_check_filter=False,
-                is_nn_filter=False,
-            )
-            in_index_time_end = time.time()
-            in_index_elapsed_time = in_index_time_end - in_index_time_start
-            st.write(f"Inverted Index created in {in_index_elapsed_time:.2f} seconds.")
-
-
-            elapsed_times_final = []
-            labels = ["NO FILTER"]
-            if check_filter:
-                labels.append("CHECK FILTER")
-
-            if nn_filter:
-                labels.append("NN FILTER")
-
-
-            for label in labels:
-                elapsed_times = []
-                for idx, related_thresh in enumerate(thresholds):
-
-                    if label == "CHECK FILTER":
-                        silk_moth_engine.is_check_filter = True
-                        silk_moth_engine.is_nn_filter = False
-                    elif label == "NN FILTER":
-                        silk_moth_engine.is_check_filter = False
-                        silk_moth_engine.is_nn_filter = True
-
-
-                    st.write(f"Processing Threshold {idx + 1}: {related_thresh} with {label} ...")
-                    silk_moth_engine.set_related_threshold(related_thresh)
-                    # Measure the time taken to search for related sets
-                    time_start = time.time()
 
-
-                    for ref_set in reference_sets:
-                        related_sets = silk_moth_engine.search_sets(ref_set)
-                        del related_sets
-
-                    time_end = time.time()
-
-
-                    elapsed_time = time_end - time_start
-                    elapsed_times.append(elapsed_time)
-
-                elapsed_times_final.append(elapsed_times)
-
-            # Remove the loading animation
-            loading_placeholder.empty()
-
-            # Display results
-            st.success("SilkMoth Engine ran successfully!")
-            fig = plot_elapsed_times(
-                related_thresholds=thresholds,
-                elapsed_times_list=elapsed_times_final,
+def read_sets(path):
+    """
+    Memory-maps the columnar copy of a set file (created by set_io.py) if there is one next to it,
+    otherwise streams the JSON file set by set instead of parsing it as one document.
+    """
+    columnar_path = os.path.splitext(path)[0] + ".sets"
+    if os.path.isdir(columnar_path):
+        return load_sets_columnar(columnar_path)
+    return list(iter_sets_from_file(path))
+
+
+@st.cache_resource(show_spinner="Loading datasets ...")
+def load_sets(reference_path, source_path):
+    """
+    Reference and source sets, loaded once per server and shared by all reruns and sessions.
+    """
+    return read_sets(reference_path), read_sets(source_path)
+
+
+@st.cache_resource(show_spinner="Creating Inverted Index ...")
+def load_engine(reference_path, source_path):
+    """
+    SilkMothEngine over the source sets, built once per dataset.
+    Filters and relatedness thresholds do not change the index, they are set per search.
+    """
+    _, source_sets = load_sets(reference_path, source_path)
+    in_index_time_start = time.time()
+    silk_moth_engine = SilkMothEngine(
+        related_thresh=0,
+        source_sets=source_sets,
+        sim_metric=contain,
+        sim_func=jaccard_similarity,
+        is_check_filter=False,
+        is_nn_filter=False,
+    )
+    return silk_moth_engine, threading.Lock(), time.time() - in_index_time_start
+
+
+labels = ["NO FILTER"]
+if check_filter:
+    labels.append("CHECK FILTER")
+if nn_filter:
+    labels.append("NN FILTER")
+
+# Start the searches in a background worker, the data and engine come from the cache
+if st.button("Run SilkMoth Engine"):
+    try:
+        reference_sets, _ = load_sets(reference_file_path, source_file_path)
+        silk_moth_engine, engine_lock, in_index_elapsed_time = load_engine(reference_file_path, source_file_path)
+        previous_job = st.session_state.get("search_job")
+        if previous_job is not None:
+            previous_job.cancel()
+        st.session_state["search_job"] = SearchJob(
+            silk_moth_engine, engine_lock, reference_sets, list(thresholds), labels
+        ).start()
+        st.session_state["in_index_elapsed_time"] = in_index_elapsed_time
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+
+
+@st.fragment(run_every=1.0)
+def show_progress():
+    job = st.session_state.get("search_job")
+    if job is None:
+        return
+    progress = job.progress()
+
+    st.write(f"Inverted Index created in {st.session_state['in_index_elapsed_time']:.2f} seconds.")
+    if progress["error"] is not None:
+        st.error(f"An error occurred: {progress['error']}")
+        return
+    if not progress["done"]:
+        st.progress(
+            progress["searched"] / max(job.total, 1),
+            text=f"Processing Threshold {progress['threshold']} with {progress['label']}: "
+                 f"{progress['current_time']:.2f} seconds ...",
+        )
+    else:
+        st.success("SilkMoth Engine ran successfully!")
+
+    # Timings of all finished thresholds
+    finished = {label: times for label, times in progress["elapsed_times"].items() if times}
+    if finished:
+        # redraw only when another threshold finished, not on every poll
+        plot_key = (id(job), sum(len(times) for times in finished.values()))
+        if st.session_state.get("plot_key") != plot_key:
+            if st.session_state.get("plot_fig") is not None:
+                plt.close(st.session_state["plot_fig"])
+            st.session_state["plot_fig"] = plot_elapsed_times(
+                related_thresholds=job.thresholds,
+                elapsed_times_list=[times + [float("nan")] * (len(job.thresholds) - len(times))
+                                    for times in finished.values()],
                 fig_text="Inclusion Dependency (α = 0.0)",
-                legend_labels=labels,
+                legend_labels=list(finished),
                 file_name="webtable_inclusion_dependency_experiment_demo.png"
             )
-            st.pyplot(fig)
+            st.session_state["plot_key"] = plot_key
+        st.pyplot(st.session_state["plot_fig"])
 
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
-    else:
-        st.warning("Please upload both reference and source set files.")
\ No newline at end of file
+
+show_progress()
@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+class SearchJob:
+    """
+    Runs the searches of all reference sets for every filter label and relatedness
+    threshold in a background thread, so the Streamlit script does not block.
+
+    The page polls progress() on every rerun, it returns a consistent copy of the
+    current state, including the timings of all finished thresholds.
+    """
+
+    def __init__(self, engine, engine_lock, reference_sets, thresholds, labels):
+        """
+        Args:
+            engine (SilkMothEngine): Cached engine, shared between sessions
+            engine_lock (threading.Lock): Lock of the engine, searches of different
+                sessions change its filters and threshold and must not interleave
+            reference_sets (list): Reference sets to search for
+            thresholds (list): Relatedness thresholds
+            labels (list): Filter labels ("NO FILTER", "CHECK FILTER", "NN FILTER")
+        """
+        self.engine = engine
+        self.engine_lock = engine_lock
+        self.reference_sets = reference_sets
+        self.thresholds = thresholds
+        self.labels = labels
+        self.total = len(labels) * len(thresholds) * len(reference_sets)
+
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._state = {
+            "label": None,
+            "threshold": None,
+            "searched": 0,
+            "current_time": 0.0,
+            "elapsed_times": {label: [] for label in labels},
+            "done": False,
+            "error": None,
+        }
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def progress(self) -> dict:
+        with self._lock:
+            state = dict(self._state)
+            state["elapsed_times"] = {label: list(times) for label, times in self._state["elapsed_times"].items()}
+        return state
+
+    def _update(self, **kwargs):
+        with self._lock:
+            self._state.update(kwargs)
+
+    def _run(self):
+        try:
+            with self.engine_lock:
+                searched = 0
+                for label in self.labels:
+                    self.engine.is_check_filter = label == "CHECK FILTER"
+                    self.engine.is_nn_filter = label == "NN FILTER"
+                    for related_thresh in self.thresholds:
+                        self.engine.set_related_threshold(related_thresh)
+                        self._update(label=label, threshold=related_thresh, current_time=0.0)
+                        time_start = time.time()
+                        for ref_set in self.reference_sets:
+                            if self._cancel.is_set():
+                                return
+                            self.engine.search_sets(ref_set)
+                            searched += 1
+                            self._update(searched=searched, current_time=time.time() - time_start)
+
+                        with self._lock:
+                            self._state["elapsed_times"][label].append(time.time() - time_start)
+        except Exception as e:
+            self._update(error=e)
+        finally:
+            self._update(done=True)
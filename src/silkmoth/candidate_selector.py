@@ -1,5 +1,14 @@
 from .utils import contain, similar, edit_similarity, N_edit_similarity, jaccard_similarity, get_q_chunks
 from math import floor, ceil
+import numpy as np
+
+# Minimum number of (set, element) tuples of a signature for bitmap based 
+# candidate selection, smaller signatures use a set
+BITMAP_MIN_POSTINGS = 1024
+
+# Minimum length of an inverted list to be probed at the candidate sets 
+# instead of walked when collecting signature hits
+SKIP_MIN_POSTINGS = 512
 
 class CandidateSelector:
     """
@@ -46,21 +55,178 @@ class CandidateSelector:
         self.alpha = sim_thresh
         self.q = q
 
-    def get_candidates(self, signature, inverted_index, ref_size) -> set:
+    def get_candidates(self, signature, inverted_index, ref_size, with_hits=False):
         """
         Retrieve candidate set indices using token signature lookup.
 
+        Signatures with many (set, element) tuples or stop tokens (see 
+        InvertedIndex) are merged in a bitmap over all set ids, otherwise the
+        candidates are collected in a set. Stop tokens are looked up by
+        scanning the sets if only a few sets are asked for, otherwise their
+        inverted lists are materialized (see scan_stop_token).
+
+        With hits, the matched source elements of every candidate are returned
+        too, so the check and nearest neighbour filters do not search the 
+        inverted index again.
+
         Args:
             signature (list): Signature tokens for a reference set.
             inverted_index (InvertedIndex): Instance of the custom InvertedIndex class.
             ref_size (int): Size of set R.
+            with_hits (bool): Also return the signature hits of the candidates.
 
         Returns:
             set: Indices of candidate sets containing at least one signature token.
+            dict: Only with hits, c_idx -> dict{token -> element indices of 
+                S[c_idx] containing the signature token}.
+        """
+        tokens = []
+        volume = 0
+        for token in signature:
+            try:
+                volume += inverted_index.get_cost(token)
+                tokens.append(token)
+            except ValueError:
+                # token not found in inverted index; safely ignore
+                continue
+        if with_hits:
+            return self._get_candidates_hits(tokens, inverted_index, ref_size)
+        num_sets = len(inverted_index.token_sets)
+        # the bitmap costs O(number of sets), it pays off for many postings
+        if volume >= max(BITMAP_MIN_POSTINGS, num_sets // 64) or any(t in inverted_index.cost_table for t in tokens):
+            return self._get_candidates_bitmap(tokens, inverted_index, ref_size)
+        return self._get_candidates_set(tokens, inverted_index, ref_size)
+
+    def _get_candidates_bitmap(self, tokens, inverted_index, ref_size) -> set:
+        """
+        Candidate selection with a bitmap over all set ids. Set ids of the
+        inverted lists are set at once and sets of the wrong size are masked 
+        out in one step. Stop tokens come last, only sets of the right size 
+        that aren't candidates yet are looked up for them.
+
+        Args:
+            tokens (list): Signature tokens contained in the index.
+            inverted_index (InvertedIndex): Inverted index
+            ref_size (int): Size of set R.
+
+        Returns:
+            set: Indices of candidate sets.
+        """
+        bitmap = np.zeros(len(inverted_index.token_sets), dtype=bool)
+        stop_tokens = []
+        for token in tokens:
+            if token in inverted_index.cost_table:
+                stop_tokens.append(token)
+                continue
+            bitmap[inverted_index.get_set_ids(token)] = True
+        size_mask = self.size_mask(ref_size, inverted_index.get_set_sizes())
+        if size_mask is not None:
+            bitmap &= size_mask
+        if stop_tokens:
+            unseen = ~bitmap if size_mask is None else size_mask & ~bitmap
+            for token in stop_tokens:
+                set_ids = np.flatnonzero(unseen)
+                if self.scan_stop_token(token, inverted_index, len(set_ids)):
+                    found = list(inverted_index.get_indexes_skip(token, set_ids.tolist()))
+                else:
+                    set_ids = inverted_index.get_set_ids(token)
+                    found = set_ids[unseen[set_ids]]
+                bitmap[found] = True
+                unseen[found] = False
+        return set(np.flatnonzero(bitmap).tolist())
+
+    def _get_candidates_hits(self, tokens, inverted_index, ref_size) -> tuple:
+        """
+        Candidate selection that keeps the hits of the signature tokens.
+        Short inverted lists are walked. Long lists contribute their set ids
+        at once and are only probed at sets of the right size (see
+        InvertedIndex.get_indexes_skip), so their other entries are skipped.
+        Stop tokens without a materialized list are looked up in all sets of
+        the right size (see scan_stop_token).
+
+        Args:
+            tokens (list): Signature tokens contained in the index.
+            inverted_index (InvertedIndex): Inverted index
+            ref_size (int): Size of set R.
+
+        Returns:
+            tuple:
+                set: Indices of candidate sets.
+                dict: c_idx -> dict{token -> element indices}.
+        """
+        hits = dict()
+        rejected = set()
+        size_mask = None
+        for token in tokens:
+            is_stop_token = token in inverted_index.cost_table
+            if is_stop_token or inverted_index.get_cost(token) >= SKIP_MIN_POSTINGS:
+                # long list: only sets of the right size are probed, others are skipped
+                if size_mask is None:
+                    size_mask = self.size_mask(ref_size, inverted_index.get_set_sizes())
+                    if size_mask is None:
+                        size_mask = np.ones(len(inverted_index.token_sets), dtype=bool)
+                if is_stop_token and self.scan_stop_token(token, inverted_index, int(size_mask.sum())):
+                    set_ids = np.flatnonzero(size_mask)
+                else:
+                    set_ids = inverted_index.get_set_ids(token)
+                    set_ids = set_ids[size_mask[set_ids]]
+                for set_idx, element_idxs in inverted_index.get_indexes_skip(token, set_ids.tolist()).items():
+                    set_hits = hits.get(set_idx)
+                    if set_hits is None:
+                        set_hits = hits[set_idx] = dict()
+                    set_hits[token] = element_idxs
+                continue
+
+            for set_idx, element_idx in inverted_index.get_indexes(token):
+                set_hits = hits.get(set_idx)
+                if set_hits is None:
+                    if set_idx in rejected:
+                        continue
+                    if not self.verify_size(ref_size, len(inverted_index.get_set(set_idx))):
+                        rejected.add(set_idx)
+                        continue
+                    set_hits = hits[set_idx] = dict()
+                token_hits = set_hits.get(token)
+                if token_hits is None:
+                    set_hits[token] = [element_idx]
+                else:
+                    token_hits.append(element_idx)
+        return set(hits), hits
+
+    @staticmethod
+    def scan_stop_token(token, inverted_index, num_sets) -> bool:
+        """
+        Decides how a stop token without a materialized list is looked up in
+        some sets. Scanning costs about one step per set, building the list
+        costs one pass over all sets but is kept for later queries within the
+        materialization budget of the index. The sets are scanned as long as
+        they are not more than the (set, element) tuples of the token's list.
+
+        Args:
+            token (str): Stop token
+            inverted_index (InvertedIndex): Inverted index
+            num_sets (int): Number of sets to look up
+
+        Returns:
+            bool: True to scan the sets, False to materialize the list
+        """
+        return num_sets <= inverted_index.get_cost(token)
+
+    def _get_candidates_set(self, tokens, inverted_index, ref_size) -> set:
+        """
+        Candidate selection with a set for signatures with few postings.
+
+        Args:
+            tokens (list): Signature tokens.
+            inverted_index (InvertedIndex): Inverted index
+            ref_size (int): Size of set R.
+
+        Returns:
+            set: Indices of candidate sets.
         """
         candidates = set()
 
-        for token in signature:
+        for token in tokens:
             try:
                 idx_list = inverted_index.get_indexes(token)
                 for set_idx, _ in idx_list:
@@ -72,6 +238,24 @@ class CandidateSelector:
                 continue
 
         return candidates
+
+    def size_mask(self, ref_size, set_sizes):
+        """
+        Vectorized verify_size(...) for all sets.
+
+        Args:
+            ref_size (int): Size of set R.
+            set_sizes (np.ndarray): Sizes of all sets.
+
+        Returns:
+            np.ndarray: True for sets that could be related based on their 
+                size, None if all sets could be related.
+        """
+        if self.sim_metric == contain:
+            return set_sizes >= ref_size
+        if self.sim_metric == similar:
+            return np.minimum(set_sizes, ref_size) >= self.delta * np.maximum(set_sizes, ref_size)
+        return None
     
     def verify_size(self, ref_size, src_size) -> bool:
         """
@@ -95,7 +279,7 @@ class CandidateSelector:
                 return False
         return True   
 
-    def check_filter(self, R, K, candidates, inverted_index) -> tuple:
+    def check_filter(self, R, K, candidates, inverted_index, hits=None, match_map=None) -> tuple:
         """
         Apply check filter to prune weak candidate sets.
 
@@ -104,6 +288,10 @@ class CandidateSelector:
             K (set): Flattened signature tokens.
             candidates (set): Candidate set indices from get_candidates().
             inverted_index (InvertedIndex): For retrieving sets.
+            hits (dict): Signature hits from get_candidates(..., with_hits=True),
+                None to look them up in the inverted index.
+            match_map (dict): Match maps that were already computed, they are
+                reused and the new ones are added.
 
         Returns:
             tuple:
@@ -111,11 +299,14 @@ class CandidateSelector:
                 dict: c_idx -> dict{r_idx -> max_sim}.
         """
         filtered = set()
-        match_map = dict()
+        if match_map is None:
+            match_map = dict()
         k_i_sets = [set(r_i).intersection(K) for r_i in R]
         
         for c_idx in candidates:
-            matched = self.create_match_map(R, k_i_sets, c_idx, inverted_index)
+            matched = match_map.get(c_idx)
+            if matched is None:
+                matched = self.create_match_map(R, k_i_sets, c_idx, inverted_index, hits)
 
             if matched:
                 filtered.add(c_idx)
@@ -123,7 +314,7 @@ class CandidateSelector:
 
         return filtered, match_map
 
-    def create_match_map(self, R, k_i_sets, c_idx, inverted_index) -> dict:
+    def create_match_map(self, R, k_i_sets, c_idx, inverted_index, hits=None) -> dict:
         """
         Create a match map for a specific candidate index.
 
@@ -132,12 +323,15 @@ class CandidateSelector:
             k_i_sets (list of sets): Unflattened signature.
             c_idx (int): Candidate set index.
             inverted_index (InvertedIndex): For retrieving sets.
+            hits (dict): Signature hits of the candidates, None to look them 
+                up in the inverted index.
 
         Returns:
             dict: r_idx -> max_sim for matched reference sets.
         """
         S = inverted_index.get_set(c_idx)
         matched = {}
+        set_hits = hits.get(c_idx, {}) if hits is not None else None
 
         for r_idx, (r_i, k_i) in enumerate(zip(R, k_i_sets)):
             if not r_i or not k_i:
@@ -154,22 +348,23 @@ class CandidateSelector:
             max_sim = 0.0
 
             for token in k_i:
-                try:
-                    entries = inverted_index.get_indexes_binary(token, c_idx)
-                    for s_idx, e_idx in entries:
-                        if s_idx != c_idx:
-                            continue
-                        s = S[e_idx]
-
-                        # call signature based on edit vs. jaccard
-                        if is_edit:
-                            sim = self.similarity(r_i, s, self.alpha)
-                        else:
-                            sim = self.similarity(r_set, set(s), self.alpha)
-                        if sim >= threshold:
-                            max_sim = max(max_sim, sim)
-                except ValueError:
-                    continue
+                if set_hits is not None:
+                    element_idxs = set_hits.get(token, ())
+                else:
+                    try:
+                        element_idxs = [e_idx for _, e_idx in inverted_index.get_indexes_binary(token, c_idx)]
+                    except ValueError:
+                        continue
+                for e_idx in element_idxs:
+                    s = S[e_idx]
+
+                    # call signature based on edit vs. jaccard
+                    if is_edit:
+                        sim = self.similarity(r_i, s, self.alpha)
+                    else:
+                        sim = self.similarity(r_set, set(s), self.alpha)
+                    if sim >= threshold:
+                        max_sim = max(max_sim, sim)
 
             if max_sim >= threshold:
                 matched[r_idx] = max_sim
@@ -211,7 +406,7 @@ class CandidateSelector:
         return max_sim
 
 
-    def nn_filter(self, R, K, candidates, inverted_index, threshold, match_map) -> set:
+    def nn_filter(self, R, K, candidates, inverted_index, threshold, match_map, hits=None) -> set:
         """
         Nearest Neighbor Filter (Algorithm 2 from SilkMoth paper).
 
@@ -222,6 +417,8 @@ class CandidateSelector:
             inverted_index (InvertedIndex): To retrieve sets and indexes.
             threshold (float): Relatedness threshold δ (between 0 and 1).
             match_map (dict): Maps candidate set index to matched rᵢ indices and their max sim (from check filter).
+            hits (dict): Signature hits from get_candidates(..., with_hits=True),
+                None to look them up in the inverted index.
 
         Returns:
             set: Final filtered candidate indices that pass the NN filter.
@@ -247,13 +444,17 @@ class CandidateSelector:
         for c_idx in candidates:
             S = inverted_index.get_set(c_idx)
             if self.alpha > 0:
-                S_tokens = set()
-                for s in S:
-                    S_tokens.update(s)
+                if hits is not None:
+                    # k_i is part of the signature, so only signature hits can intersect it
+                    S_tokens = hits.get(c_idx, {}).keys()
+                else:
+                    S_tokens = set()
+                    for s in S:
+                        S_tokens.update(s)
 
             # Check if match_map is provided, otherwise create it
             if match_map is None:
-                matched = self.create_match_map(R, K, c_idx, inverted_index)
+                matched = self.create_match_map(R, k_i_sets, c_idx, inverted_index, hits)
             else:
                 matched = match_map.get(c_idx, {})
 
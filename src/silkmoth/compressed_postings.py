@@ -0,0 +1,309 @@
+import numpy as np
+
+# Number of (set, element) tuples per block, every block has a skip header
+BLOCK_SIZE = 128
+
+# Minimum number of bytes decoded with numpy instead of a Python loop
+NUMPY_MIN_BYTES = 512
+
+
+def encode_varints(values) -> bytes:
+    """
+    Encodes non-negative integers as varints (LEB128), 7 bits per byte with
+    the high bit set on all but the last byte of a value.
+
+    Args:
+        values (iterable): Non-negative integers
+
+    Returns:
+        bytes: Encoded values
+    """
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def varint_lengths(values: np.ndarray) -> np.ndarray:
+    """
+    Gives the number of bytes of the varints of non-negative integers.
+
+    Args:
+        values (np.ndarray): Non-negative integers
+
+    Returns:
+        np.ndarray: Number of bytes of every value
+    """
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        more = values >= (1 << (7 * k))
+        if not more.any():
+            break
+        lengths += more
+    return lengths
+
+
+def encode_varints_array(values: np.ndarray, lengths: np.ndarray = None) -> bytes:
+    """
+    Vectorized encode_varints(...) for large arrays.
+
+    Args:
+        values (np.ndarray): Non-negative integers
+        lengths (np.ndarray): Number of bytes of every value, computed if None
+
+    Returns:
+        bytes: Encoded values
+    """
+    if lengths is None:
+        lengths = varint_lengths(values)
+    starts = np.cumsum(lengths) - lengths
+    byte_idx = np.arange(int(lengths.sum()), dtype=np.int64) - np.repeat(starts, lengths)
+    out = (np.repeat(values.astype(np.int64), lengths) >> (7 * byte_idx)) & 0x7F
+    out |= (byte_idx < np.repeat(lengths, lengths) - 1).astype(np.int64) << 7
+    return out.astype(np.uint8).tobytes()
+
+
+def decode_varints(data) -> list:
+    """
+    Decodes varints with a Python loop, fast for short inputs.
+
+    Args:
+        data (bytes): Encoded values
+
+    Returns:
+        list: Decoded integers
+    """
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            values.append(value)
+            value = 0
+            shift = 0
+        else:
+            shift += 7
+    return values
+
+
+def decode_varints_array(data) -> np.ndarray:
+    """
+    Vectorized decode_varints(...) for long inputs.
+
+    Args:
+        data (bytes): Encoded values
+
+    Returns:
+        np.ndarray: Decoded integers
+    """
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(encoded < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (np.arange(len(encoded), dtype=np.int64) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((encoded & 0x7F).astype(np.int64) << shifts, starts)
+
+
+class CompressedPostings:
+    """
+    A compressed inverted list. The (set, element) tuples are stored as
+    varints of the set id delta to the previous tuple and the element id,
+    which mostly take one byte each instead of a Python tuple.
+
+    Lists longer than one block have a skip header per block with the set id
+    before the block, the last set id in the block and the byte offset of
+    the block. Lookups of single sets only decode the blocks that can
+    contain them, whole lists are decoded in bulk with numpy.
+
+    Examples
+    --------
+    ```
+    >>> from silkmoth.compressed_postings import CompressedPostings
+    >>> postings = CompressedPostings([(0, 1), (3, 0), (3, 2), (7, 1)])
+    >>> len(postings)
+    4
+    >>> postings.lookup(3)
+    [(3, 0), (3, 2)]
+    >>> postings.to_list()
+    [(0, 1), (3, 0), (3, 2), (7, 1)]
+    ```
+    """
+    __slots__ = ("data", "skips", "length")
+
+    def __init__(self, postings):
+        """
+        Compresses an inverted list.
+
+        Args:
+            postings (list): (set, element) tuples sorted by set and element
+        """
+        self.length = len(postings)
+        self.skips = None
+        if self.length <= BLOCK_SIZE:
+            values = []
+            previous = 0
+            for set_idx, element_idx in postings:
+                values.append(set_idx - previous)
+                values.append(element_idx)
+                previous = set_idx
+            self.data = encode_varints(values)
+            return
+
+        pairs = np.array(postings, dtype=np.int64).reshape(-1, 2)
+        set_ids = pairs[:, 0]
+        values = pairs.copy()
+        values[1:, 0] = np.diff(set_ids)
+        values = values.ravel()
+        lengths = varint_lengths(values)
+        self.data = encode_varints_array(values, lengths)
+
+        firsts = np.arange(0, self.length, BLOCK_SIZE)
+        bases = np.zeros(len(firsts), dtype=np.int64)
+        bases[1:] = set_ids[firsts[1:] - 1]
+        lasts = set_ids[np.minimum(firsts + BLOCK_SIZE, self.length) - 1]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))[2 * firsts]
+        self.skips = np.stack([bases, lasts, offsets]).tobytes()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getstate__(self):
+        return self.data, self.skips, self.length
+
+    def __setstate__(self, state):
+        self.data, self.skips, self.length = state
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the encoded list and its skip headers in bytes.
+        """
+        return len(self.data) + (len(self.skips) if self.skips is not None else 0)
+
+    def _headers(self) -> tuple:
+        bases, lasts, offsets = np.frombuffer(self.skips, dtype=np.int64).reshape(3, -1)
+        return bases, lasts, offsets
+
+    def _decode(self, data, base=0) -> tuple:
+        """
+        Decodes (part of) the list.
+
+        Args:
+            data (bytes): Encoded tuples
+            base (int): Set id before the first tuple
+
+        Returns:
+            np.ndarray: Set ids
+            np.ndarray: Element ids
+        """
+        if len(data) >= NUMPY_MIN_BYTES:
+            values = decode_varints_array(data)
+        else:
+            values = np.array(decode_varints(data), dtype=np.int64)
+        values = values.reshape(-1, 2)
+        return base + np.cumsum(values[:, 0]), values[:, 1]
+
+    def to_list(self) -> list:
+        """
+        Decodes the whole list.
+
+        Returns:
+            list: (set, element) tuples
+        """
+        if self.skips is None:
+            values = decode_varints(self.data)
+            postings = []
+            set_idx = 0
+            for i in range(0, len(values), 2):
+                set_idx += values[i]
+                postings.append((set_idx, values[i + 1]))
+            return postings
+        set_ids, element_ids = self._decode(self.data)
+        return list(zip(set_ids.tolist(), element_ids.tolist()))
+
+    def set_ids(self) -> np.ndarray:
+        """
+        Decodes the set ids of the whole list in bulk.
+
+        Returns:
+            np.ndarray: Set ids of all tuples, in ascending order
+        """
+        return self._decode(self.data)[0]
+
+    def lookup(self, set_idx) -> list:
+        """
+        Gives the tuples of one set, only the blocks that can contain the set
+        are decoded.
+
+        Args:
+            set_idx (int): Set id
+
+        Returns:
+            list: (set_idx, element_idx) tuples of the set
+        """
+        if self.skips is None:
+            values = decode_varints(self.data)
+            result = []
+            current = 0
+            for i in range(0, len(values), 2):
+                current += values[i]
+                if current == set_idx:
+                    result.append((set_idx, values[i + 1]))
+                elif current > set_idx:
+                    break
+            return result
+        return [(set_idx, element_idx) for element_idx in self.lookup_many([set_idx]).get(set_idx, [])]
+
+    def lookup_many(self, set_ids) -> dict:
+        """
+        Gives the element ids of many sets. Every block that can contain one
+        of the sets is decoded once, the other blocks are skipped.
+
+        Args:
+            set_ids (list): Ascending set ids
+
+        Returns:
+            dict: set_idx -> element ids of the set, sets without tuples are
+                  left out.
+        """
+        requested = np.asarray(set_ids, dtype=np.int64)
+        if not len(requested):
+            return dict()
+        if self.skips is None:
+            decoded_sets, decoded_elements = self._decode(self.data)
+        else:
+            bases, lasts, offsets = self._headers()
+            num_blocks = len(lasts)
+            # a set is in the first block whose last set id is not smaller,
+            # and in the following blocks as long as it is their last set id
+            firsts = np.searchsorted(lasts, requested, "left")
+            stops = np.minimum(np.searchsorted(lasts, requested, "right"), num_blocks - 1)
+            blocks = set()
+            for first, stop in zip(firsts.tolist(), stops.tolist()):
+                if first < num_blocks:
+                    blocks.update(range(first, stop + 1))
+            if not blocks:
+                return dict()
+            ends = np.append(offsets[1:], len(self.data)).tolist()
+            offsets = offsets.tolist()
+            bases = bases.tolist()
+            segments = [
+                self._decode(self.data[offsets[k]:ends[k]], bases[k]) for k in sorted(blocks)
+            ]
+            decoded_sets = np.concatenate([segment[0] for segment in segments])
+            decoded_elements = np.concatenate([segment[1] for segment in segments])
+
+        lefts = np.searchsorted(decoded_sets, requested, "left")
+        rights = np.searchsorted(decoded_sets, requested, "right")
+        result = dict()
+        for set_idx, left, right in zip(requested.tolist(), lefts.tolist(), rights.tolist()):
+            if right > left:
+                result[set_idx] = decoded_elements[left:right].tolist()
+        return result
@@ -0,0 +1,195 @@
+import threading
+from .utils import element_key
+
+
+class ElementStore:
+    """
+    Global table of distinct raw elements. Every distinct element gets an
+    element id and is tokenized only once, all sets containing it share the
+    same token object. This saves tokenization time and memory for datasets
+    that repeat the same elements (e.g. "Name" or city names in webtables).
+
+    Similarities between two interned elements are cached by their element
+    ids, so the [Verifier](verifier.md) computes them only once. The raw
+    similarity is cached, the similarity threshold α is applied by the caller.
+    The cache can be shared by verification threads.
+
+    Reference sets are tokenized with intern=False, they reuse the tokens of
+    known elements but don't add new ones, so the store only grows with the
+    source sets.
+
+    Examples
+    --------
+    ```
+    >>> from silkmoth.element_store import ElementStore
+    >>> from silkmoth.tokenizer import Tokenizer
+    >>> from silkmoth.utils import jaccard_similarity
+    >>> store = ElementStore(Tokenizer(jaccard_similarity))
+    >>> S1 = store.tokenize(["Name", "Date"])
+    >>> S2 = store.tokenize(["Date", "City"])
+    >>> S1[1] is S2[0]
+    True
+    >>> len(store)
+    3
+    >>> store.element_ids(["City", "Name"])
+    [2, 0]
+    ```
+    """
+
+    def __init__(self, tokenizer, max_cache_size=1_000_000):
+        """
+        Initialize an empty element store.
+
+        Args:
+            tokenizer (Tokenizer): Tokenizer for single elements
+            max_cache_size (int): Maximum number of cached similarities, the
+                cache is cleared when it is exceeded
+        """
+        self.tokenizer = tokenizer
+        self.max_cache_size = max_cache_size
+        self.element_table = dict()     # element key -> element id
+        self.tokens = []                # element id -> tokenized element
+        self.token_ids = dict()         # id(tokenized element) -> element id
+        self.sim_cache = dict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getstate__(self):
+        # object ids are only valid in this process
+        state = self.__dict__.copy()
+        state["token_ids"] = None
+        state["lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.token_ids = {id(tokens): e_id for e_id, tokens in enumerate(self.tokens)}
+        self.lock = threading.Lock()
+
+    def intern(self, element) -> int:
+        """
+        Gives the element id of a raw element and tokenizes it if it is new.
+
+        Args:
+            element: Raw element
+
+        Returns:
+            int: Element id
+        """
+        key = element_key(element)
+        e_id = self.element_table.get(key)
+        if e_id is None:
+            tokens = self.tokenizer.tokenize([element])[0]
+            with self.lock:
+                e_id = self.element_table.get(key)
+                if e_id is None:
+                    e_id = len(self.tokens)
+                    self.element_table[key] = e_id
+                    self.tokens.append(tokens)
+                    self.token_ids[id(tokens)] = e_id
+        return e_id
+
+    def merge(self, input_sets: list, token_sets: list) -> list:
+        """
+        Adds sets tokenized by another store, e.g. in a worker process of the
+        parallel index build. Known elements are replaced by the token objects
+        of this store, new elements are interned with their tokens.
+
+        Args:
+            input_sets (list): Raw sets
+            token_sets (list): Tokenized sets of the raw sets
+
+        Returns:
+            list: Tokenized sets sharing the token objects of this store
+        """
+        merged = []
+        with self.lock:
+            for input_set, token_set in zip(input_sets, token_sets):
+                merged_set = []
+                for element, tokens in zip(input_set, token_set):
+                    key = element_key(element)
+                    e_id = self.element_table.get(key)
+                    if e_id is None:
+                        e_id = len(self.tokens)
+                        self.element_table[key] = e_id
+                        self.tokens.append(tokens)
+                        self.token_ids[id(tokens)] = e_id
+                    merged_set.append(self.tokens[e_id])
+                merged.append(merged_set)
+        return merged
+
+    def element_ids(self, input_set: list) -> list:
+        """
+        Interns all elements of a raw set.
+
+        Args:
+            input_set (list): Raw set
+
+        Returns:
+            list: Element ids of the set's elements
+        """
+        return [self.intern(element) for element in input_set]
+
+    def tokenize(self, input_set: list, intern=True) -> list:
+        """
+        Tokenizes a raw set like Tokenizer.tokenize(...), but repeated elements
+        share one token object.
+
+        Args:
+            input_set (list): Raw set
+            intern (bool): Flag to add new elements to the store. Otherwise 
+                only known elements share their token object, e.g. for 
+                reference sets.
+
+        Returns:
+            list: Tokenized elements of the set
+        """
+        if intern:
+            return [self.tokens[e_id] for e_id in self.element_ids(input_set)]
+        tokenized = []
+        for element in input_set:
+            e_id = self.element_table.get(element_key(element))
+            tokenized.append(self.tokenizer.tokenize([element])[0] if e_id is None else self.tokens[e_id])
+        return tokenized
+
+    def get_element_id(self, tokens):
+        """
+        Gives the element id of a tokenized element returned by this store.
+
+        Args:
+            tokens: Tokenized element
+
+        Returns:
+            int: Element id or None if the element was not interned
+        """
+        return self.token_ids.get(id(tokens))
+
+    def similarity(self, x, y, sim_func) -> float:
+        """
+        Gives the raw similarity of two tokenized elements. It is cached if both
+        elements are interned.
+
+        Args:
+            x: Tokenized element x
+            y: Tokenized element y
+            sim_func (callable): Similarity function phi
+
+        Returns:
+            float: Similarity score without similarity threshold
+        """
+        x_id = self.token_ids.get(id(x))
+        y_id = self.token_ids.get(id(y))
+        if x_id is None or y_id is None:
+            return sim_func(x, y)
+
+        key = (x_id, y_id)
+        sim = self.sim_cache.get(key)
+        if sim is None:
+            sim = sim_func(x, y)
+            with self.lock:
+                if len(self.sim_cache) >= self.max_cache_size:
+                    self.sim_cache.clear()
+                self.sim_cache[key] = sim
+        return sim
@@ -0,0 +1,247 @@
+import time
+from collections import namedtuple
+
+# Everything the filters know about the current query
+FilterContext = namedtuple("FilterContext", [
+    "r_tokens", "signature", "inverted_index", "related_thresh", "candidate_selector", "hits"
+])
+
+
+class CandidateFilter:
+    """
+    Base class of the filters of the refinement step. A filter gets a set of
+    candidates together with the bounds computed by the filters before it and
+    gives the candidates that pass together with the bounds. The bounds are
+    the match maps of the candidates, c_idx -> dict{r_idx -> max_sim} (see
+    CandidateSelector.create_match_map), filters reuse them instead of
+    computing them again.
+
+    A filter must only prune sets that can't be related, then the results of
+    a search don't depend on the filters and their order. Subclasses set a
+    unique name and an estimated cost in seconds per candidate, which orders
+    the filters until their real cost has been measured.
+
+    Examples
+    --------
+    ```
+    >>> from silkmoth.filter_chain import CandidateFilter
+    >>> class EvenFilter(CandidateFilter):
+    ...     name = "even"
+    ...     cost = 1e-7
+    ...     def apply(self, context, candidates, bounds):
+    ...         return {c for c in candidates if c % 2 == 0}, bounds
+    >>> EvenFilter().apply(None, {1, 2, 3, 4}, {})
+    ({2, 4}, {})
+    ```
+    """
+    name = "filter"
+    cost = 1e-5
+
+    def apply(self, context, candidates, bounds) -> tuple:
+        """
+        Prunes candidates.
+
+        Args:
+            context (FilterContext): The current query
+            candidates (set): Candidate indices
+            bounds (dict): Match maps computed so far, c_idx -> dict{r_idx -> max_sim}
+
+        Returns:
+            tuple:
+                set: Candidate indices that pass the filter.
+                dict: Match maps including the ones computed by the filter.
+        """
+        raise NotImplementedError
+
+
+class SizeFilter(CandidateFilter):
+    """
+    Prunes candidates whose size rules out relatedness (see
+    CandidateSelector.verify_size). Candidate selection already applies it,
+    so it is only needed for candidates from other sources.
+    """
+    name = "size"
+    cost = 5e-7
+
+    def apply(self, context, candidates, bounds) -> tuple:
+        selector = context.candidate_selector
+        ref_size = len(context.r_tokens)
+        passed = {
+            c_idx for c_idx in candidates
+            if selector.verify_size(ref_size, len(context.inverted_index.get_set(c_idx)))
+        }
+        return passed, bounds
+
+
+class CheckFilter(CandidateFilter):
+    """
+    The check filter, see CandidateSelector.check_filter. Match maps computed
+    by the nearest neighbor filter are reused.
+    """
+    name = "check"
+    cost = 2e-5
+
+    def apply(self, context, candidates, bounds) -> tuple:
+        return context.candidate_selector.check_filter(
+            context.r_tokens, context.signature, candidates, context.inverted_index, context.hits, bounds
+        )
+
+
+class NNFilter(CandidateFilter):
+    """
+    The nearest neighbor filter, see CandidateSelector.nn_filter. Missing
+    match maps are computed and kept, so a later check filter reuses them.
+    """
+    name = "nn"
+    cost = 5e-5
+
+    def apply(self, context, candidates, bounds) -> tuple:
+        selector = context.candidate_selector
+        missing = [c_idx for c_idx in candidates if c_idx not in bounds]
+        if missing:
+            k_i_sets = [set(r_i).intersection(context.signature) for r_i in context.r_tokens]
+            for c_idx in missing:
+                bounds[c_idx] = selector.create_match_map(
+                    context.r_tokens, k_i_sets, c_idx, context.inverted_index, context.hits
+                )
+        passed = selector.nn_filter(
+            context.r_tokens, context.signature, candidates, context.inverted_index, context.related_thresh,
+            bounds, context.hits
+        )
+        return passed, bounds
+
+
+class FilterChain:
+    """
+    Runs the filters of the refinement step on the candidates of a query. The
+    candidates are filtered in chunks, and the filters of every chunk run in
+    the order of their pruned fraction per unit of cost, which is the best
+    order for independent filters. Costs and pass rates start with the
+    filters' estimates and are updated from every chunk (exponential moving
+    average).
+
+    With drop=True a filter is not run for the remaining chunks of a query
+    once it costs more than it saves, i.e. its time exceeds the number of
+    candidates it pruned times the verification cost of a candidate. This
+    changes the number of verified candidates but not the related sets.
+
+    The candidates, pruned candidates and time of every filter of the last
+    query are kept in last_stats.
+
+    Examples
+    --------
+    ```
+    >>> from silkmoth.filter_chain import FilterChain, CheckFilter, NNFilter
+    >>> chain = FilterChain([CheckFilter(), NNFilter()])
+    >>> [f.name for f in chain.order(chain.filters)]
+    ['check', 'nn']
+    >>> chain.pass_rates["check"] = 0.9
+    >>> [f.name for f in chain.order(chain.filters)]
+    ['nn', 'check']
+    ```
+    """
+
+    def __init__(self, filters, drop=False, min_candidates=64, smoothing=0.2, verify_cost=2e-4):
+        """
+        Initialize the filter chain.
+
+        Args:
+            filters (list): Filters (CandidateFilter) with unique names
+            drop (bool): Flag to stop running filters that don't pay off
+            min_candidates (int): Number of candidates a filter sees in a
+                query before it can be dropped
+            smoothing (float): Weight of a new observation in the moving
+                averages of costs and pass rates
+            verify_cost (float): Initial verification cost in seconds per
+                candidate
+        """
+        names = [f.name for f in filters]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Filter names must be unique: {names}")
+        self.filters = list(filters)
+        self.drop = drop
+        self.min_candidates = min_candidates
+        self.smoothing = smoothing
+        self.verify_cost = verify_cost
+        self.costs = {f.name: f.cost for f in self.filters}
+        self.pass_rates = {f.name: 0.5 for f in self.filters}
+        self.last_stats = {}
+
+    def _update(self, table, key, value):
+        table[key] = (1 - self.smoothing) * table[key] + self.smoothing * value
+
+    def order(self, filters) -> list:
+        """
+        Orders filters by their pruned fraction per unit of cost.
+
+        Args:
+            filters (list): Filters to order
+
+        Returns:
+            list: Filters in execution order
+        """
+        return sorted(filters, key=lambda f: -(1 - self.pass_rates[f.name]) / max(self.costs[f.name], 1e-12))
+
+    def run(self, context, candidates, chunk_size=256, skip=()):
+        """
+        Filters the candidates chunk by chunk.
+
+        Args:
+            context (FilterContext): The current query
+            candidates (set): Candidate indices
+            chunk_size (int): Number of candidates per chunk
+            skip (iterable): Names of filters that don't run for this query
+
+        Yields:
+            list: Candidate indices of a chunk that passed all filters, in
+                ascending order.
+        """
+        active = [f for f in self.filters if f.name not in skip]
+        stats = {f.name: {"candidates": 0, "pruned": 0, "time": 0.0, "dropped": False} for f in active}
+        self.last_stats = stats
+        ordered = sorted(candidates)
+
+        for start in range(0, len(ordered), chunk_size):
+            chunk = ordered[start:start + chunk_size]
+            if not active:
+                yield chunk
+                continue
+            passed = set(chunk)
+            bounds = dict()
+            for candidate_filter in self.order(active):
+                if not passed:
+                    break
+                seen = len(passed)
+                time_start = time.perf_counter()
+                passed, bounds = candidate_filter.apply(context, passed, bounds)
+                elapsed = time.perf_counter() - time_start
+
+                filter_stats = stats[candidate_filter.name]
+                filter_stats["candidates"] += seen
+                filter_stats["pruned"] += seen - len(passed)
+                filter_stats["time"] += elapsed
+                self._update(self.costs, candidate_filter.name, elapsed / seen)
+                self._update(self.pass_rates, candidate_filter.name, len(passed) / seen)
+
+            if self.drop:
+                active = [f for f in active if self._pays_off(stats[f.name])]
+            yield [c_idx for c_idx in chunk if c_idx in passed]
+
+    def _pays_off(self, filter_stats) -> bool:
+        if filter_stats["candidates"] < self.min_candidates:
+            return True
+        if filter_stats["time"] <= filter_stats["pruned"] * self.verify_cost:
+            return True
+        filter_stats["dropped"] = True
+        return False
+
+    def observe_verification(self, candidates, seconds):
+        """
+        Updates the verification cost, which decides whether filters pay off.
+
+        Args:
+            candidates (int): Number of verified candidates
+            seconds (float): Verification time
+        """
+        if candidates:
+            self.verify_cost = (1 - self.smoothing) * self.verify_cost + self.smoothing * seconds / candidates
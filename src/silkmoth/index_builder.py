@@ -0,0 +1,345 @@
+import heapq
+import math
+import os
+import pickle
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from .element_store import ElementStore
+from .inverted_index import InvertedIndex, add_postings, TUPLE_BYTES, SET_ID_BUDGET
+
+# Size of an empty inverted list and its lookup table entry in bytes, the
+# (set, element) tuples are counted with TUPLE_BYTES
+LIST_BYTES = sys.getsizeof([]) + 3 * 8
+
+
+def partial_lists_bytes(num_lists: int, postings: int) -> int:
+    """
+    Gives the memory of partial inverted lists during the build. The tokens
+    are shared with the tokenized sets and not counted.
+
+    Args:
+        num_lists (int): Number of inverted lists
+        postings (int): Number of (set, element) tuples of all lists
+
+    Returns:
+        int: Size in bytes
+    """
+    return num_lists * LIST_BYTES + postings * TUPLE_BYTES
+
+
+def _write_run(items, directory: str, run_id: int) -> str:
+    """
+    Writes partial inverted lists sorted by token to a run file.
+
+    Args:
+        items (iterable): (token, inverted list) tuples sorted by token
+        directory (str): Directory for the run files
+        run_id (int): Number of the run
+
+    Returns:
+        str: Path of the run file
+    """
+    path = os.path.join(directory, f"run_{run_id}.pkl")
+    with open(path, "wb") as run_file:
+        for item in items:
+            pickle.dump(item, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path: str):
+    """
+    Reads the (token, inverted list) records of a run file one by one.
+
+    Args:
+        path (str): Path of the run file
+
+    Yields:
+        tuple: Token and its partial inverted list
+    """
+    with open(path, "rb") as run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
+
+
+def _build_chunk(tokenizer, offset: int, source_sets: list) -> tuple:
+    """
+    Tokenizes a chunk of source sets and builds its partial inverted lists.
+    Runs in a worker process of the parallel build.
+
+    Args:
+        tokenizer (Tokenizer): Tokenizer for the raw sets
+        offset (int): Index of the first set of the chunk
+        source_sets (list): Chunk of "raw" source sets
+
+    Returns:
+        (list, list, int):  Tokenized sets, (token, inverted list) tuples 
+                            sorted by token and the number of postings.
+    """
+    token_sets = []
+    lookup_table = dict()
+    postings = 0
+    for set_idx, source_set in enumerate(source_sets, start=offset):
+        token_set = tokenizer.tokenize(source_set)
+        token_sets.append(token_set)
+        postings += add_postings(lookup_table, set_idx, token_set)
+    return token_sets, sorted(lookup_table.items()), postings
+
+
+def merge_runs(runs) -> dict:
+    """
+    Merges runs of partial inverted lists with a k-way merge over the tokens.
+    Every run has to be sorted by token and the runs have to be ordered by the
+    set indices they cover, so concatenating the partial lists of a token in
+    run order keeps its inverted list sorted.
+
+    Args:
+        runs (list): Iterables of (token, inverted list) tuples
+
+    Returns:
+        dict: Token to inverted list mapping
+    """
+    lookup_table = dict()
+    # heapq.merge is stable, so equal tokens are emitted in run order
+    for token, postings in heapq.merge(*runs, key=itemgetter(0)):
+        if token in lookup_table:
+            lookup_table[token].extend(postings)
+        else:
+            lookup_table[token] = postings
+    return lookup_table
+
+
+class StreamingIndexBuilder:
+    """
+    Builds an [InvertedIndex](inverted_index.md) from any iterable or generator
+    of raw sets, e.g. a streaming JSONL reader. The raw sets are tokenized one
+    at a time and never kept.
+
+    The inverted lists are built in memory until their size (see
+    partial_lists_bytes(...)) exceeds the memory budget. Then they are
+    spilled to disk as a run sorted by token. At the end all runs are merged
+    into the final inverted lists. The budget only bounds the memory of the
+    partial inverted lists during the build. The tokenized sets are kept in
+    memory for the whole build, since the index and the verification need
+    them, so the peak memory still grows with the dataset (about
+    token_set_bytes(...) per set, see estimate_memory(...)), as does the
+    merged index.
+
+    With more than one worker, chunks of sets are tokenized and turned into 
+    partial inverted lists in a process pool. The partial lists of all chunks
+    are merged with the same k-way merge, so the inverted lists stay sorted 
+    by (set, element) as required by get_indexes_binary(...). If the sets are
+    tokenized by an [ElementStore](element_store.md), every chunk is interned
+    into an empty store in its worker and merged into the builder's store.
+
+    Examples
+    --------
+    ```
+    >>> from silkmoth.index_builder import StreamingIndexBuilder
+    >>> from silkmoth.tokenizer import Tokenizer
+    >>> from silkmoth.utils import jaccard_similarity
+    >>> sets = (["Apple Pear", "Apple Sun"] for _ in range(3))
+    >>> builder = StreamingIndexBuilder(Tokenizer(jaccard_similarity), memory_budget=0.0001)
+    >>> I = builder.build(sets)
+    >>> I.get_indexes("Sun")
+    [(0, 1), (1, 1), (2, 1)]
+    ```
+    """
+
+    def __init__(self, tokenizer, memory_budget=None, tmp_dir=None, workers=1, chunk_size=10_000, stop_df=None,
+                 materialize_budget=None, compress=False, set_id_budget=SET_ID_BUDGET):
+        """
+        Initialize the streaming index builder.
+
+        Args:
+            tokenizer (Tokenizer): Tokenizer for the raw sets
+            memory_budget (float): Memory budget for the partial inverted 
+                lists in MB, None to never spill to disk. The tokenized sets
+                and the final index are not part of the budget.
+            tmp_dir (str): Directory for the run files, defaults to the system's
+                temporary directory
+            workers (int): Number of worker processes for tokenization and 
+                building the partial inverted lists
+            chunk_size (int): Number of sets per chunk of the parallel build
+            stop_df (float): Fraction of sets above which a token is a stop
+                token without materialized list, see 
+                [InvertedIndex](inverted_index.md)
+            materialize_budget (int): Maximum number of (set, element) tuples
+                of lists built on demand that are kept
+            compress (bool): Flag to store the inverted lists compressed
+            set_id_budget (int): Maximum number of bytes of cached set ids of
+                the index
+        """
+        self.tokenizer = tokenizer
+        self.memory_budget = memory_budget
+        self.tmp_dir = tmp_dir
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.stop_df = stop_df
+        self.materialize_budget = materialize_budget
+        self.compress = compress
+        self.set_id_budget = set_id_budget
+
+    def estimate_memory(self, sample_sets, num_sets) -> dict:
+        """
+        Predicts the memory of the index of num_sets sets from a sample of 
+        them, before building it. The sample is tokenized and indexed with 
+        the same settings. 
+        Tokenized sets and (set, element) tuples grow linearly with the 
+        number of sets, the vocabulary grows like n^beta (Heaps' law), where
+        beta is fitted from the vocabularies of both halves of the sample.
+
+        Args:
+            sample_sets (iterable): Uniform random sample of "raw" source sets,
+                e.g. from a reservoir sample
+            num_sets (int): Number of sets of the full collection
+
+        Returns:
+            dict:   Estimated number of sets, tokens (vocabulary) and 
+                    (set, element) tuples of materialized lists, and the 
+                    estimated memory in bytes of the structures of 
+                    InvertedIndex.memory_usage(...) without the query caches.
+        """
+        token_sets = [self.tokenizer.tokenize(s) for s in sample_sets]
+        if not token_sets:
+            raise ValueError("The sample must not be empty")
+        scale = num_sets / len(token_sets)
+        index = InvertedIndex(token_sets, self.stop_df, compress=self.compress)
+        memory = index.memory_usage()
+
+        vocabulary = len(index.keys())
+        half = len(token_sets) // 2
+        half_vocabulary = len({token for token_set in token_sets[:half] for tokens in token_set for token in tokens})
+        beta = 1.0
+        if half and half_vocabulary and vocabulary > half_vocabulary:
+            beta = min(1.0, math.log(vocabulary / half_vocabulary) / math.log(len(token_sets) / half))
+        elif half:
+            # the vocabulary is saturated
+            beta = 0.0
+        vocabulary_scale = scale ** beta
+
+        postings = sum(len(inverted_list) for inverted_list in index.lookup_table.values())
+        estimate = {
+            "lookup_table": int(memory["postings"] * scale + (memory["lookup_table"] - memory["postings"]) * vocabulary_scale),
+            "postings": int(memory["postings"] * scale),
+            "cost_table": int(memory["cost_table"] * vocabulary_scale),
+            "set_sizes": 8 * num_sets,
+            "token_sets": int(memory["token_sets"] * scale),
+        }
+        estimate["total"] = sum(size for key, size in estimate.items() if key != "postings")
+        return {
+            "sets": num_sets,
+            "vocabulary": int(vocabulary * vocabulary_scale),
+            "postings": int(postings * scale),
+            "memory": estimate,
+        }
+
+    def _max_bytes(self) -> float:
+        if self.memory_budget is None:
+            return float("inf")
+        return self.memory_budget * 1024 ** 2
+
+    def build(self, source_sets) -> InvertedIndex:
+        """
+        Tokenizes all source sets and creates the inverted index.
+
+        Args:
+            source_sets (iterable): Iterable of "raw" source sets
+
+        Returns:
+            InvertedIndex: Inverted index
+        """
+        if self.workers > 1:
+            return self._build_parallel(source_sets)
+        if self.memory_budget is None:
+            return InvertedIndex((self.tokenizer.tokenize(s) for s in source_sets), self.stop_df,
+                                 self.materialize_budget, self.compress, self.set_id_budget)
+
+        max_bytes = self._max_bytes()
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as run_dir:
+            token_sets = []
+            lookup_table = dict()
+            postings = 0
+            run_paths = []
+
+            for set_idx, source_set in enumerate(source_sets):
+                token_set = self.tokenizer.tokenize(source_set)
+                token_sets.append(token_set)
+                postings += add_postings(lookup_table, set_idx, token_set)
+                if partial_lists_bytes(len(lookup_table), postings) >= max_bytes:
+                    run_paths.append(_write_run(sorted(lookup_table.items()), run_dir, len(run_paths)))
+                    lookup_table = dict()
+                    postings = 0
+
+            if run_paths:
+                if lookup_table:
+                    run_paths.append(_write_run(sorted(lookup_table.items()), run_dir, len(run_paths)))
+                lookup_table = merge_runs([_read_run(path) for path in run_paths])
+
+        return InvertedIndex.from_lookup_table(token_sets, lookup_table, self.stop_df,
+                                               self.materialize_budget, self.compress, self.set_id_budget)
+
+    def _build_parallel(self, source_sets) -> InvertedIndex:
+        """
+        Builds the inverted index with a process pool. Partial inverted lists
+        are kept in memory as long as they fit into the memory budget, 
+        otherwise they are spilled to disk.
+
+        Args:
+            source_sets (iterable): Iterable of "raw" source sets
+
+        Returns:
+            InvertedIndex: Inverted index
+        """
+        max_bytes = self._max_bytes()
+        token_sets = []
+        runs = []
+        in_memory_bytes = 0
+
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as run_dir, \
+                ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+
+            # the store of the builder is not sent to the workers, their elements are merged into it
+            element_store = self.tokenizer if isinstance(self.tokenizer, ElementStore) else None
+            tokenizer = self.tokenizer if element_store is None else ElementStore(element_store.tokenizer)
+
+            def collect():
+                nonlocal in_memory_bytes
+                future, chunk = pending.popleft()
+                chunk_token_sets, items, postings = future.result()
+                if element_store is not None:
+                    chunk_token_sets = element_store.merge(chunk, chunk_token_sets)
+                token_sets.extend(chunk_token_sets)
+                chunk_bytes = partial_lists_bytes(len(items), postings)
+                if in_memory_bytes + chunk_bytes > max_bytes:
+                    runs.append(_read_run(_write_run(items, run_dir, len(runs))))
+                else:
+                    runs.append(items)
+                    in_memory_bytes += chunk_bytes
+
+            source_iter = iter(source_sets)
+            offset = 0
+            while True:
+                chunk = list(islice(source_iter, self.chunk_size))
+                if not chunk:
+                    break
+                future = pool.submit(_build_chunk, tokenizer, offset, chunk)
+                pending.append((future, chunk if element_store is not None else None))
+                offset += len(chunk)
+                # bound the number of chunks in flight
+                if len(pending) >= 2 * self.workers:
+                    collect()
+            while pending:
+                collect()
+
+            lookup_table = merge_runs(runs)
+
+        return InvertedIndex.from_lookup_table(token_sets, lookup_table, self.stop_df,
+                                               self.materialize_budget, self.compress, self.set_id_budget)
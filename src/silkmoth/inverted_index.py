@@ -1,4 +1,102 @@
 import bisect
+import heapq
+import sys
+from collections import Counter, OrderedDict
+from operator import itemgetter
+import numpy as np
+from .compressed_postings import CompressedPostings
+
+# Number of evenly spaced sets whose memory is measured to estimate the 
+# memory of all tokenized sets
+MEMORY_SAMPLE_SETS = 1000
+
+# Memory of one (set, element) tuple in a Python inverted list, the tuple
+# and its list slot. The set and element ids are shared or cached ints.
+TUPLE_BYTES = sys.getsizeof((0, 0)) + 8
+
+# Default memory budget of the cached set ids of inverted lists in bytes
+SET_ID_BUDGET = 64 * 1024 ** 2
+
+def add_postings(lookup_table: dict, set_idx: int, token_set: list) -> int:
+    """
+    Appends the (set, element) tuples of one tokenized set to the inverted 
+    lists of a lookup table. Sets have to be added in ascending order of their
+    index to keep the inverted lists sorted.
+
+    Args:
+        lookup_table (dict): Token to inverted list mapping
+        set_idx (int): Index of the tokenized set
+        token_set (list): Tokenized set
+
+    Returns:
+        int: Number of added (set, element) tuples
+    """
+    added = 0
+    for element_idx, tokens in enumerate(token_set):
+        for token in tokens:
+            key = (set_idx, element_idx)
+            if token not in lookup_table:
+                lookup_table[token] = [key]
+                added += 1
+            elif lookup_table[token][-1] != key:
+                lookup_table[token].append(key)
+                added += 1
+    return added
+
+
+def token_set_bytes(token_set) -> int:
+    """
+    Gives the memory of a tokenized set, including its elements and tokens.
+
+    Args:
+        token_set (list): Tokenized set
+
+    Returns:
+        int: Size in bytes
+    """
+    size = sys.getsizeof(token_set)
+    for tokens in token_set:
+        size += sys.getsizeof(tokens)
+        for token in tokens:
+            size += sys.getsizeof(token)
+    return size
+
+
+def distribution(values, log_buckets=False) -> dict:
+    """
+    Summarizes a distribution of non-negative integers.
+
+    Args:
+        values (np.ndarray): Values
+        log_buckets (bool): Flag to count the values in buckets [2^k, 2^(k+1))
+            instead of per value, for heavy-tailed distributions
+
+    Returns:
+        dict: Histogram (value or lower bucket bound -> count), mean and the
+              50th, 90th, 99th and 100th percentiles.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return {"histogram": {}, "mean": 0.0, "percentiles": {}}
+    if log_buckets:
+        buckets = np.zeros(len(values), dtype=np.int64)
+        positive = values > 0
+        buckets[positive] = 2 ** np.floor(np.log2(values[positive])).astype(np.int64)
+        keys, counts = np.unique(buckets, return_counts=True)
+    else:
+        keys, counts = np.unique(values, return_counts=True)
+    percentiles = np.percentile(values, [50, 90, 99, 100])
+    return {
+        "histogram": dict(zip(keys.tolist(), counts.tolist())),
+        "mean": float(values.mean()),
+        "percentiles": dict(zip([50, 90, 99, 100], percentiles.tolist())),
+    }
+
+
+def _max_df(stop_df, num_sets) -> float:
+    # number of sets above which a token is a stop token
+    return float("inf") if stop_df is None else stop_df * num_sets
+
 
 class InvertedIndex:
     """
@@ -13,6 +111,21 @@ class InvertedIndex:
     
     - is sorted first by the order of the sets and then by the order of the elements.
 
+    Stop tokens, which occur in more than a fraction stop_df of all sets 
+    (e.g. "the" or digits of word tokens), only keep their costs (inverted
+    list lengths). Signatures rarely select such frequent tokens, so their
+    inverted lists are only materialized on first access. Lookups of such a
+    token in single sets scan these sets instead of materializing its list.
+    A materialization budget bounds the postings of materialized lists, the
+    least recently used ones are dropped again.
+    The distinct set ids of inverted lists (see get_set_ids) are cached 
+    within a budget in bytes the same way.
+
+    With compress=True the inverted lists are stored as 
+    [CompressedPostings](compressed_postings.md), which take a few bytes per
+    (set, element) tuple. get_indexes(...) decodes them, the lookups of sets
+    only decode the blocks containing the sets.
+
     Examples
     --------
     ```
@@ -33,27 +146,99 @@ class InvertedIndex:
     Licensed under CC BY-NC-ND 4.0.*
     """
 
-    def __init__(self, token_sets: list):
+    def __init__(self, token_sets: list, stop_df=None, materialize_budget=None, compress=False,
+                 set_id_budget=SET_ID_BUDGET):
         """
         Initialize the inverted index.
 
         Args:
-            token_sets (list): Collection of tokenized sets
-            sim_func (function): Similarity function
+            token_sets (list): Collection (or any iterable) of tokenized sets
+            stop_df (float): Fraction of sets above which a token is a stop
+                token, whose list is built on demand. None for no stop tokens.
+            materialize_budget (int): Maximum number of (set, element) tuples
+                of lists built on demand that are kept. None to keep all.
+            compress (bool): Flag to store the inverted lists compressed
+            set_id_budget (int): Maximum number of bytes of cached set ids,
+                the least recently used ones are dropped. None to keep all.
         """
-        #self.sim_func = sim_func
         self.token_sets = []
         self.lookup_table = dict()
+        self.cost_table = dict()    # token -> cost of not materialized lists
+        self.set_id_budget = set_id_budget
+        self.set_id_cache = OrderedDict()   # token -> distinct set ids of its inverted list, in LRU order
+        self.set_id_bytes = 0
+        self.set_sizes = None
+        self.materialize_budget = materialize_budget
+        self.materialized = OrderedDict()   # token -> cost of lists built on demand, in LRU order
+        self.materialized_postings = 0
+        self.compress = compress
 
-        for set_idx, token_set in enumerate(token_sets):
-            self.token_sets.append(token_set)
-            for element_idx, tokens in enumerate(token_set):
-                for token in tokens:
-                    key = (set_idx, element_idx)
-                    if token not in self.lookup_table:
-                        self.lookup_table[token] = [key]
-                    elif self.lookup_table[token][-1] != key:
-                        self.lookup_table[token].append(key)
+        if stop_df is None:
+            for set_idx, token_set in enumerate(token_sets):
+                self.token_sets.append(token_set)
+                add_postings(self.lookup_table, set_idx, token_set)
+            self._compress_lists()
+            return
+
+        # count first, so no (set, element) tuples of frequent tokens are created
+        self.token_sets = list(token_sets)
+        costs = Counter()
+        dfs = Counter()
+        for token_set in self.token_sets:
+            set_tokens = set()
+            for tokens in token_set:
+                element_tokens = set(tokens)
+                costs.update(element_tokens)
+                set_tokens |= element_tokens
+            dfs.update(set_tokens)
+        max_df = _max_df(stop_df, len(self.token_sets))
+        self.cost_table = {token: cost for token, cost in costs.items() if dfs[token] > max_df}
+        frequent = self.cost_table
+        for set_idx, token_set in enumerate(self.token_sets):
+            if frequent:
+                token_set = [[t for t in tokens if t not in frequent] for tokens in token_set]
+            add_postings(self.lookup_table, set_idx, token_set)
+        self._compress_lists()
+
+    @classmethod
+    def from_lookup_table(cls, token_sets: list, lookup_table: dict, stop_df=None,
+                          materialize_budget=None, compress=False, set_id_budget=SET_ID_BUDGET):
+        """
+        Creates an inverted index from already built inverted lists, e.g. by
+        the [StreamingIndexBuilder](index_builder.md).
+
+        Args:
+            token_sets (list): Collection of tokenized sets
+            lookup_table (dict): Token to sorted inverted list mapping
+            stop_df (float): Fraction of sets above which the list of a 
+                (stop) token is dropped and rebuilt on demand. None to keep all.
+            materialize_budget (int): Maximum number of (set, element) tuples
+                of lists built on demand that are kept. None to keep all.
+            compress (bool): Flag to store the inverted lists compressed
+            set_id_budget (int): Maximum number of bytes of cached set ids.
+                None to keep all.
+
+        Returns:
+            InvertedIndex: Inverted index
+        """
+        index = cls([], materialize_budget=materialize_budget, compress=compress, set_id_budget=set_id_budget)
+        index.token_sets = token_sets
+        index.lookup_table = lookup_table
+        max_df = _max_df(stop_df, len(token_sets))
+        frequent = []
+        for token, postings in lookup_table.items():
+            # the df is at most the list length, so only long lists are counted
+            if len(postings) > max_df and len({set_idx for set_idx, _ in postings}) > max_df:
+                frequent.append(token)
+        for token in frequent:
+            index.cost_table[token] = len(lookup_table.pop(token))
+        index._compress_lists()
+        return index
+
+    def _compress_lists(self):
+        if self.compress:
+            for token, postings in self.lookup_table.items():
+                self.lookup_table[token] = CompressedPostings(postings)
 
     def keys(self):
         """
@@ -62,8 +247,58 @@ class InvertedIndex:
         Returns:
             set (set): A set-like object providing all keys
         """
+        if self.cost_table:
+            return self.lookup_table.keys() | self.cost_table.keys()
         return self.lookup_table.keys()
 
+    def _materialize(self, token):
+        """
+        Builds the inverted list of a token whose list was not materialized by
+        scanning all tokenized sets. If the materialized lists exceed the 
+        materialization budget, the least recently used ones are dropped.
+
+        Args:
+            token (str): Input token
+        """
+        postings = []
+        for set_idx, token_set in enumerate(self.token_sets):
+            for element_idx, tokens in enumerate(token_set):
+                if token in tokens:
+                    postings.append((set_idx, element_idx))
+        self.lookup_table[token] = CompressedPostings(postings) if self.compress else postings
+        del self.cost_table[token]
+        self.materialized[token] = len(postings)
+        self.materialized_postings += len(postings)
+
+        if self.materialize_budget is None:
+            return
+        # the new list is kept even if it exceeds the budget on its own
+        while self.materialized_postings > self.materialize_budget and len(self.materialized) > 1:
+            evicted, cost = self.materialized.popitem(last=False)
+            del self.lookup_table[evicted]
+            self._drop_set_ids(evicted)
+            self.cost_table[evicted] = cost
+            self.materialized_postings -= cost
+
+    def _scan(self, token, set_idx) -> list:
+        """
+        Gives the (set, element) tuples of a not materialized token in one set
+        by scanning the set.
+
+        Args:
+            token (str): Input token
+            set_idx (int): Set index
+
+        Returns:
+            list: All (set_idx, element_idx) tuples of the set containing the token
+        """
+        if set_idx < 0 or set_idx >= len(self.token_sets):
+            return []
+        return [
+            (set_idx, element_idx) for element_idx, tokens in enumerate(self.token_sets[set_idx])
+            if token in tokens
+        ]
+
     def __getitem__(self, token) -> list:
         """
         Access inverted list from inverted index using square brackets.
@@ -91,10 +326,101 @@ class InvertedIndex:
             list:   A list of all (set index, element index) tuples for (set, 
                     element) tuples which contain the input tuple
         """
+        postings = self._get_postings(token)
+        return postings.to_list() if self.compress else postings
+
+    def _get_postings(self, token):
+        """
+        Gives the stored inverted list of a token, it is materialized if 
+        needed.
+
+        Args:
+            token (str): Input token
+
+        Returns:
+            list | CompressedPostings: Inverted list
+        """
         if not token in self.lookup_table:
-            raise ValueError(f"Unknown token") 
-        return self.lookup_table[token] 
+            if token not in self.cost_table:
+                raise ValueError(f"Unknown token") 
+            self._materialize(token)
+        elif token in self.materialized:
+            self.materialized.move_to_end(token)
+        return self.lookup_table[token]
     
+    def get_cost(self, token) -> int:
+        """
+        Gives the cost of a token, i.e. the length of its inverted list. The 
+        signature generator only needs these costs, so other index 
+        implementations can provide them without exposing the inverted lists.
+
+        Args:
+            token (str): Input token
+
+        Returns:
+            int: Number of (set, element) tuples which contain the token
+        """
+        if token not in self.lookup_table:
+            if token not in self.cost_table:
+                raise ValueError(f"Unknown token")
+            return self.cost_table[token]
+        return len(self.lookup_table[token])
+
+    def get_set_ids(self, token) -> np.ndarray:
+        """
+        Gives the distinct set ids of a token's inverted list as a sorted
+        array. The arrays are cached within the set id budget, so bitmap 
+        based candidate selection converts frequently used inverted lists 
+        only once.
+
+        Args:
+            token (str): Input token
+
+        Returns:
+            np.ndarray: Sorted distinct set ids of all sets containing the token
+        """
+        set_ids = self.set_id_cache.get(token)
+        if set_ids is not None:
+            self.set_id_cache.move_to_end(token)
+            return set_ids
+
+        postings = self._get_postings(token)
+        if self.compress:
+            set_ids = postings.set_ids()
+        else:
+            set_ids = np.fromiter((s for s, _ in postings), dtype=np.int64, count=len(postings))
+        if len(set_ids) > 1:
+            # inverted lists are sorted by set id
+            set_ids = set_ids[np.concatenate(([True], set_ids[1:] != set_ids[:-1]))]
+
+        if self.set_id_budget is not None and set_ids.nbytes > self.set_id_budget:
+            return set_ids
+        self.set_id_cache[token] = set_ids
+        self.set_id_bytes += set_ids.nbytes
+        if self.set_id_budget is not None:
+            while self.set_id_bytes > self.set_id_budget:
+                self._drop_set_ids(next(iter(self.set_id_cache)))
+        return set_ids
+
+    def _drop_set_ids(self, token):
+        set_ids = self.set_id_cache.pop(token, None)
+        if set_ids is not None:
+            self.set_id_bytes -= set_ids.nbytes
+
+    def get_set_sizes(self) -> np.ndarray:
+        """
+        Gives the sizes (number of elements) of all sets as an array indexed
+        by set id.
+
+        Returns:
+            np.ndarray: Set sizes
+        """
+        if self.set_sizes is None or len(self.set_sizes) != len(self.token_sets):
+            self.set_sizes = np.fromiter(
+                (len(token_set) for token_set in self.token_sets), dtype=np.int64, count=len(self.token_sets)
+            )
+        return self.set_sizes
+
     def get_set(self, set_id: int) -> list:
         """
         Access (tokenized) set from set ID.
@@ -121,20 +447,148 @@ class InvertedIndex:
         Returns:
             list: All (set_idx, element_idx) tuples where the token appears in the given set.
         """
-        if token not in self.lookup_table:
-            raise ValueError("Unknown token")
-
-        index_list = self.lookup_table[token]
+        if token in self.cost_table:
+            # scanning one set is cheaper than materializing the list
+            return self._scan(token, set_idx)
+        if self.compress:
+            return self._get_postings(token).lookup(set_idx)
+        index_list = self.get_indexes(token)
 
         # Using bisect to find the range of entries where set_idx matches
         left = bisect.bisect_left(index_list, (set_idx, -1))
         right = bisect.bisect_right(index_list, (set_idx, float('inf')))
         return index_list[left:right]
     
+    def get_indexes_skip(self, token, set_ids) -> dict:
+        """
+        Gets the element indexes of a token for many sets at once. The sets
+        are probed in ascending order with galloping (exponential) search, so 
+        entries of sets that are not asked for are skipped instead of walked.
+
+        Args:
+            token (str): The token to search in the inverted index.
+            set_ids (list): Ascending set ids to probe.
+
+        Returns:
+            dict: set_idx -> element indexes of the set containing the token,
+                  sets without the token are left out.
+        """
+        if token in self.cost_table:
+            result = dict()
+            for set_idx in set_ids:
+                element_idxs = [element_idx for _, element_idx in self._scan(token, set_idx)]
+                if element_idxs:
+                    result[set_idx] = element_idxs
+            return result
+        if self.compress:
+            return self._get_postings(token).lookup_many(set_ids)
+        index_list = self.get_indexes(token)
+        n = len(index_list)
+        result = dict()
+        pos = 0
+        for set_idx in set_ids:
+            if pos >= n:
+                break
+            if index_list[pos][0] < set_idx:
+                # gallop to a bound, then binary search between the last two probes
+                bound = 1
+                while pos + bound < n and index_list[pos + bound][0] < set_idx:
+                    bound *= 2
+                pos = bisect.bisect_left(index_list, (set_idx, -1), pos + bound // 2, min(pos + bound, n))
+            element_idxs = []
+            while pos < n and index_list[pos][0] == set_idx:
+                element_idxs.append(index_list[pos][1])
+                pos += 1
+            if element_idxs:
+                result[set_idx] = element_idxs
+        return result
+
+    def stats(self, top_k=10) -> dict:
+        """
+        Gives statistics of the index, e.g. to choose stop tokens, q or the
+        number of shards.
+
+        Args:
+            top_k (int): Number of most frequent tokens
+
+        Returns:
+            dict:   Number of sets, elements, tokens (vocabulary), stop tokens
+                    (tokens without materialized list) and (set, element) 
+                    tuples, the distributions of inverted list lengths, set 
+                    sizes and element sizes (tokens per element, see 
+                    distribution(...)), the top_k tokens with the longest 
+                    inverted lists as (token, cost) pairs and the memory of
+                    the index (see memory_usage(...)).
+        """
+        costs = {token: self.get_cost(token) for token in self.keys()}
+        lengths = np.fromiter(costs.values(), dtype=np.int64, count=len(costs))
+        element_sizes = np.fromiter(
+            (len(tokens) for token_set in self.token_sets for tokens in token_set), dtype=np.int64
+        )
+        return {
+            "sets": len(self.token_sets),
+            "elements": len(element_sizes),
+            "vocabulary": len(costs),
+            "stop_tokens": len(self.cost_table),
+            "postings": int(lengths.sum()),
+            "posting_lengths": distribution(lengths, log_buckets=True),
+            "top_tokens": heapq.nlargest(top_k, costs.items(), key=itemgetter(1)),
+            "set_sizes": distribution(self.get_set_sizes()),
+            "element_sizes": distribution(element_sizes),
+            "memory": self.memory_usage(),
+        }
+
+    def memory_usage(self) -> dict:
+        """
+        Gives the memory of the structures of the index in bytes. The memory 
+        of the tokenized sets is extrapolated from a sample of 
+        MEMORY_SAMPLE_SETS sets, the other structures are measured.
+
+        Returns:
+            dict:   Bytes of the inverted lists ("lookup_table"), the costs of
+                    not materialized lists ("cost_table"), the cached set ids
+                    ("set_id_cache"), the set sizes ("set_sizes"), the 
+                    tokenized sets ("token_sets") and their sum ("total").
+                    "postings" is the part of "lookup_table" that grows with
+                    the number of (set, element) tuples.
+        """
+        postings = 0
+        lookup_table = sys.getsizeof(self.lookup_table)
+        for inverted_list in self.lookup_table.values():
+            if self.compress:
+                postings += len(inverted_list.data)
+                lookup_table += sys.getsizeof(inverted_list) + sys.getsizeof(inverted_list.data)
+                if inverted_list.skips is not None:
+                    lookup_table += sys.getsizeof(inverted_list.skips)
+            else:
+                postings += len(inverted_list) * TUPLE_BYTES
+                lookup_table += sys.getsizeof(inverted_list) + (TUPLE_BYTES - 8) * len(inverted_list)
+
+        set_id_cache = sys.getsizeof(self.set_id_cache) + sum(
+            sys.getsizeof(set_ids) for set_ids in self.set_id_cache.values()
+        )
+        num_sets = len(self.token_sets)
+        step = max(1, num_sets // MEMORY_SAMPLE_SETS)
+        sample = self.token_sets[::step]
+        token_sets = sys.getsizeof(self.token_sets)
+        if sample:
+            token_sets += sum(token_set_bytes(token_set) for token_set in sample) * num_sets // len(sample)
+
+        usage = {
+            "lookup_table": lookup_table,
+            "postings": postings,
+            "cost_table": sys.getsizeof(self.cost_table),
+            "set_id_cache": set_id_cache,
+            "set_sizes": self.set_sizes.nbytes if self.set_sizes is not None else 0,
+            "token_sets": token_sets,
+        }
+        usage["total"] = sum(size for key, size in usage.items() if key != "postings")
+        return usage
+
     def print_index(self):
         """
         Prints the inverted index in a readable format.
         """
         print("=== Inverted Index ===")
-        for token, locations in self.lookup_table.items():
-            print(f"Token: {token} → Locations: {locations}")
\ No newline at end of file
+        for token in self.lookup_table:
+            print(f"Token: {token} → Locations: {self.get_indexes(token)}")
\ No newline at end of file
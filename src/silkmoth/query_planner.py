@@ -0,0 +1,223 @@
+import random
+import time
+from collections import namedtuple
+from .utils import SigType
+
+# A plan is a signature scheme and the filters to apply
+QueryPlan = namedtuple("QueryPlan", [
+    "sig_type", "is_check_filter", "is_nn_filter", "estimated_cost", "estimated_candidates", "postings"
+])
+
+# (check filter, nn filter) combinations
+FILTER_MODES = ((False, False), (True, False), (False, True), (True, True))
+
+
+class QueryPlanner:
+    """
+    The query planner picks the signature scheme and the filters for every
+    reference set separately. Which plan is the fastest depends on α, δ and
+    the dataset, so instead of one fixed configuration the
+    [SilkMothEngine](silkmoth_engine.md) can run the cheapest plan of every
+    query (`auto_plan=True`).
+
+    The cost of a plan is estimated as
+
+    - signature: the time generating the plan's signature, which is measured
+      while planning,
+    - selection: number of (set, element) tuples of the signature's inverted
+      lists times the time per tuple,
+    - filters: expected candidates reaching a filter times its time per
+      candidate, the candidates are reduced by the filter's pass rate. The
+      filters are taken in the order the [FilterChain](filter_chain.md) runs
+      them, by their pruned fraction per unit of cost,
+    - verification: expected candidates after the filters times the time per
+      verified candidate.
+
+    Planning only uses the costs (inverted list lengths) of the signature
+    tokens, no inverted list is decoded or materialized. The number of 
+    candidates is estimated as the union of the sets in the inverted lists,
+    assuming every (set, element) tuple is in another set and the tokens
+    occur independently, times the fraction of sets passing the size filter.
+    The ratio of real to estimated candidates is learned like a pass rate.
+    Times per unit and pass rates start with rough priors and are updated
+    from the stats of every executed query (exponential moving average). The
+    first queries are warm-up queries, they run both filters and additionally
+    time the verification of a sample of candidates.
+
+    Examples
+    --------
+    ```
+    >>> from silkmoth.silkmoth_engine import SilkMothEngine
+    >>> from silkmoth.utils import contain, SigType
+    >>> S = [["77 Mass Ave", "5th St"], ["77 Boston MA", "Seattle WA"], ["Mass Ave Chicago IL"]]
+    >>> engine = SilkMothEngine(0.5, S, contain, auto_plan=True)
+    >>> results, _, _ = engine.search_sets(["77 Mass Ave Boston"])
+    >>> engine.last_query_stats["plan"].sig_type in SigType
+    True
+    ```
+    """
+
+    def __init__(self, sig_types=(SigType.WEIGHTED, SigType.SKYLINE, SigType.DICHOTOMY), filter_modes=FILTER_MODES,
+                 sample_size=8, sample_queries=3, smoothing=0.2, seed=0):
+        """
+        Initialize the query planner.
+
+        Args:
+            sig_types (tuple): Signature schemes to choose from
+            filter_modes (tuple): (check filter, nn filter) flags to choose from
+            sample_size (int): Number of candidates whose verification is timed
+                while the verification cost is sampled
+            sample_queries (int): Number of first queries that sample the
+                verification cost
+            smoothing (float): Weight of a new observation in the moving
+                averages of costs and pass rates
+            seed (int): Seed of the candidate sample
+        """
+        self.sig_types = sig_types
+        self.filter_modes = filter_modes
+        self.sample_size = sample_size
+        self.sample_queries = sample_queries
+        self.smoothing = smoothing
+        self.rng = random.Random(seed)
+        # seconds per unit, rough priors of a pure Python build
+        self.costs = {"posting": 2e-7, "check": 2e-5, "nn": 5e-5, "verify": 2e-4}
+        # "selection" is the ratio of selected to estimated candidates
+        self.pass_rates = {"check": 0.5, "nn": 0.5, "selection": 1.0}
+        self.queries = 0
+        self.plan_counts = {}
+
+    def _update(self, table, key, value):
+        table[key] = (1 - self.smoothing) * table[key] + self.smoothing * value
+
+    def estimate(self, postings, candidates, is_check_filter, is_nn_filter) -> float:
+        """
+        Estimates the cost of a plan in seconds without its signature. The 
+        filters are applied in the order of FilterChain.order(...).
+
+        Args:
+            postings (int): Number of (set, element) tuples of the signature
+            candidates (float): Expected number of candidates
+            is_check_filter (bool): Flag to apply the check filter
+            is_nn_filter (bool): Flag to apply the nearest neighbor filter
+
+        Returns:
+            float: Estimated cost
+        """
+        cost = postings * self.costs["posting"]
+        names = [name for name, enabled in (("check", is_check_filter), ("nn", is_nn_filter)) if enabled]
+        for name in sorted(names, key=lambda n: -(1 - self.pass_rates[n]) / max(self.costs[n], 1e-12)):
+            cost += candidates * self.costs[name]
+            candidates *= self.pass_rates[name]
+        return cost + candidates * self.costs["verify"]
+
+    def plan(self, engine, r_tokens) -> tuple:
+        """
+        Generates the signature of every signature scheme and gives the plan
+        with the lowest estimated cost. The estimated cost of a plan includes
+        the time generating its signature.
+
+        Args:
+            engine (SilkMothEngine): Engine running the query
+            r_tokens (list): Tokenized reference set
+
+        Returns:
+            QueryPlan: Cheapest plan
+            list: Signature of the plan's signature scheme
+        """
+        index = engine.inverted_index
+        size_fraction = 1.0
+        if hasattr(index, "get_set_sizes"):
+            size_mask = engine.candidate_selector.size_mask(len(r_tokens), index.get_set_sizes())
+            if size_mask is not None and len(size_mask):
+                size_fraction = float(size_mask.mean())
+
+        # warm-up queries run both filters, so their costs and pass rates are measured once
+        filter_modes = self.filter_modes
+        if self.queries < self.sample_queries and (True, True) in filter_modes:
+            filter_modes = ((True, True),)
+
+        # without the sets (e.g. global costs of shards) every tuple counts as a set
+        num_sets = len(index.token_sets) if hasattr(index, "token_sets") else None
+
+        best, best_signature = None, None
+        for sig_type in self.sig_types:
+            time_start = time.perf_counter()
+            signature = engine.signature_gen.get_signature(
+                r_tokens, index, engine.related_thresh, engine.sim_thresh, sig_type, engine.sim_func, engine.q
+            )
+            signature_time = time.perf_counter() - time_start
+            postings, missed = 0, 1.0
+            for token in signature:
+                try:
+                    cost = index.get_cost(token)
+                except ValueError:
+                    continue
+                postings += cost
+                if num_sets:
+                    # fraction of sets not containing any of the tokens so far
+                    missed *= max(0.0, 1.0 - cost / num_sets)
+            distinct_sets = num_sets * (1.0 - missed) if num_sets else postings
+            candidates = distinct_sets * size_fraction * self.pass_rates["selection"]
+
+            for is_check_filter, is_nn_filter in filter_modes:
+                cost = self.estimate(postings, candidates, is_check_filter, is_nn_filter) + signature_time
+                if best is None or cost < best.estimated_cost:
+                    best = QueryPlan(sig_type, is_check_filter, is_nn_filter, cost, candidates, postings)
+                    best_signature = signature
+
+        if self.queries < self.sample_queries:
+            self.sample_verification(engine, r_tokens, best_signature)
+        return best, best_signature
+
+    def sample_verification(self, engine, r_tokens, signature):
+        """
+        Times the verification of a random sample of candidates and updates
+        the verification cost.
+
+        Args:
+            engine (SilkMothEngine): Engine running the query
+            r_tokens (list): Tokenized reference set
+            signature (list): Signature of the reference set
+        """
+        index = engine.inverted_index
+        if not hasattr(index, "get_set_ids"):
+            return
+        sample = set()
+        for token in signature:
+            # lists of stop tokens are not materialized for a sample
+            if token in index.cost_table:
+                continue
+            try:
+                sample.update(index.get_set_ids(token)[:self.sample_size].tolist())
+            except ValueError:
+                continue
+        if not sample:
+            return
+        sample = self.rng.sample(sorted(sample), min(self.sample_size, len(sample)))
+        time_start = time.perf_counter()
+        engine.verifier.get_related_sets(r_tokens, sample, index)
+        self._update(self.costs, "verify", (time.perf_counter() - time_start) / len(sample))
+
+    def observe(self, plan, stats):
+        """
+        Updates the costs and pass rates from the stats of an executed query.
+
+        Args:
+            plan (QueryPlan): Executed plan
+            stats (dict): Query stats of the engine (last_query_stats)
+        """
+        self.queries += 1
+        self.plan_counts[plan[:3]] = self.plan_counts.get(plan[:3], 0) + 1
+        if "selection_time" in stats and plan.postings:
+            self._update(self.costs, "posting", stats["selection_time"] / plan.postings)
+        if "candidates" in stats and plan.estimated_candidates:
+            estimated = plan.estimated_candidates / max(self.pass_rates["selection"], 1e-12)
+            self._update(self.pass_rates, "selection", stats["candidates"] / estimated)
+        for name in ("check", "nn"):
+            filter_stats = stats.get("filters", {}).get(name)
+            if filter_stats and filter_stats["candidates"]:
+                seen = filter_stats["candidates"]
+                self._update(self.costs, name, filter_stats["time"] / seen)
+                self._update(self.pass_rates, name, (seen - filter_stats["pruned"]) / seen)
+        if "verify_time" in stats and stats.get("candidates_after_filters"):
+            self._update(self.costs, "verify", stats["verify_time"] / stats["candidates_after_filters"])
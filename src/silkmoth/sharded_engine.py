@@ -0,0 +1,290 @@
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from .silkmoth_engine import SilkMothEngine
+from .tokenizer import Tokenizer
+from .utils import jaccard_similarity, similar, SigType
+
+# Engine of the shard that lives in the current worker process
+_shard_engine = None
+
+# Former names of partitioning schemes
+PARTITION_ALIASES = {"hash": "round_robin"}
+
+# Engine arguments that are passed on to the engines of the shards
+SHARD_ARGS = (
+    "index_memory_budget", "index_workers", "dedup_elements", "index_cache_budget", "index_stop_df",
+    "index_materialize_budget", "index_compress", "index_set_id_budget", "verify_workers", "verify_chunk_size",
+    "filters", "drop_filters",
+)
+
+
+def _init_shard(source_sets, engine_args):
+    global _shard_engine
+    _shard_engine = SilkMothEngine(source_sets=source_sets, **engine_args)
+
+
+def _shard_token_costs() -> Counter:
+    index = _shard_engine.inverted_index
+    return Counter({token: index.get_cost(token) for token in index.keys()})
+
+
+def _shard_set_q(q) -> Counter:
+    _shard_engine.set_q(q)
+    return _shard_token_costs()
+
+
+def _shard_search(r_tokens, signature, config) -> tuple[list, int, int]:
+    engine = _shard_engine
+    if engine.related_thresh != config["related_thresh"]:
+        engine.set_related_threshold(config["related_thresh"])
+    if engine.sim_thresh != config["sim_thresh"]:
+        engine.set_alpha(config["sim_thresh"])
+    if engine.reduction != config["reduction"]:
+        engine.set_reduction(config["reduction"])
+    engine.set_check_filter(config["is_check_filter"])
+    engine.set_nn_filter(config["is_nn_filter"])
+    return engine.search_with_signature(r_tokens, signature)
+
+
+class GlobalTokenCosts:
+    """
+    Token costs summed up over all shards. It provides the same cost lookup as
+    the [InvertedIndex](inverted_index.md), so the signature generator selects
+    the same tokens as for a single index over all source sets.
+    """
+
+    def __init__(self, shard_costs: list):
+        """
+        Initialize the global token costs.
+
+        Args:
+            shard_costs (list): Token costs (Counter) of every shard
+        """
+        self.lookup_table = Counter()
+        for costs in shard_costs:
+            self.lookup_table.update(costs)
+
+    def keys(self):
+        """
+        Gives all tokens of all shards.
+
+        Returns:
+            set (set): A set-like object providing all keys
+        """
+        return self.lookup_table.keys()
+
+    def get_cost(self, token) -> int:
+        """
+        Gives the length of the global inverted list of a token.
+
+        Args:
+            token (str): Input token
+
+        Returns:
+            int: Number of (set, element) tuples over all shards which contain
+            the token
+        """
+        if token not in self.lookup_table:
+            raise ValueError(f"Unknown token")
+        return self.lookup_table[token]
+
+
+class ShardedSilkMothEngine(SilkMothEngine):
+    """
+    A SilkMothEngine whose source sets are partitioned into shards. Every shard
+    is served by its own worker process, which tokenizes its source sets and
+    builds and queries its own [InvertedIndex](inverted_index.md).
+
+    The index costs of all shards are merged once after building, so the
+    signature is generated in the main process with globally consistent token
+    costs. A search scatters the tokenized reference set and its signature to
+    all shards, which run candidate selection, refinement and verification in
+    parallel, and gathers the related sets with their global set indices.
+
+    Sets are assigned to shards either round-robin by their index
+    ("round_robin", formerly "hash") or in contiguous ranges ("range"). The
+    index, element store and verification arguments of SilkMothEngine 
+    (SHARD_ARGS) are passed on to the engines of the shards. The engine should
+    be closed after use to stop the worker processes.
+
+    Examples
+    --------
+    ```
+    >>> from silkmoth.sharded_engine import ShardedSilkMothEngine
+    >>> from silkmoth.utils import contain
+    >>> S = [
+    ...     ['Mass Ave St Boston 02115', '77 Mass 5th St Boston', '77 Mass Ave 5th 02115'],
+    ...     ['77 Boston MA', '77 5th St Boston 02115', '77 Mass Ave 02115 Seattle'],
+    ...     ['77 Mass Ave 5th Boston MA', 'Mass Ave Chicago IL', '77 Mass Ave St'],
+    ...     ['77 Mass Ave MA', '5th St 02115 Seattle WA', '77 5th St Boston Seattle']
+    ... ]
+    >>> R = ['77 Mass Ave Boston MA', '5th St 02115 Seattle WA', '77 5th St Chicago IL']
+    >>> with ShardedSilkMothEngine(0.7, S, contain, num_shards=2) as engine:
+    ...     results, _, _ = engine.search_sets(R)
+    >>> results
+    [(3, 0.7428571428571429)]
+    ```
+    """
+
+    def __init__(self, related_thresh, source_sets, sim_metric=similar, sim_func=jaccard_similarity, sim_thresh=0, reduction=False, sig_type=SigType.WEIGHTED, is_check_filter=False, is_nn_filter=False, q=3, num_shards=None, partition="round_robin", lazy_index=False, **shard_args):
+        """
+        Initialize the sharded engine and start one worker process per shard.
+
+        Args:
+            related_thresh (float): Relatedness threshold delta
+            source_sets (list): Collection of source sets
+            sim_metric (callable): Similarity metric similar(...)/contain(...)
+            sim_func (callable): Similarity function phi
+            sim_thresh (float): Similarity threshold alpha
+            reduction (bool): Flag to activate/deactivate triangle inequality reduction
+            sig_type (SigType): Type of signature.
+            is_check_filter (bool): Flag to activate/deactivate check filter
+            is_nn_filter (bool): Flag to activate/deactivate nearest neighbor filter
+            q (int): The q-gram size for tokenization
+            num_shards (int): Number of shards, defaults to the number of CPUs
+            partition (str): Partitioning scheme "round_robin" or "range",
+                "hash" is accepted as the former name of "round_robin"
+            lazy_index (bool): Flag to start the shards on the first query 
+                instead of on initialization
+            **shard_args: Arguments of the shard engines, see SHARD_ARGS and
+                SilkMothEngine
+        """
+        partition = PARTITION_ALIASES.get(partition, partition)
+        if partition not in ("round_robin", "range"):
+            raise ValueError(f"Unknown partition scheme: {partition}")
+        unsupported = sorted(set(shard_args) - set(SHARD_ARGS))
+        if unsupported:
+            raise ValueError(f"Engine arguments not supported with shards: {unsupported}")
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.partition = partition
+        self.shard_args = shard_args
+        self.shard_ids = []
+        self.executors = []
+        # the raw source sets are only kept by the shards
+        super().__init__(related_thresh, source_sets, sim_metric, sim_func, sim_thresh, reduction, sig_type, is_check_filter, is_nn_filter, q, keep_source_sets=False, lazy_index=lazy_index)
+
+    def _partition(self, num_sets) -> list:
+        """
+        Assigns the set indices to the shards.
+
+        Args:
+            num_sets (int): Number of source sets
+
+        Returns:
+            list: Global set indices for every shard
+        """
+        if self.partition == "round_robin":
+            return [list(range(k, num_sets, self.num_shards)) for k in range(self.num_shards)]
+        size = -(-num_sets // self.num_shards)
+        return [list(range(k * size, min((k + 1) * size, num_sets))) for k in range(self.num_shards)]
+
+    def build_index(self, source_sets) -> GlobalTokenCosts:
+        """
+        Partitions the source sets and starts the shard workers, which build
+        their inverted indexes in parallel.
+
+        Args:
+            source_sets (list): Collection of "raw" source sets
+
+        Returns:
+            GlobalTokenCosts: Token costs over all shards
+        """
+        self.close()
+        source_sets = list(source_sets)
+        self.shard_ids = [ids for ids in self._partition(len(source_sets)) if ids]
+        engine_args = {
+            "related_thresh": self.related_thresh,
+            "sim_metric": self.sim_metric,
+            "sim_func": self.sim_func,
+            "sim_thresh": self.sim_thresh,
+            "reduction": self.reduction,
+            "sig_type": self.signature_type,
+            "is_check_filter": self.is_check_filter,
+            "is_nn_filter": self.is_nn_filter,
+            "q": self.q,
+            **self.shard_args,
+        }
+        for ids in self.shard_ids:
+            shard_sets = [source_sets[i] for i in ids]
+            self.executors.append(ProcessPoolExecutor(
+                max_workers=1, initializer=_init_shard, initargs=(shard_sets, engine_args)
+            ))
+        return self._gather_costs(_shard_token_costs)
+
+    def _gather_costs(self, method, *args) -> GlobalTokenCosts:
+        futures = [executor.submit(method, *args) for executor in self.executors]
+        return GlobalTokenCosts([future.result() for future in futures])
+
+    def search_with_signature(self, r_tokens, signature, related_thresh=None, is_check_filter=None, is_nn_filter=None) -> tuple[list, int, int]:
+        """
+        Scatters the tokenized reference set and its signature to all shards
+        and gathers their related sets.
+
+        Args:
+            r_tokens (list): Tokenized reference set
+            signature (list): Signature tokens of the reference set
+            related_thresh (float): Relatedness threshold delta used for this
+                search only, defaults to the engine's threshold
+            is_check_filter (bool): Check filter flag for this search only
+            is_nn_filter (bool): Nearest neighbor filter flag for this search only
+
+        Returns:
+            list:   Pairs of global indices of all related sets and their
+                    relatedness with the reference set, ordered by index.
+            int:    Number of candidates before applying filters.
+            int:    Number of candidates after applying filters.
+        """
+        config = {
+            "related_thresh": self.related_thresh if related_thresh is None else related_thresh,
+            "sim_thresh": self.sim_thresh,
+            "reduction": self.reduction,
+            "is_check_filter": self.is_check_filter if is_check_filter is None else is_check_filter,
+            "is_nn_filter": self.is_nn_filter if is_nn_filter is None else is_nn_filter,
+        }
+        futures = [executor.submit(_shard_search, r_tokens, signature, config) for executor in self.executors]
+
+        related_sets = []
+        candidates_start = 0
+        candidates_end = 0
+        for ids, future in zip(self.shard_ids, futures):
+            shard_related, shard_start, shard_end = future.result()
+            related_sets.extend((ids[c], relatedness) for c, relatedness in shard_related)
+            candidates_start += shard_start
+            candidates_end += shard_end
+        related_sets.sort()
+        self.last_query_stats = {
+            "signature_size": len(signature),
+            "check_filter": config["is_check_filter"],
+            "nn_filter": config["is_nn_filter"],
+            "candidates": candidates_start,
+            "candidates_after_filters": candidates_end,
+            "related_sets": len(related_sets),
+        }
+        return related_sets, candidates_start, candidates_end
+
+    def set_q(self, q):
+        """
+        Updates q-gram size. Every shard re-tokenizes its own source sets.
+
+        Args:
+            q (int): The q-gram size for tokenization
+        """
+        self.q = q
+        self.tokenizer = Tokenizer(self.sim_func, q)
+        self.inverted_index = self._gather_costs(_shard_set_q, q)
+
+    def close(self):
+        """
+        Stops all shard worker processes.
+        """
+        for executor in self.executors:
+            executor.shutdown()
+        self.executors = []
+        super().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -131,7 +131,7 @@ class SignatureGenerator:
                 # need cheapest additional chunks -> sort all chunks by cost = inverted_index size
                 sorted_chunks = sorted(
                     r,
-                    key=lambda t: len(inverted_index.get_indexes(t)) if t in inverted_index.lookup_table else float('inf')
+                    key=lambda t: self._get_token_cost(t, inverted_index)
                 )
                 # add cheapest chunks up to m_i
                 for chunk in sorted_chunks:
@@ -142,6 +142,15 @@ class SignatureGenerator:
         return list(simthresh_sig)    
             
     
+    def _get_token_cost(self, token, inverted_index) -> float:
+        """
+        Gives the cost of a token, tokens unknown to the index get infinite cost.
+        """
+        try:
+            return inverted_index.get_cost(token)
+        except ValueError:
+            return float('inf')
+
     def _generate_skyline_signature(self, reference_set, inverted_index: InvertedIndex, delta, alpha):
         if self.sim_fun == jaccard_similarity:
             weighted = set(self._generate_weighted_signature(reference_set, inverted_index, delta))
@@ -168,7 +177,7 @@ class SignatureGenerator:
             else:
                 # add tokens with minimum |I[t]|
                 tokens = list(k)
-                tokens.sort(key=lambda t: len(inverted_index.get_indexes(t)))
+                tokens.sort(key=lambda t: inverted_index.get_cost(t))
                 skyline = skyline.union(tokens[:rhs])
         return list(skyline)
 
@@ -223,7 +232,7 @@ class SignatureGenerator:
             # Handle cases where a token might not be in the index.
             def get_token_cost(token):
                 try:
-                    return len(inverted_index.get_indexes(token))
+                    return inverted_index.get_cost(token)
                 except ValueError:
                     return float('inf')  # Assign a high cost if not found
 
@@ -273,7 +282,7 @@ class SignatureGenerator:
             if val <= 0:
                 continue
             try:
-                cost = len(inverted_index.get_indexes(t)) # look up each token in inverted index to count in how many sets it is = cost
+                cost = inverted_index.get_cost(t) # look up each token in inverted index to count in how many sets it is = cost
             except ValueError:
                 # Token not in index: assign infinite cost to deprioritize
                 cost = float('inf')
@@ -360,7 +369,7 @@ class SignatureGenerator:
             if val <= 0:
                 continue
             try:
-                cost = len(inverted_index.get_indexes(chunk))  # number of sets where chunk appears
+                cost = inverted_index.get_cost(chunk)  # number of sets where chunk appears
             except ValueError:
                 cost = float('inf')
             heapq.heappush(heap, (cost / val, chunk))
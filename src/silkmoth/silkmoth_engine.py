@@ -1,10 +1,25 @@
+import copy
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from .utils import jaccard_similarity, similar, SigType
 from .inverted_index import InvertedIndex
-from .tokenizer import Tokenizer
+from .index_builder import StreamingIndexBuilder
+from .tokenizer import Tokenizer, QgramRetokenizer
+from .element_store import ElementStore
 from .signature_generator import SignatureGenerator
 from .candidate_selector import CandidateSelector
 from .verifier import Verifier
-import warnings
+from .query_planner import QueryPlanner
+from .filter_chain import FilterChain, FilterContext, CheckFilter, NNFilter
+
+
+def _verify_chunk(verifier, r_tokens, chunk, inverted_index) -> tuple[list, float]:
+    # runs in a verification thread, the time is measured in the thread
+    time_verify = time.perf_counter()
+    related_sets = verifier.get_related_sets(r_tokens, chunk, inverted_index)
+    return related_sets, time.perf_counter() - time_verify
+
 
 class SilkMothEngine:
     """
@@ -35,24 +50,75 @@ class SilkMothEngine:
     ```
     """
     
-    def __init__(self, related_thresh, source_sets, sim_metric=similar, sim_func=jaccard_similarity, sim_thresh=0, reduction=False, sig_type=SigType.WEIGHTED, is_check_filter=False, is_nn_filter=False, q=3):
+    def __init__(self, related_thresh, source_sets, sim_metric=similar, sim_func=jaccard_similarity, sim_thresh=0, reduction=False, sig_type=SigType.WEIGHTED, is_check_filter=False, is_nn_filter=False, q=3, keep_source_sets=True, index_memory_budget=None, index_workers=1, dedup_elements=False, index_cache_budget=None, lazy_index=False, index_stop_df=None, index_materialize_budget=None, index_compress=False, index_set_id_budget=64, verify_workers=1, verify_chunk_size=256, auto_plan=False, filters=None, drop_filters=False):
         """
         Initialize the SilkMothEngine with all the necessary parameters.
         
         Args:
             related_thresh (float): Relatedness threshold delta
-            source_sets (list): Collection of source sets
+            source_sets (list): Collection (or any iterable) of source sets
             sim_metric (callable): Similarity metric similar(...)/contain(...)
             sim_func (callable): Similarity function phi
             sim_thresh (float): Similarity threshold alpha
-            reduction (bool): Flag to activate/deactivate triangle inequality reduction
+            reduction (bool): Flag to activate/deactivate triangle inequality reduction,
+                for alpha > 0 only forced exact matches are reduced
             sig_type (SigType): Type of signature.
             is_check_filter (bool): Flag to activate/deactivate check filter
             is_nn_filter (bool): Flag to activate/deactivate nearest neighbor filter
             q (int): The q-gram size for tokenization
+            keep_source_sets (bool): Flag to keep the raw source sets, which are
+                needed to rebuild the index in set_q(...). Must be False for 
+                one-shot iterables like generators.
+            index_memory_budget (float): Memory budget in MB for the inverted 
+                lists during the index build, partial lists are spilled to disk
+                when it is exceeded. The tokenized sets are kept in memory and
+                not part of the budget. None to build fully in memory.
+            index_workers (int): Number of processes used to build the index
+            dedup_elements (bool): Flag to intern distinct elements in an 
+                ElementStore, so each is tokenized and stored once and their
+                similarities are cached. With index_workers > 1 the elements
+                interned by the workers are merged into the engine's store.
+            index_cache_budget (float): Memory budget in MB for the indexes of
+                previously used q-gram sizes, which set_q(...) reuses instead 
+                of rebuilding. None to disable the cache.
+            lazy_index (bool): Flag to build the index on the first query 
+                instead of on initialization
+            index_stop_df (float): Fraction of source sets above which a 
+                token is a stop token, only its cost is kept and its list is
+                built or the sets are scanned when needed. None for no stop
+                tokens. Together with index_materialize_budget this replaces
+                the former index_df_cutoff, which cut off at a list length.
+            index_materialize_budget (int): Maximum number of (set, element)
+                tuples of inverted lists built on demand that are kept, the
+                least recently used ones are dropped. None to keep all.
+            index_compress (bool): Flag to store the inverted lists 
+                compressed (see CompressedPostings), which needs a fraction 
+                of the memory at a small cost for decoding.
+            index_set_id_budget (float): Memory budget in MB for the cached
+                set ids of inverted lists, which the bitmap based candidate
+                selection uses, the least recently used ones are dropped.
+                None to keep all.
+            verify_workers (int): Number of threads verifying the candidates of
+                a query. With more than one, filtering and verification run 
+                as a pipeline, the filters pass chunks of candidates to the 
+                verification threads. The matching solvers and rapidfuzz 
+                release the GIL, so the threads overlap.
+            verify_chunk_size (int): Number of candidates per chunk
+            auto_plan (bool): Flag to let a QueryPlanner choose the signature 
+                scheme and filters of every search_sets(...) query from cost 
+                estimates, instead of sig_type and the filter flags. The 
+                chosen plan is recorded in last_query_stats.
+            filters (list): Additional filters (CandidateFilter) of the 
+                refinement step, they run together with the check and 
+                nearest neighbor filter in the order of their pruning per 
+                unit of cost (see FilterChain)
+            drop_filters (bool): Flag to stop running filters that cost more
+                than they save for the rest of a query
         """
+        if keep_source_sets and iter(source_sets) is source_sets:
+            raise ValueError("One-shot iterables can't be kept, use keep_source_sets=False")
         self.related_thresh = related_thresh        # delta
-        self.source_sets = source_sets              # S
+        self.source_sets = source_sets if keep_source_sets else None    # S
         self.sim_metric = sim_metric                # related
         self.sim_func = sim_func                    # phi
         self.sim_thresh = sim_thresh                # alpha
@@ -62,23 +128,84 @@ class SilkMothEngine:
         self.tokenizer = Tokenizer(sim_func, q)
         self.is_check_filter = is_check_filter
         self.is_nn_filter = is_nn_filter
+        self.index_memory_budget = index_memory_budget
+        self.index_workers = index_workers
+        self.dedup_elements = dedup_elements
+        self.element_store = self._create_element_store()
+        self.index_cache_budget = index_cache_budget
+        self.index_cache = OrderedDict()    # q -> (index, element store, size in MB)
+        self.index_stop_df = index_stop_df
+        self.index_materialize_budget = index_materialize_budget
+        self.index_compress = index_compress
+        self.index_set_id_budget = index_set_id_budget
+        self.verify_workers = verify_workers
+        self.verify_chunk_size = verify_chunk_size
+        self._verify_pool = None
+        self.query_planner = QueryPlanner() if auto_plan else None
+        self.last_query_stats = {}
+        self.filter_chain = FilterChain([CheckFilter(), NNFilter(), *(filters or [])], drop=drop_filters)
         self.signature_gen = SignatureGenerator()
         self.candidate_selector = self._create_candidate_selector()
         self.verifier = self._create_verifier()
-        self.inverted_index = self.build_index(source_sets)
+        self._inverted_index = None
+        self._unindexed_sets = source_sets
+        if not lazy_index:
+            self.inverted_index = self.build_index(source_sets)
+
+    @property
+    def inverted_index(self):
+        """
+        Inverted index of the source sets, built on first access if the engine
+        was created with lazy_index=True.
+        """
+        if self._inverted_index is None:
+            self._inverted_index = self.build_index(self._unindexed_sets)
+            self._unindexed_sets = None
+        return self._inverted_index
+
+    @inverted_index.setter
+    def inverted_index(self, inverted_index):
+        self._inverted_index = inverted_index
+        self._unindexed_sets = None
         
     def build_index(self, source_sets) -> InvertedIndex:
         """
         Tokenizes all source sets and creates the inverted index.
 
         Args:
-            source_sets (list): Collection of "raw" source sets
+            source_sets (list): Collection (or any iterable) of "raw" source sets
         
         Returns:
             InvertedIndex: Inverted index
         """
-        token_sets = [self.tokenizer.tokenize(s) for s in source_sets]
-        return InvertedIndex(token_sets)
+        return self._index_builder(self._set_tokenizer()).build(source_sets)
+
+    def estimate_index_memory(self, sample_sets, num_sets) -> dict:
+        """
+        Predicts the memory of the index of num_sets source sets with the 
+        engine's settings from a sample of them, see 
+        StreamingIndexBuilder.estimate_memory(...). Create the engine with 
+        lazy_index=True to estimate before building.
+
+        Args:
+            sample_sets (iterable): Uniform random sample of "raw" source sets
+            num_sets (int): Number of source sets
+
+        Returns:
+            dict: Estimated vocabulary, (set, element) tuples and memory in bytes
+        """
+        # the element store isn't filled with the sample
+        return self._index_builder(self.tokenizer).estimate_memory(sample_sets, num_sets)
+
+    def _index_builder(self, tokenizer) -> StreamingIndexBuilder:
+        return StreamingIndexBuilder(tokenizer, self.index_memory_budget, workers=self.index_workers,
+                                     stop_df=self.index_stop_df, materialize_budget=self.index_materialize_budget,
+                                     compress=self.index_compress, set_id_budget=self._set_id_budget_bytes())
+
+    def _set_id_budget_bytes(self):
+        if self.index_set_id_budget is None:
+            return None
+        return int(self.index_set_id_budget * 1024 ** 2)
         
     def search_sets(self, reference_set) -> tuple[list, int, int]:
         """
@@ -94,29 +221,196 @@ class SilkMothEngine:
             int:    Number of candidates before applying filters.
             int:    Number of candidates after applying filters. 
         """
-        r_tokens = self.tokenizer.tokenize(reference_set)
+        r_tokens = self._tokenize_reference(reference_set)
+        if self.query_planner is not None:
+            time_plan = time.perf_counter()
+            plan, signature = self.query_planner.plan(self, r_tokens)
+            plan_time = time.perf_counter() - time_plan
+            result = self.search_with_signature(r_tokens, signature, None, plan.is_check_filter, plan.is_nn_filter)
+            self.last_query_stats["plan"] = plan
+            self.last_query_stats["plan_time"] = plan_time
+            # the planning is part of the query
+            self.last_query_stats["total_time"] += plan_time
+            self.query_planner.observe(plan, self.last_query_stats)
+            return result
         signature = self.signature_gen.get_signature(r_tokens, self.inverted_index, self.related_thresh, self.sim_thresh, self.signature_type, self.sim_func, self.q)
-        candidates = self.candidate_selector.get_candidates(signature, self.inverted_index, len(r_tokens))
+        return self.search_with_signature(r_tokens, signature)
+
+    def search_with_signature(self, r_tokens, signature, related_thresh=None, is_check_filter=None, is_nn_filter=None) -> tuple[list, int, int]:
+        """
+        Runs candidate selection, refinement and verification for an already
+        tokenized reference set and its signature. Candidate counts and stage
+        times are recorded in last_query_stats.
+
+        Args:
+            r_tokens (list): Tokenized reference set
+            signature (list): Signature tokens of the reference set
+            related_thresh (float): Relatedness threshold delta used for this
+                search only, defaults to the engine's threshold
+            is_check_filter (bool): Check filter flag for this search only,
+                defaults to the engine's flag
+            is_nn_filter (bool): Nearest neighbor filter flag for this search
+                only, defaults to the engine's flag
+
+        Returns:
+            list:   Pairs of indices of all related sets from the candidates and 
+                    their relatedness with the reference set.
+            int:    Number of candidates before applying filters.
+            int:    Number of candidates after applying filters. 
+        """
+        if related_thresh is None or related_thresh == self.related_thresh:
+            related_thresh = self.related_thresh
+            candidate_selector = self.candidate_selector
+            verifier = self.verifier
+        else:
+            candidate_selector = self._create_candidate_selector(related_thresh)
+            verifier = self._create_verifier(related_thresh)
+        is_check_filter = self.is_check_filter if is_check_filter is None else is_check_filter
+        is_nn_filter = self.is_nn_filter if is_nn_filter is None else is_nn_filter
+        skip = set()
+        if not is_check_filter:
+            skip.add(CheckFilter.name)
+        if not is_nn_filter:
+            skip.add(NNFilter.name)
+        is_filtered = len(skip) < len(self.filter_chain.filters)
+        stats = {"signature_size": len(signature), "check_filter": is_check_filter, "nn_filter": is_nn_filter}
+        self.last_query_stats = stats
+        time_start = time.perf_counter()
+
+        # the filters reuse the signature hits instead of searching the index again
+        if is_filtered:
+            candidates, hits = candidate_selector.get_candidates(
+                signature, self.inverted_index, len(r_tokens), with_hits=True
+            )
+        else:
+            candidates = candidate_selector.get_candidates(signature, self.inverted_index, len(r_tokens))
+            hits = None
 
         # Count how many candidates are removed by the filters
         candidates_start = len(candidates)
+        stats["candidates"] = candidates_start
+        stats["selection_time"] = time.perf_counter() - time_start
+
+        context = FilterContext(r_tokens, set(signature), self.inverted_index, related_thresh, candidate_selector, hits)
+        chunks = self.filter_chain.run(context, candidates, self.verify_chunk_size, skip)
 
-        # Apply check filter if enabled
-        if self.is_check_filter:
-            candidates, match_map = self.candidate_selector.check_filter(
-                r_tokens, set(signature), candidates, self.inverted_index
+        if self.verify_workers > 1 and candidates_start > self.verify_chunk_size:
+            related_sets, candidates_end, stats["filter_time"], stats["verify_time"] = self._verify_pipelined(
+                r_tokens, chunks, verifier
             )
         else:
-            match_map = None
+            # Apply the filters
+            time_filter = time.perf_counter()
+            candidates = [c_idx for chunk in chunks for c_idx in chunk]
+            stats["filter_time"] = time.perf_counter() - time_filter
+            candidates_end = len(candidates)
+
+            time_verify = time.perf_counter()
+            related_sets = verifier.get_related_sets(r_tokens, candidates, self.inverted_index)
+            stats["verify_time"] = time.perf_counter() - time_verify
+        self.filter_chain.observe_verification(candidates_end, stats["verify_time"])
+
+        stats["filters"] = self.filter_chain.last_stats
+        stats["candidates_after_filters"] = candidates_end
+        stats["related_sets"] = len(related_sets)
+        stats["total_time"] = time.perf_counter() - time_start
+        return related_sets, candidates_start, candidates_end
+
+    def _verify_pipelined(self, r_tokens, chunks, verifier) -> tuple[list, int, float, float]:
+        """
+        Verifies every filtered chunk in the verification thread pool while 
+        the next chunk is filtered. At most two chunks per thread are in 
+        flight, so memory stays bounded. Every chunk is verified by its own
+        copy of the verifier, only the element store (and its similarity 
+        cache) is shared, which is thread-safe.
 
-        # Apply nearest neighbor filter if enabled
-        if self.is_nn_filter:
-            candidates= self.candidate_selector.nn_filter(
-                r_tokens, set(signature), candidates, self.inverted_index, self.related_thresh, match_map
-            )
+        Args:
+            r_tokens (list): Tokenized reference set
+            chunks (iterable): Filtered chunks of candidate indices
+            verifier (Verifier): Verifier of this search
 
-        return self.verifier.get_related_sets(r_tokens, candidates, self.inverted_index), candidates_start , len(candidates)
+        Returns:
+            list:   Pairs of indices of all related sets and their relatedness,
+                    ordered by set index.
+            int:    Number of candidates after applying filters.
+            float:  Time spent filtering in seconds.
+            float:  Time spent verifying in seconds, summed over the threads,
+                    so it is comparable to the time of a serial verification.
+        """
+        if self._verify_pool is None:
+            self._verify_pool = ThreadPoolExecutor(self.verify_workers, thread_name_prefix="silkmoth-verify")
+        pending = deque()
+        related_sets = []
+        candidates_end = 0
+        filter_time = 0.0
+        verify_time = 0.0
+
+        def collect():
+            nonlocal verify_time
+            chunk_related_sets, chunk_time = pending.popleft().result()
+            related_sets.extend(chunk_related_sets)
+            verify_time += chunk_time
+
+        chunks = iter(chunks)
+        while True:
+            time_filter = time.perf_counter()
+            chunk = next(chunks, None)
+            filter_time += time.perf_counter() - time_filter
+            if chunk is None:
+                break
+            candidates_end += len(chunk)
+            if not chunk:
+                continue
+            if len(pending) >= 2 * self.verify_workers:
+                collect()
+            pending.append(self._verify_pool.submit(
+                _verify_chunk, copy.copy(verifier), r_tokens, chunk, self.inverted_index
+            ))
+
+        while pending:
+            collect()
+        return related_sets, candidates_end, filter_time, verify_time
+
+    def close(self):
+        """
+        Stops the verification threads, they are restarted by the next 
+        pipelined search.
+        """
+        if self._verify_pool is not None:
+            self._verify_pool.shutdown()
+            self._verify_pool = None
 
+    def search_sets_multi(self, reference_set, thresholds) -> tuple[dict, int, int]:
+        """
+        Search mode for several relatedness thresholds in one pass. Signature,
+        candidates and filters use the smallest threshold, which is valid for
+        all larger ones. Every candidate is verified once and the related sets
+        are bucketed by their relatedness.
+
+        Args:
+            reference_set (list): "Raw" reference set
+            thresholds (list): Relatedness thresholds delta
+
+        Returns:
+            dict:   Threshold to pairs of indices of all related sets and their
+                    relatedness with the reference set.
+            int:    Number of candidates before applying filters.
+            int:    Number of candidates after applying filters. 
+        """
+        thresholds = sorted(set(thresholds))
+        if not thresholds:
+            raise ValueError("At least one threshold is required")
+        min_thresh = thresholds[0]
+
+        r_tokens = self._tokenize_reference(reference_set)
+        signature = self.signature_gen.get_signature(r_tokens, self.inverted_index, min_thresh, self.sim_thresh, self.signature_type, self.sim_func, self.q)
+        related_sets, candidates_start, candidates_end = self.search_with_signature(r_tokens, signature, min_thresh)
+
+        results = {
+            thresh: [(c, relatedness) for c, relatedness in related_sets if relatedness >= thresh]
+            for thresh in thresholds
+        }
+        return results, candidates_start, candidates_end
 
     def discover_sets(self, reference_sets) -> list:
         """
@@ -138,6 +432,32 @@ class SilkMothEngine:
 
         return related_pairs
 
+    def discover_sets_multi(self, reference_sets, thresholds) -> dict:
+        """
+        Discovery mode for several relatedness thresholds in one pass, see
+        search_sets_multi(...).
+
+        Args:
+            reference_sets (list): Collection of "raw" reference set
+            thresholds (list): Relatedness thresholds delta
+        
+        Returns:
+            dict:   Threshold to tuples (i, j, sim) of all related sets with 
+                    reference index i, source set index j and the computed 
+                    similarity score sim.
+        """
+        thresholds = sorted(set(thresholds))
+        if not thresholds:
+            raise ValueError("At least one threshold is required")
+        related_pairs = {thresh: [] for thresh in thresholds}
+
+        for i, reference_set in enumerate(reference_sets):
+            results, _, _ = self.search_sets_multi(reference_set, thresholds)
+            for thresh, sets in results.items():
+                related_pairs[thresh].extend([(i, j, sim) for j, sim in sets])
+
+        return related_pairs
+
     def set_related_threshold(self, related_thresh):
         """
         Updates the relatedness threshold.
@@ -197,41 +517,113 @@ class SilkMothEngine:
         self.reduction = reduction
         self.verifier = self._create_verifier()
 
-    def _create_verifier(self):
-        if self.reduction and self.sim_thresh > 0:
-            self.reduction = False
-            warnings.warn(""""Reduction-based verification does not work when the 
-                          similarity threshold alpha is greater than zero. 
-                          Reduction is disabled for now.""")
+    def _create_verifier(self, related_thresh=None):
         return Verifier(
-            self.related_thresh,
+            self.related_thresh if related_thresh is None else related_thresh,
             self.sim_metric,
             self.sim_func,
             self.sim_thresh,
-            self.reduction
+            self.reduction,
+            element_store=self.element_store
         )
 
-    def _create_candidate_selector(self):
+    def _create_element_store(self):
+        return ElementStore(self.tokenizer) if self.dedup_elements else None
+
+    def _set_tokenizer(self):
+        # the element store tokenizes sets like the tokenizer, but only once per distinct element
+        return self.element_store if self.element_store is not None else self.tokenizer
+
+    def _tokenize_reference(self, reference_set) -> list:
+        # reference sets aren't interned, so the element store only grows with the source sets
+        if self.element_store is not None:
+            return self.element_store.tokenize(reference_set, intern=False)
+        return self.tokenizer.tokenize(reference_set)
+
+    def _create_candidate_selector(self, related_thresh=None):
         return CandidateSelector(
             self.sim_func,
             self.sim_metric,
-            self.related_thresh,
+            self.related_thresh if related_thresh is None else related_thresh,
             self.sim_thresh
         )
 
     def set_q(self, q):
         """
-        Updates q-gram size.
+        Updates q-gram size. Jaccard tokens don't depend on q, so the index is
+        kept. For edit similarity, the index of q is taken from the index cache
+        if possible, otherwise it is derived from the cached index with the 
+        largest smaller q or rebuilt from the source sets.
 
         Args:
             q (int): The q-gram size for tokenization
         """
+        if self.sim_func == jaccard_similarity:
+            self.q = q
+            self.tokenizer = Tokenizer(self.sim_func, q)
+            return
+        if q == self.q:
+            return
+        if self._inverted_index is None:
+            # lazy index not built yet, it will be built for the new q
+            self.q = q
+            self.tokenizer = Tokenizer(self.sim_func, q)
+            self.element_store = self._create_element_store()
+            return
+
+        cached = self.index_cache.pop(q, None)
+        if cached is None:
+            base_q = max((c for c in [self.q, *self.index_cache] if c < q), default=None)
+            if base_q is None and self.source_sets is None:
+                raise ValueError("The source sets are required to rebuild the index, use keep_source_sets=True")
+            base_index = None if base_q is None else (
+                self.inverted_index if base_q == self.q else self.index_cache[base_q][0]
+            )
+        self._cache_index(self.q, self.inverted_index, self.element_store)
+
         self.q = q
         self.tokenizer = Tokenizer(self.sim_func, q)
-        self.inverted_index = self.build_index(self.source_sets)
+        if cached is not None:
+            self.inverted_index, self.element_store, _ = cached
+        else:
+            self.element_store = self._create_element_store()
+            if base_index is None:
+                self.inverted_index = self.build_index(self.source_sets)
+            else:
+                self.inverted_index = self._derive_index(base_index, q)
         self.signature_gen = SignatureGenerator()
         self.candidate_selector = self._create_candidate_selector()
         self.verifier = self._create_verifier()
 
+    def _derive_index(self, base_index, q) -> InvertedIndex:
+        """
+        Derives the index of q from the index of a smaller q-gram size by 
+        re-tokenizing its token sets instead of the raw source sets.
+
+        Args:
+            base_index (InvertedIndex): Index of a smaller q-gram size
+            q (int): The new q-gram size
 
+        Returns:
+            InvertedIndex: Inverted index for q
+        """
+        return self._index_builder(QgramRetokenizer(q)).build(base_index.token_sets)
 
+    def _cache_index(self, q, inverted_index, element_store):
+        """
+        Adds an index to the LRU index cache and evicts the least recently used
+        indexes until the cache fits into its memory budget.
+
+        Args:
+            q (int): q-gram size of the index
+            inverted_index (InvertedIndex): Inverted index
+            element_store (ElementStore): Element store of the index
+        """
+        if self.index_cache_budget is None:
+            return
+        size = inverted_index.memory_usage()["lookup_table"] / 1024 ** 2
+        self.index_cache[q] = (inverted_index, element_store, size)
+        total = sum(entry[2] for entry in self.index_cache.values())
+        while self.index_cache and total > self.index_cache_budget:
+            _, (_, _, evicted) = self.index_cache.popitem(last=False)
+            total -= evicted
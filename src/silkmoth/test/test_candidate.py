@@ -1,3 +1,4 @@
+import random
 import unittest
 from silkmoth.inverted_index import InvertedIndex
 from silkmoth.candidate_selector import CandidateSelector
@@ -117,6 +118,123 @@ class TestCandidateSelector(unittest.TestCase):
         self.assertTrue(sel.verify_size(4, 5))
         
         
+    def test_bitmap_candidates(self):
+        signature = ["MA", "Seattle", "WA", "Chicago", "IL", "Berlin"]
+        tokens = [t for t in signature if t != "Berlin"]
+        for sel in (self.selector, CandidateSelector(jaccard_similarity, similar, 0.7)):
+            for ref_size in (1, 3, 4):
+                self.assertEqual(
+                    sel._get_candidates_bitmap(tokens, self.inverted_index, ref_size),
+                    sel._get_candidates_set(tokens, self.inverted_index, ref_size),
+                )
+
+    def test_bitmap_candidates_large(self):
+        rng = random.Random(0)
+        S = [[[str(rng.randint(0, 30))] for _ in range(rng.randint(1, 8))] for _ in range(4000)]
+        I = InvertedIndex(S)
+        signature = ["0", "1", "2", "Berlin"]
+        # enough postings for the bitmap
+        self.assertGreater(sum(I.get_cost(t) for t in signature[:3]), 1024)
+        for sel in (self.selector, CandidateSelector(jaccard_similarity, similar, 0.7)):
+            expected = sel._get_candidates_set(signature[:3], I, 4)
+            self.assertEqual(sel.get_candidates(signature, I, 4), expected)
+            self.assertTrue(all(isinstance(c, int) for c in expected))
+
+    def test_candidates_with_hits(self):
+        signature = ["MA", "Seattle", "WA", "Chicago", "IL", "Berlin"]
+        candidates, hits = self.selector.get_candidates(signature, self.inverted_index, 3, with_hits=True)
+        self.assertEqual(candidates, {1, 2, 3})
+        self.assertEqual(set(hits), candidates)
+        # "MA" is in the first element of S2, S3 and S4
+        self.assertEqual(hits[1], {"MA": [0], "Seattle": [2]})
+        self.assertEqual(hits[2], {"MA": [0], "Chicago": [1], "IL": [1]})
+        self.assertEqual(hits[3], {"MA": [0], "Seattle": [1, 2], "WA": [1]})
+
+    def test_candidates_with_hits_long_lists(self):
+        rng = random.Random(1)
+        S = [[[str(rng.randint(0, 40)) for _ in range(2)] for _ in range(rng.randint(1, 8))] for _ in range(3000)]
+        I = InvertedIndex(S)
+        signature = ["0", "1", "17", "39"]
+        for sel in (self.selector, CandidateSelector(jaccard_similarity, similar, 0.7)):
+            candidates, hits = sel.get_candidates(signature, I, 4, with_hits=True)
+            expected = {}
+            for set_idx, token_set in enumerate(S):
+                if not sel.verify_size(4, len(token_set)):
+                    continue
+                for token in signature:
+                    element_idxs = [e for e, tokens in enumerate(token_set) if token in tokens]
+                    if element_idxs:
+                        expected.setdefault(set_idx, {})[token] = element_idxs
+            self.assertEqual(hits, expected)
+            self.assertEqual(candidates, sel.get_candidates(signature, I, 4))
+
+    def test_candidates_stop_tokens(self):
+        # the sets are scanned for stop tokens instead of materializing their lists
+        rng = random.Random(2)
+        S = [[[str(rng.randint(0, 40)) for _ in range(2)] + ["x"] for _ in range(rng.randint(1, 8))]
+             for _ in range(2000)]
+        full = InvertedIndex(S)
+        I = InvertedIndex(S, stop_df=0.5)
+        self.assertIn("x", I.cost_table)
+        for signature in (["x", "0"], ["0", "x", "1", "17"], ["x"]):
+            for sel in (self.selector, CandidateSelector(jaccard_similarity, similar, 0.7)):
+                self.assertEqual(sel.get_candidates(signature, I, 4), sel.get_candidates(signature, full, 4))
+                self.assertEqual(
+                    sel.get_candidates(signature, I, 4, with_hits=True),
+                    sel.get_candidates(signature, full, 4, with_hits=True),
+                )
+        self.assertFalse(I.materialized)
+        self.assertIn("x", I.cost_table)
+
+    def test_candidates_stop_tokens_materialized(self):
+        # "y" is in one element of 60% of the sets, its list is built to look up more sets than that
+        rng = random.Random(3)
+        S = [[[str(rng.randint(0, 40))] for _ in range(rng.randint(1, 8))] for _ in range(2000)]
+        for set_idx in range(len(S)):
+            if set_idx % 5 < 3:
+                S[set_idx][0].append("y")
+        full = InvertedIndex(S)
+        signature = ["y", "3"]
+        # sets of size 6 to 8 are scanned, the sets of any size aren't
+        for sel, ref_size, scans in ((CandidateSelector(jaccard_similarity, similar, 0.7), 8, True),
+                                     (self.selector, 1, False)):
+            for with_hits in (False, True):
+                I = InvertedIndex(S, stop_df=0.5)
+                self.assertEqual(I.get_cost("y"), 1200)
+                self.assertEqual(
+                    sel.get_candidates(signature, I, ref_size, with_hits=with_hits),
+                    sel.get_candidates(signature, full, ref_size, with_hits=with_hits),
+                )
+                self.assertEqual("y" in I.materialized, not scans)
+                self.assertEqual("y" in I.cost_table, scans)
+
+    def test_filters_with_hits(self):
+        signature = ["MA", "Seattle", "WA", "Chicago", "IL"]
+        K = set(signature)
+        candidates, hits = self.selector.get_candidates(signature, self.inverted_index, 3, with_hits=True)
+        self.assertEqual(
+            self.selector.check_filter(self.R, K, candidates, self.inverted_index, hits),
+            self.selector.check_filter(self.R, K, candidates, self.inverted_index),
+        )
+        for alpha in (0.0, 0.5):
+            sel = CandidateSelector(jaccard_similarity, contain, 0.7, sim_thresh=alpha)
+            # without match map from the check filter
+            self.assertEqual(
+                sel.nn_filter(self.R, K, candidates, self.inverted_index, 0.7, None, hits),
+                sel.nn_filter(self.R, K, candidates, self.inverted_index, 0.7, None),
+            )
+        self.assertEqual(self.selector.nn_filter(self.R, K, candidates, self.inverted_index, 0.7, None, hits), {3})
+
+    def test_nn_filter_without_match_map(self):
+        # only the NN filter enabled: the match maps are built from the per-element signatures
+        K = {"MA", "Seattle", "WA", "Chicago", "IL"}
+        _, match_map = self.selector.check_filter(self.R, K, {0, 1, 2, 3}, self.inverted_index)
+        self.assertEqual(
+            self.selector.nn_filter(self.R, K, {0, 1, 2, 3}, self.inverted_index, 0.7, None),
+            self.selector.nn_filter(self.R, K, {0, 1, 2, 3}, self.inverted_index, 0.7, match_map),
+        )
+        self.assertEqual(self.selector.nn_filter(self.R, K, {0, 1, 2, 3}, self.inverted_index, 0.7, None), {3})
+
     def test_nn_search_S3(self):
         inverted_index = InvertedIndex([self.S3])
         # Check r0 vs S3 (should match s31 with 5/6)
@@ -0,0 +1,56 @@
+import pickle
+import random
+import unittest
+import numpy as np
+from silkmoth.compressed_postings import (CompressedPostings, BLOCK_SIZE, encode_varints, decode_varints,
+                                          encode_varints_array, decode_varints_array)
+
+
+class TestCompressedPostings(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.lists = [[], [(0, 0)], [(5, 1), (5, 3), (9, 0)]]
+        for length, num_sets in ((BLOCK_SIZE, 50), (BLOCK_SIZE + 1, 50), (3000, 400), (3000, 10 ** 6)):
+            postings = {(rng.randrange(num_sets), rng.randrange(20)) for _ in range(length)}
+            self.lists.append(sorted(postings))
+
+    def test_varints(self):
+        values = [0, 1, 127, 128, 300, 16383, 16384, 2 ** 40]
+        self.assertEqual(decode_varints(encode_varints(values)), values)
+        self.assertEqual(encode_varints_array(np.array(values)), encode_varints(values))
+        self.assertEqual(decode_varints_array(encode_varints(values)).tolist(), values)
+        self.assertEqual(len(encode_varints([1, 2, 3])), 3)
+
+    def test_round_trip(self):
+        for postings in self.lists:
+            compressed = CompressedPostings(postings)
+            self.assertEqual(len(compressed), len(postings))
+            self.assertEqual(compressed.to_list(), postings)
+            self.assertEqual(compressed.set_ids().tolist(), [s for s, _ in postings])
+            self.assertEqual(pickle.loads(pickle.dumps(compressed)).to_list(), postings)
+            if postings:
+                self.assertLess(compressed.nbytes, 8 * len(postings))
+
+    def test_lookup(self):
+        for postings in self.lists:
+            compressed = CompressedPostings(postings)
+            expected = dict()
+            for set_idx, element_idx in postings:
+                expected.setdefault(set_idx, []).append(element_idx)
+            probes = sorted(set(list(expected)[::3]) | {0, 1, 17, 399, 10 ** 7})
+            for set_idx in probes:
+                self.assertEqual(compressed.lookup(set_idx), [(set_idx, e) for e in expected.get(set_idx, [])])
+            self.assertEqual(compressed.lookup_many(probes), {s: expected[s] for s in probes if s in expected})
+            self.assertEqual(compressed.lookup_many(sorted(expected)), expected)
+
+    def test_set_across_blocks(self):
+        # set 1 fills more than two blocks
+        postings = [(0, 0)] + [(1, e) for e in range(2 * BLOCK_SIZE + 5)] + [(2, 0)]
+        compressed = CompressedPostings(postings)
+        self.assertEqual(compressed.lookup(1), postings[1:-1])
+        self.assertEqual(compressed.lookup_many([0, 2]), {0: [0], 2: [0]})
+
+
+if __name__ == '__main__':
+    unittest.main()
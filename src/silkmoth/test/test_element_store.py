@@ -0,0 +1,125 @@
+import pickle
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from silkmoth.element_store import ElementStore
+from silkmoth.index_builder import StreamingIndexBuilder
+from silkmoth.inverted_index import InvertedIndex
+from silkmoth.silkmoth_engine import SilkMothEngine
+from silkmoth.tokenizer import Tokenizer
+from silkmoth.utils import contain, similar, jaccard_similarity, edit_similarity
+
+class TestElementStore(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        # few distinct elements repeated over many sets, like webtables columns
+        elements = ["Name", "Date", "City", "Berlin Mitte", "New York", "Los Angeles", "Paris"]
+        self.source_sets = [random.sample(elements, random.randint(1, 5)) for _ in range(80)]
+        self.reference_sets = [random.sample(elements, 3) for _ in range(5)]
+
+    def test_tokenize(self):
+        for sim_func in (jaccard_similarity, edit_similarity):
+            tokenizer = Tokenizer(sim_func)
+            store = ElementStore(tokenizer)
+            for s in self.source_sets:
+                self.assertEqual(store.tokenize(s), tokenizer.tokenize(s))
+
+    def test_shared_tokens(self):
+        store = ElementStore(Tokenizer(jaccard_similarity))
+        S1 = store.tokenize(["Name", "Date", ["Date"]])
+        S2 = store.tokenize(["Date", "Name"])
+        self.assertIs(S1[0], S2[1])
+        self.assertIs(S1[1], S2[0])
+        # nested lists are different elements
+        self.assertIsNot(S1[1], S1[2])
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.element_ids(["Date", "Name"]), [1, 0])
+        self.assertEqual(store.get_element_id(S2[0]), 1)
+        self.assertIsNone(store.get_element_id({"Date"}))
+
+    def test_similarity_cache(self):
+        calls = []
+
+        def counting_sim(x, y, sim_thresh=0):
+            calls.append((x, y))
+            return jaccard_similarity(x, y, sim_thresh)
+
+        store = ElementStore(Tokenizer(jaccard_similarity))
+        x, y = store.tokenize(["Berlin Mitte", "Berlin"])
+        self.assertEqual(store.similarity(x, y, counting_sim), 0.5)
+        self.assertEqual(store.similarity(x, y, counting_sim), 0.5)
+        self.assertEqual(len(calls), 1)
+        # not interned elements are not cached
+        self.assertEqual(store.similarity({"Berlin"}, y, counting_sim), 1.0)
+        self.assertEqual(len(store.sim_cache), 1)
+
+    def test_tokenize_without_intern(self):
+        store = ElementStore(Tokenizer(jaccard_similarity))
+        S = store.tokenize(["Name", "Date"])
+        R = store.tokenize(["Date", "City"], intern=False)
+        self.assertIs(R[0], S[1])
+        self.assertEqual(R[1], {"City"})
+        self.assertIsNone(store.get_element_id(R[1]))
+        self.assertEqual(len(store), 2)
+
+    def test_element_keys(self):
+        store = ElementStore(Tokenizer(jaccard_similarity))
+        self.assertEqual(len({store.intern(e) for e in (1, True, "1", 1.0, [1], ["1"], ("1",))}), 6)
+
+    def test_threaded_similarity(self):
+        store = ElementStore(Tokenizer(jaccard_similarity), max_cache_size=10)
+        tokens = store.tokenize(["Berlin Mitte", "Berlin", "New York", "York", "Paris", "Los Angeles"])
+        pairs = [(x, y) for x in tokens for y in tokens] * 20
+        with ThreadPoolExecutor(4) as pool:
+            sims = list(pool.map(lambda pair: store.similarity(*pair, jaccard_similarity), pairs))
+        self.assertEqual(sims, [jaccard_similarity(x, y) for x, y in pairs])
+        self.assertLessEqual(len(store.sim_cache), 10)
+
+    def test_pickle(self):
+        store = ElementStore(Tokenizer(jaccard_similarity))
+        store.tokenize(["Name", "Date"])
+        copy = pickle.loads(pickle.dumps(store))
+        self.assertEqual(copy.get_element_id(copy.tokens[1]), 1)
+        self.assertEqual(copy.tokenize(["Date"])[0], {"Date"})
+
+    def test_engine_dedup(self):
+        for sim_func, sim_thresh in ((jaccard_similarity, 0), (jaccard_similarity, 0.5), (edit_similarity, 0.6)):
+            for sim_metric, thresh in ((similar, 0.5), (contain, 0.7)):
+                expected = SilkMothEngine(thresh, self.source_sets, sim_metric, sim_func, sim_thresh)
+                engine = SilkMothEngine(thresh, self.source_sets, sim_metric, sim_func, sim_thresh,
+                                        dedup_elements=True)
+                size = len(engine.element_store)
+                self.assertLessEqual(size, 7 + 3 * 5)
+                for R in self.reference_sets + [["Unknown", "Name"]]:
+                    self.assertEqual(engine.search_sets(R), expected.search_sets(R))
+                # the reference sets are not interned
+                self.assertEqual(len(engine.element_store), size)
+
+    def test_engine_dedup_shares_tokens(self):
+        engine = SilkMothEngine(0.5, self.source_sets, dedup_elements=True)
+        ids = {id(tokens) for s in engine.inverted_index.token_sets for tokens in s}
+        self.assertEqual(len(ids), len(engine.element_store))
+        engine.set_q(2)
+        self.assertEqual(len(engine.element_store), len(ids))
+
+    def test_engine_dedup_parallel_build(self):
+        # the elements interned in the worker processes are merged into the engine's store
+        expected = SilkMothEngine(0.5, self.source_sets, similar, jaccard_similarity, 0.5)
+        engine = SilkMothEngine(0.5, self.source_sets, similar, jaccard_similarity, 0.5, dedup_elements=True,
+                                index_workers=2)
+        self.assertEqual(len(engine.element_store), 7)
+        for R in self.reference_sets:
+            self.assertEqual(engine.search_sets(R), expected.search_sets(R))
+        self.assertTrue(engine.element_store.sim_cache)
+
+        # chunks of different workers share the token objects too
+        store = ElementStore(Tokenizer(jaccard_similarity))
+        index = StreamingIndexBuilder(store, workers=2, chunk_size=10).build(self.source_sets)
+        self.assertEqual(index.token_sets, InvertedIndex([store.tokenize(s) for s in self.source_sets]).token_sets)
+        ids = {id(tokens) for s in index.token_sets for tokens in s}
+        self.assertEqual(len(ids), len(store))
+        self.assertEqual(len(store), 7)
+
+if __name__ == '__main__':
+    unittest.main()
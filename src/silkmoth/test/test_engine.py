@@ -1,5 +1,7 @@
+import random
 import unittest
 from silkmoth.silkmoth_engine import SilkMothEngine
+from silkmoth.filter_chain import FilterChain
 from silkmoth.utils import contain, jaccard_similarity, similar, edit_similarity, SigType
 
 class TestEngine(unittest.TestCase):
@@ -44,5 +46,161 @@ class TestEngine(unittest.TestCase):
         search_results, _, _ = engine.search_sets(["77 Mas Ave Boston MA"])
         self.assertGreaterEqual(len(search_results), 1)
 
+    def test_reduction_with_alpha(self):
+        engine = SilkMothEngine(0.5, self.S, contain, jaccard_similarity, sim_thresh=0.5)
+        expected, _, _ = engine.search_sets(self.R)
+        engine.set_reduction(True)
+        self.assertTrue(engine.reduction)
+        search_results, _, _ = engine.search_sets(self.R)
+        self.assertEqual(search_results, expected)
+
+    def test_search_sets_multi(self):
+        thresholds = [0.7, 0.3, 0.5]
+        for sim_metric in (similar, contain):
+            for is_filter in (False, True):
+                engine = SilkMothEngine(0.9, self.S, sim_metric, is_check_filter=is_filter, is_nn_filter=is_filter)
+                results, _, _ = engine.search_sets_multi(self.R, thresholds)
+                self.assertEqual(sorted(results), [0.3, 0.5, 0.7])
+                for thresh in thresholds:
+                    single = SilkMothEngine(thresh, self.S, sim_metric, is_check_filter=is_filter, is_nn_filter=is_filter)
+                    expected, _, _ = single.search_sets(self.R)
+                    self.assertEqual(sorted(results[thresh]), sorted(expected))
+                # the engine's own threshold is not changed
+                self.assertEqual(engine.related_thresh, 0.9)
+
+    def test_set_q_index_cache(self):
+        engine = SilkMothEngine(0.5, self.S, contain, edit_similarity, sim_thresh=0.6, index_cache_budget=100)
+        index_3 = engine.inverted_index
+        engine.set_q(2)
+        index_2 = engine.inverted_index
+        engine.set_q(3)
+        self.assertIs(engine.inverted_index, index_3)
+        engine.set_q(2)
+        self.assertIs(engine.inverted_index, index_2)
+        self.assertEqual(list(engine.index_cache), [3])
+
+    def test_set_q_index_cache_eviction(self):
+        engine = SilkMothEngine(0.5, self.S, contain, edit_similarity, index_cache_budget=0)
+        index_3 = engine.inverted_index
+        engine.set_q(2)
+        self.assertEqual(len(engine.index_cache), 0)
+        engine.set_q(3)
+        self.assertIsNot(engine.inverted_index, index_3)
+        self.assertEqual(engine.inverted_index.lookup_table, index_3.lookup_table)
+
+    def test_set_q_derived_index(self):
+        engine = SilkMothEngine(0.5, iter(self.S), contain, edit_similarity, keep_source_sets=False)
+        for q in (4, 6):
+            engine.set_q(q)
+            expected = SilkMothEngine(0.5, self.S, contain, edit_similarity, q=q)
+            self.assertEqual(engine.inverted_index.lookup_table, expected.inverted_index.lookup_table)
+            self.assertEqual(engine.search_sets(self.R), expected.search_sets(self.R))
+
+    def test_set_q_jaccard(self):
+        engine = SilkMothEngine(0.5, iter(self.S), keep_source_sets=False)
+        index = engine.inverted_index
+        engine.set_q(2)
+        self.assertIs(engine.inverted_index, index)
+        self.assertEqual(engine.q, 2)
+
+    def test_lazy_index(self):
+        expected = SilkMothEngine(0.5, self.S, contain)
+        engine = SilkMothEngine(0.5, iter(self.S), contain, keep_source_sets=False, lazy_index=True)
+        self.assertIsNone(engine._inverted_index)
+        self.assertEqual(engine.search_sets(self.R), expected.search_sets(self.R))
+        self.assertIsNotNone(engine._inverted_index)
+
+    def test_lazy_index_set_q(self):
+        engine = SilkMothEngine(0.5, self.S, contain, edit_similarity, lazy_index=True)
+        engine.set_q(2)
+        self.assertIsNone(engine._inverted_index)
+        expected = SilkMothEngine(0.5, self.S, contain, edit_similarity, q=2)
+        self.assertEqual(engine.inverted_index.lookup_table, expected.inverted_index.lookup_table)
+
+    def test_index_stop_df_on_demand(self):
+        # the lists of stop tokens are built when the filters need them
+        for sim_func in (jaccard_similarity, edit_similarity):
+            expected = SilkMothEngine(0.5, self.S, similar, sim_func, is_check_filter=True, is_nn_filter=True)
+            engine = SilkMothEngine(0.5, self.S, similar, sim_func, is_check_filter=True, is_nn_filter=True,
+                                    index_stop_df=0.5)
+            self.assertTrue(engine.inverted_index.cost_table)
+            self.assertEqual(engine.search_sets(self.R), expected.search_sets(self.R))
+
+    def test_index_stop_df(self):
+        for sim_func in (jaccard_similarity, edit_similarity):
+            for is_filter in (False, True):
+                expected = SilkMothEngine(0.3, self.S, similar, sim_func, is_check_filter=is_filter,
+                                          is_nn_filter=is_filter)
+                engine = SilkMothEngine(0.3, self.S, similar, sim_func, is_check_filter=is_filter,
+                                        is_nn_filter=is_filter, index_stop_df=0.5, index_materialize_budget=10)
+                self.assertTrue(engine.inverted_index.cost_table)
+                for sig_type in SigType:
+                    expected.set_signature_type(sig_type)
+                    engine.set_signature_type(sig_type)
+                    self.assertEqual(engine.search_sets(self.R), expected.search_sets(self.R))
+                index = engine.inverted_index
+                self.assertTrue(index.materialized_postings <= 10 or len(index.materialized) == 1)
+
+    def test_index_compress(self):
+        for sim_func in (jaccard_similarity, edit_similarity):
+            for is_filter in (False, True):
+                expected = SilkMothEngine(0.3, self.S, similar, sim_func, is_check_filter=is_filter,
+                                          is_nn_filter=is_filter)
+                engine = SilkMothEngine(0.3, self.S, similar, sim_func, is_check_filter=is_filter,
+                                        is_nn_filter=is_filter, index_compress=True, index_memory_budget=0.001)
+                self.assertTrue(engine.inverted_index.compress)
+                self.assertEqual(engine.search_sets(self.R), expected.search_sets(self.R))
+
+    def test_discover_sets_multi(self):
+        engine = SilkMothEngine(0.5, self.S, similar)
+        results = engine.discover_sets_multi([self.R, self.S[0]], [0.5, 0.8])
+        for thresh in (0.5, 0.8):
+            engine.set_related_threshold(thresh)
+            expected = engine.discover_sets([self.R, self.S[0]])
+            self.assertEqual(sorted(results[thresh]), sorted(expected))
+        # thresholds are deduplicated once, also from a one-shot iterable
+        self.assertEqual(engine.discover_sets_multi([self.R], iter([0.8, 0.5, 0.8])).keys(), {0.5, 0.8})
+        with self.assertRaises(ValueError):
+            engine.discover_sets_multi([self.R], [])
+
+    def test_pipelined_verification(self):
+        for sim_metric in (similar, contain):
+            for is_filter in (False, True):
+                expected = SilkMothEngine(0.3, self.S, sim_metric, is_check_filter=is_filter, is_nn_filter=is_filter)
+                engine = SilkMothEngine(0.3, self.S, sim_metric, is_check_filter=is_filter, is_nn_filter=is_filter,
+                                        verify_workers=3, verify_chunk_size=1)
+                results, start, end = engine.search_sets(self.R)
+                expected_results, expected_start, expected_end = expected.search_sets(self.R)
+                # ordered by set index
+                self.assertEqual(results, sorted(expected_results))
+                self.assertEqual((start, end), (expected_start, expected_end))
+                engine.close()
+
+    def test_pipelined_verification_threads(self):
+        # many chunks verified concurrently, the threads share the similarity cache
+        rng = random.Random(0)
+        words = [f"w{i}" for i in range(40)]
+        S = [
+            [" ".join(rng.sample(words, rng.randint(2, 4))) for _ in range(rng.randint(3, 6))]
+            for _ in range(300)
+        ]
+        for sim_thresh in (0.0, 0.3):
+            expected = SilkMothEngine(0.1, S, similar, sim_thresh=sim_thresh, dedup_elements=True,
+                                      is_check_filter=True, is_nn_filter=True)
+            engine = SilkMothEngine(0.1, S, similar, sim_thresh=sim_thresh, dedup_elements=True,
+                                    is_check_filter=True, is_nn_filter=True, verify_workers=4, verify_chunk_size=8)
+            for R in S[:5]:
+                results, start, end = engine.search_sets(R)
+                expected_results, expected_start, expected_end = expected.search_sets(R)
+                self.assertGreater(end, engine.verify_chunk_size)
+                self.assertEqual(results, expected_results)
+                self.assertEqual((start, end), (expected_start, expected_end))
+                # the stage times are recorded like in the serial path
+                self.assertGreater(engine.last_query_stats["filter_time"], 0)
+                self.assertGreater(engine.last_query_stats["verify_time"], 0)
+            # the verification cost is learned from the pipelined searches
+            self.assertNotEqual(engine.filter_chain.verify_cost, FilterChain([]).verify_cost)
+            engine.close()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import time
+import unittest
+from silkmoth.silkmoth_engine import SilkMothEngine
+from silkmoth.filter_chain import CandidateFilter, FilterChain, FilterContext, SizeFilter, CheckFilter, NNFilter
+from silkmoth.candidate_selector import CandidateSelector
+from silkmoth.inverted_index import InvertedIndex
+from silkmoth.tokenizer import Tokenizer
+from silkmoth.utils import contain, similar, jaccard_similarity, edit_similarity
+
+
+class OddFilter(CandidateFilter):
+    name = "odd"
+    cost = 1e-7
+
+    def apply(self, context, candidates, bounds):
+        return {c_idx for c_idx in candidates if c_idx % 2 == 1}, bounds
+
+
+class SlowFilter(CandidateFilter):
+    # prunes nothing and takes its time
+    name = "slow"
+
+    def apply(self, context, candidates, bounds):
+        time.sleep(1e-3)
+        return set(candidates), bounds
+
+
+class TestFilterChain(unittest.TestCase):
+
+    def setUp(self):
+        self.S = [
+            ['Mass Ave St Boston 02115', '77 Mass 5th St Boston', '77 Mass Ave 5th 02115'],
+            ['77 Boston MA', '77 5th St Boston 02115', '77 Mass Ave 02115 Seattle'],
+            ['77 Mass Ave 5th Boston MA', 'Mass Ave Chicago IL', '77 Mass Ave St'],
+            ['77 Mass Ave MA', '5th St 02115 Seattle WA', '77 5th St Boston Seattle']
+        ]
+        self.R = ['77 Mass Ave Boston MA', '5th St 02115 Seattle WA', '77 5th St Chicago IL']
+
+    def context(self, related_thresh, sim_metric=contain, sim_func=jaccard_similarity, sim_thresh=0.0):
+        tokenizer = Tokenizer(sim_func)
+        index = InvertedIndex([tokenizer.tokenize(s) for s in self.S])
+        r_tokens = tokenizer.tokenize(self.R)
+        signature = {token for r_i in r_tokens for token in r_i}
+        selector = CandidateSelector(sim_func, sim_metric, related_thresh, sim_thresh)
+        return FilterContext(r_tokens, signature, index, related_thresh, selector, None)
+
+    def test_order_independent(self):
+        for sim_func, sim_thresh in ((jaccard_similarity, 0.0), (edit_similarity, 0.7)):
+            context = self.context(0.5, similar, sim_func, sim_thresh)
+            chain = FilterChain([CheckFilter(), NNFilter()])
+            check_first = [c for chunk in chain.run(context, range(len(self.S))) for c in chunk]
+            # NN first, the check filter reuses its match maps
+            chain.pass_rates["check"] = 0.99
+            self.assertEqual([f.name for f in chain.order(chain.filters)], ["nn", "check"])
+            nn_first = [c for chunk in chain.run(context, range(len(self.S))) for c in chunk]
+            self.assertEqual(check_first, nn_first)
+
+    def test_check_filter_reuses_bounds(self):
+        context = self.context(0.7)
+        candidates, bounds = CheckFilter().apply(context, {0, 1, 2, 3}, {})
+        # a known empty match map prunes without recomputing it
+        bounds[3] = {}
+        passed, _ = CheckFilter().apply(context, candidates, bounds)
+        self.assertNotIn(3, passed)
+        self.assertEqual(passed, candidates - {3})
+
+    def test_size_filter(self):
+        context = self.context(0.7, similar)
+        passed, _ = SizeFilter().apply(context, {0, 1, 2, 3}, {})
+        self.assertEqual(passed, {0, 1, 2, 3})
+        context = context._replace(r_tokens=context.r_tokens[:1])
+        passed, _ = SizeFilter().apply(context, {0, 1, 2, 3}, {})
+        self.assertEqual(passed, set())
+
+    def test_stats(self):
+        context = self.context(0.7)
+        chain = FilterChain([CheckFilter(), NNFilter(), OddFilter()])
+        # the cheap odd filter runs first
+        self.assertEqual(chain.order(chain.filters)[0].name, "odd")
+        chunks = list(chain.run(context, {0, 1, 2, 3}, chunk_size=2, skip={"check"}))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(set(chain.last_stats), {"nn", "odd"})
+        self.assertEqual(chain.last_stats["odd"]["candidates"], 4)
+        self.assertEqual(chain.last_stats["odd"]["pruned"], 2)
+        self.assertEqual(chain.last_stats["nn"]["candidates"], 2)
+
+    def test_drop(self):
+        context = self.context(0.3)
+        chain = FilterChain([SlowFilter(), NNFilter()], drop=True, min_candidates=2)
+        result = [c for chunk in chain.run(context, range(len(self.S)), chunk_size=1) for c in chunk]
+        self.assertTrue(chain.last_stats["slow"]["dropped"])
+        self.assertEqual(chain.last_stats["slow"]["candidates"], 2)
+        # without the slow filter
+        chain = FilterChain([NNFilter()])
+        self.assertEqual(result, [c for chunk in chain.run(context, range(len(self.S))) for c in chunk])
+
+    def test_unique_names(self):
+        with self.assertRaises(ValueError):
+            FilterChain([CheckFilter(), CheckFilter()])
+
+    def test_engine_filters(self):
+        for is_filter in (False, True):
+            expected = SilkMothEngine(0.3, self.S, contain, is_check_filter=is_filter, is_nn_filter=is_filter)
+            engine = SilkMothEngine(0.3, self.S, contain, is_check_filter=is_filter, is_nn_filter=is_filter,
+                                    filters=[OddFilter()])
+            results, start, end = engine.search_sets(self.R)
+            expected_results, expected_start, _ = expected.search_sets(self.R)
+            self.assertEqual(start, expected_start)
+            self.assertEqual(results, [(c, r) for c, r in sorted(expected_results) if c % 2 == 1])
+            filter_stats = engine.last_query_stats["filters"]
+            self.assertEqual(end, start - sum(stats["pruned"] for stats in filter_stats.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -92,4 +92,138 @@ class TestInvertedIndex(unittest.TestCase):
         self.assertEqual(I.get_indexes_binary("IL",2), [(2, 1)]) 
         self.assertEqual(I.get_indexes_binary("02115",0), [(0, 0), (0, 2)])
         self.assertEqual(I.get_indexes_binary("02115",1), [(1, 1), (1, 2)])
-        self.assertEqual(I.get_indexes_binary("02115",3), [(3, 1)])
\ No newline at end of file
+        self.assertEqual(I.get_indexes_binary("02115",3), [(3, 1)])
+
+    def test_stop_tokens_on_demand(self):
+        full = InvertedIndex(self.S)
+        I = InvertedIndex(iter(self.S), stop_df=0.75)
+        # "77" is in all sets, "IL" only in one
+        self.assertIn(self.t1, I.cost_table)
+        self.assertNotIn(self.t1, I.lookup_table)
+        self.assertEqual(I.get_indexes(self.t12), full.get_indexes(self.t12))
+        self.assertEqual(set(I.keys()), set(full.keys()))
+        for token in full.keys():
+            self.assertEqual(I.get_cost(token), full.get_cost(token))
+        self.assertIn(self.t1, I.cost_table)
+        # a single set is scanned
+        self.assertEqual(I.get_indexes_binary(self.t1, 1), full.get_indexes_binary(self.t1, 1))
+        self.assertIn(self.t1, I.cost_table)
+        # materialized on demand
+        self.assertEqual(I.get_indexes(self.t1), full.get_indexes(self.t1))
+        self.assertNotIn(self.t1, I.cost_table)
+        self.assertEqual(I.get_indexes(self.t1), full.get_indexes(self.t1))
+        with self.assertRaises(ValueError):
+            I.get_cost("Berlin")
+
+    def test_stop_df_from_lookup_table(self):
+        full = InvertedIndex(self.S)
+        lookup_table = {token: list(postings) for token, postings in full.lookup_table.items()}
+        I = InvertedIndex.from_lookup_table(self.S, lookup_table, stop_df=0.75)
+        self.assertEqual(I.cost_table, InvertedIndex(self.S, stop_df=0.75).cost_table)
+        self.assertEqual(I.get_indexes(self.t2), full.get_indexes(self.t2))
+
+    def test_stop_df(self):
+        full = InvertedIndex(self.S)
+        I = InvertedIndex(self.S, stop_df=0.75)
+        # "77", "Mass", "Ave", "5th", "St" and "Boston" are in all 4 sets
+        self.assertEqual(set(I.cost_table), {self.t1, self.t2, "Ave", "5th", "St", "Boston"})
+        for token in full.keys():
+            self.assertEqual(I.get_cost(token), full.get_cost(token))
+        lookup_table = {token: list(postings) for token, postings in full.lookup_table.items()}
+        self.assertEqual(InvertedIndex.from_lookup_table(self.S, lookup_table, stop_df=0.75).cost_table, I.cost_table)
+
+        # lookups in some sets scan them
+        for set_ids in ([1], [0, 2, 3], [0, 2, 7]):
+            expected = full.get_indexes_skip(self.t1, set_ids)
+            self.assertEqual(I.get_indexes_skip(self.t1, set_ids), expected)
+        self.assertEqual(I.get_indexes_binary(self.t2, 2), full.get_indexes_binary(self.t2, 2))
+        self.assertFalse(I.materialized)
+
+    def test_materialize_budget(self):
+        full = InvertedIndex(self.S)
+        I = InvertedIndex(self.S, stop_df=0.75, materialize_budget=12)
+        self.assertEqual(I.get_indexes(self.t1), full.get_indexes(self.t1))
+        self.assertEqual(I.get_set_ids(self.t1).tolist(), [0, 1, 2, 3])
+        # "77" is dropped for "Mass", both together exceed the budget
+        self.assertEqual(I.get_indexes(self.t2), full.get_indexes(self.t2))
+        self.assertEqual(list(I.materialized), [self.t2])
+        self.assertIn(self.t1, I.cost_table)
+        self.assertNotIn(self.t1, I.set_id_cache)
+        self.assertEqual(I.get_cost(self.t1), full.get_cost(self.t1))
+        self.assertEqual(I.materialized_postings, full.get_cost(self.t2))
+        self.assertEqual(I.get_indexes(self.t1), full.get_indexes(self.t1))
+
+    def test_set_id_budget(self):
+        full = InvertedIndex(self.S, set_id_budget=None)
+        tokens = sorted(full.keys(), key=full.get_cost, reverse=True)[:3]
+        sizes = [full.get_set_ids(token).nbytes for token in tokens]
+        self.assertEqual(full.set_id_bytes, sum(sizes))
+
+        # room for the first two arrays only
+        I = InvertedIndex(self.S, set_id_budget=sizes[0] + sizes[1])
+        for token in tokens[:2]:
+            self.assertEqual(I.get_set_ids(token).tolist(), full.get_set_ids(token).tolist())
+        # the first one is used again, so the second one is dropped
+        I.get_set_ids(tokens[0])
+        self.assertEqual(I.get_set_ids(tokens[2]).tolist(), full.get_set_ids(tokens[2]).tolist())
+        self.assertEqual(list(I.set_id_cache), [tokens[0], tokens[2]] if sizes[2] <= sizes[1] else [tokens[2]])
+        self.assertLessEqual(I.set_id_bytes, I.set_id_budget)
+        self.assertEqual(I.set_id_bytes, sum(set_ids.nbytes for set_ids in I.set_id_cache.values()))
+
+        # arrays larger than the budget are not cached
+        I = InvertedIndex(self.S, set_id_budget=0)
+        self.assertEqual(I.get_set_ids(tokens[0]).tolist(), full.get_set_ids(tokens[0]).tolist())
+        self.assertFalse(I.set_id_cache)
+
+    def test_compress(self):
+        full = InvertedIndex(self.S)
+        for I in (InvertedIndex(self.S, compress=True), InvertedIndex(self.S, stop_df=0.75, compress=True)):
+            for token in full.keys():
+                self.assertEqual(I.get_cost(token), full.get_cost(token))
+                self.assertEqual(I.get_set_ids(token).tolist(), full.get_set_ids(token).tolist())
+                for set_idx in range(len(self.S)):
+                    self.assertEqual(I.get_indexes_binary(token, set_idx), full.get_indexes_binary(token, set_idx))
+                self.assertEqual(I.get_indexes_skip(token, [0, 2, 3]), full.get_indexes_skip(token, [0, 2, 3]))
+                self.assertEqual(I.get_indexes(token), full.get_indexes(token))
+        lookup_table = {token: list(postings) for token, postings in full.lookup_table.items()}
+        I = InvertedIndex.from_lookup_table(self.S, lookup_table, compress=True)
+        self.assertEqual(I.get_indexes(self.t1), full.get_indexes(self.t1))
+
+    def test_stats(self):
+        I = InvertedIndex(self.S, stop_df=0.75)
+        stats = I.stats(top_k=2)
+        self.assertEqual(stats["sets"], 4)
+        self.assertEqual(stats["elements"], 12)
+        self.assertEqual(stats["vocabulary"], 12)
+        self.assertEqual(stats["stop_tokens"], 6)
+        self.assertEqual(stats["postings"], sum(InvertedIndex(self.S).get_cost(t) for t in I.keys()))
+        # "77" is in 9 elements, "Mass" in 8
+        self.assertEqual(stats["top_tokens"], [(self.t1, 9), (self.t2, 8)])
+        self.assertEqual(stats["set_sizes"]["histogram"], {3: 4})
+        self.assertEqual(sum(stats["posting_lengths"]["histogram"].values()), 12)
+        self.assertEqual(stats["posting_lengths"]["percentiles"][100], 9)
+        self.assertEqual(stats["element_sizes"]["mean"], sum(len(e) for s in self.S for e in s) / 12)
+
+        memory = stats["memory"]
+        self.assertEqual(memory["total"], sum(size for key, size in memory.items() if key not in ("total", "postings")))
+        compressed = InvertedIndex(self.S, compress=True).memory_usage()
+        self.assertLess(compressed["lookup_table"], InvertedIndex(self.S).memory_usage()["lookup_table"])
+
+    def test_get_set_ids(self):
+        I = InvertedIndex(self.S, stop_df=0.75)
+        # "02115" is twice in S1 and S2
+        self.assertEqual(I.get_set_ids(self.t7).tolist(), [0, 1, 3])
+        self.assertEqual(I.get_set_ids(self.t1).tolist(), [0, 1, 2, 3])
+        self.assertEqual(I.get_set_sizes().tolist(), [3, 3, 3, 3])
+        with self.assertRaises(ValueError):
+            I.get_set_ids("Berlin")
+
+    def test_get_indexes_skip(self):
+        I = InvertedIndex(self.S)
+        for token in I.keys():
+            for set_ids in ([0, 1, 2, 3], [1, 3], [3], [], [0, 2, 7]):
+                expected = {
+                    set_idx: [e for _, e in I.get_indexes_binary(token, set_idx)]
+                    for set_idx in set_ids if I.get_indexes_binary(token, set_idx)
+                }
+                self.assertEqual(I.get_indexes_skip(token, set_ids), expected)
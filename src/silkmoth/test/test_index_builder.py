@@ -0,0 +1,108 @@
+import random
+import sys
+import unittest
+from silkmoth.index_builder import StreamingIndexBuilder, merge_runs, partial_lists_bytes
+from silkmoth.inverted_index import InvertedIndex
+from silkmoth.silkmoth_engine import SilkMothEngine
+from silkmoth.tokenizer import Tokenizer
+from silkmoth.utils import contain, jaccard_similarity, edit_similarity
+
+class TestStreamingIndexBuilder(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        words = [f"w{i}" for i in range(50)]
+        self.source_sets = [[" ".join(random.sample(words, 3)) for _ in range(random.randint(1, 6))]
+                            for _ in range(200)]
+        self.tokenizer = Tokenizer(jaccard_similarity)
+        self.expected = InvertedIndex([self.tokenizer.tokenize(s) for s in self.source_sets])
+
+    def test_build_in_memory(self):
+        index = StreamingIndexBuilder(self.tokenizer).build(iter(self.source_sets))
+        self.assertEqual(index.lookup_table, self.expected.lookup_table)
+        self.assertEqual(index.token_sets, self.expected.token_sets)
+
+    def test_build_with_spilling(self):
+        # budget of roughly 100 postings forces many runs
+        builder = StreamingIndexBuilder(self.tokenizer, memory_budget=100 * 100 / 1024 ** 2)
+        index = builder.build(s for s in self.source_sets)
+        self.assertEqual(index.lookup_table, self.expected.lookup_table)
+        self.assertEqual(index.token_sets, self.expected.token_sets)
+        for token in self.expected.keys():
+            self.assertEqual(index.get_indexes_binary(token, 5), self.expected.get_indexes_binary(token, 5))
+
+    def test_partial_lists_bytes(self):
+        lookup_table = self.expected.lookup_table
+        postings = sum(len(inverted_list) for inverted_list in lookup_table.values())
+        measured = sum(sys.getsizeof(inverted_list) + sum(sys.getsizeof(key) for key in inverted_list)
+                       for inverted_list in lookup_table.values())
+        estimate = partial_lists_bytes(len(lookup_table), postings)
+        self.assertLess(abs(estimate - measured) / measured, 0.2)
+
+    def test_build_parallel(self):
+        builder = StreamingIndexBuilder(self.tokenizer, workers=2, chunk_size=15)
+        index = builder.build(iter(self.source_sets))
+        self.assertEqual(index.lookup_table, self.expected.lookup_table)
+        self.assertEqual(index.token_sets, self.expected.token_sets)
+
+    def test_build_parallel_with_spilling(self):
+        builder = StreamingIndexBuilder(self.tokenizer, memory_budget=100 * 100 / 1024 ** 2,
+                                        workers=3, chunk_size=10)
+        index = builder.build(self.source_sets)
+        self.assertEqual(index.lookup_table, self.expected.lookup_table)
+        self.assertEqual(index.token_sets, self.expected.token_sets)
+
+    def test_engine_parallel_build(self):
+        engine = SilkMothEngine(0.7, self.source_sets, contain, edit_similarity, index_workers=2)
+        expected = SilkMothEngine(0.7, self.source_sets, contain, edit_similarity)
+        self.assertEqual(engine.inverted_index.lookup_table, expected.inverted_index.lookup_table)
+
+    def test_estimate_memory(self):
+        for compress in (False, True):
+            builder = StreamingIndexBuilder(self.tokenizer, compress=compress)
+            index = builder.build(self.source_sets)
+            memory = index.memory_usage()
+            # the full collection as sample gives the index itself
+            estimate = builder.estimate_memory(self.source_sets, len(self.source_sets))
+            self.assertEqual(estimate["vocabulary"], len(index.keys()))
+            self.assertEqual(estimate["postings"], index.stats()["postings"])
+            for key in ("lookup_table", "postings", "cost_table", "token_sets"):
+                self.assertEqual(estimate["memory"][key], memory[key])
+            # a sample of half of the sets
+            estimate = builder.estimate_memory(self.source_sets[::2], len(self.source_sets))
+            self.assertLess(abs(estimate["memory"]["total"] / memory["total"] - 1), 0.2)
+            self.assertLessEqual(estimate["vocabulary"], 2 * len(index.keys()))
+        with self.assertRaises(ValueError):
+            builder.estimate_memory([], 10)
+
+    def test_engine_estimate_memory(self):
+        engine = SilkMothEngine(0.5, self.source_sets, contain, lazy_index=True, index_stop_df=0.1,
+                                dedup_elements=True)
+        estimate = engine.estimate_index_memory(self.source_sets, len(self.source_sets))
+        self.assertIsNone(engine._inverted_index)
+        self.assertEqual(estimate["postings"], engine.inverted_index.stats()["postings"]
+                         - sum(engine.inverted_index.cost_table.values()))
+
+    def test_merge_runs(self):
+        runs = [[("a", [(0, 0)]), ("c", [(0, 1)])], [("a", [(1, 0)]), ("b", [(1, 1)])]]
+        self.assertEqual(merge_runs(runs), {"a": [(0, 0), (1, 0)], "b": [(1, 1)], "c": [(0, 1)]})
+
+    def test_engine_from_generator(self):
+        engine = SilkMothEngine(0.7, (s for s in self.source_sets), contain, jaccard_similarity,
+                                keep_source_sets=False, index_memory_budget=0.001)
+        expected = SilkMothEngine(0.7, self.source_sets, contain, jaccard_similarity)
+        self.assertIsNone(engine.source_sets)
+        for reference_set in self.source_sets[:10]:
+            self.assertEqual(engine.search_sets(reference_set), expected.search_sets(reference_set))
+
+    def test_engine_generator_must_not_be_kept(self):
+        with self.assertRaises(ValueError):
+            SilkMothEngine(0.7, (s for s in self.source_sets))
+
+    def test_set_q_without_source_sets(self):
+        engine = SilkMothEngine(0.7, iter(self.source_sets), contain, edit_similarity, keep_source_sets=False)
+        with self.assertRaises(ValueError):
+            engine.set_q(2)
+
+if __name__ == '__main__':
+    unittest.main()
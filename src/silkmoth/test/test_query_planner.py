@@ -0,0 +1,119 @@
+import unittest
+from silkmoth.silkmoth_engine import SilkMothEngine
+from silkmoth.query_planner import QueryPlanner, QueryPlan
+from silkmoth.utils import contain, similar, jaccard_similarity, edit_similarity, SigType
+
+
+class TestQueryPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.S = [
+            ['Mass Ave St Boston 02115', '77 Mass 5th St Boston', '77 Mass Ave 5th 02115'],
+            ['77 Boston MA', '77 5th St Boston 02115', '77 Mass Ave 02115 Seattle'],
+            ['77 Mass Ave 5th Boston MA', 'Mass Ave Chicago IL', '77 Mass Ave St'],
+            ['77 Mass Ave MA', '5th St 02115 Seattle WA', '77 5th St Boston Seattle']
+        ]
+        self.R = ['77 Mass Ave Boston MA', '5th St 02115 Seattle WA', '77 5th St Chicago IL']
+
+    def test_auto_plan_results(self):
+        # every plan is exact, so the results don't depend on the chosen plan
+        for sim_metric in (similar, contain):
+            for sim_func, sim_thresh in ((jaccard_similarity, 0.0), (edit_similarity, 0.7)):
+                expected = SilkMothEngine(0.3, self.S, sim_metric, sim_func, sim_thresh)
+                engine = SilkMothEngine(0.3, self.S, sim_metric, sim_func, sim_thresh, auto_plan=True)
+                for _ in range(5):
+                    for R in (self.R, self.S[0]):
+                        results, _, _ = engine.search_sets(R)
+                        self.assertEqual(sorted(results), sorted(expected.search_sets(R)[0]))
+                self.assertEqual(engine.query_planner.queries, 10)
+
+    def test_plan_recorded(self):
+        engine = SilkMothEngine(0.5, self.S, contain, auto_plan=True)
+        engine.search_sets(self.R)
+        plan = engine.last_query_stats["plan"]
+        self.assertIsInstance(plan, QueryPlan)
+        self.assertIn(plan.sig_type, SigType)
+        # warm-up queries run both filters
+        self.assertTrue(plan.is_check_filter and plan.is_nn_filter)
+        self.assertEqual(engine.last_query_stats["check_filter"], plan.is_check_filter)
+        self.assertIn("verify_time", engine.last_query_stats)
+
+    def test_last_query_stats_without_planner(self):
+        engine = SilkMothEngine(0.5, self.S, contain, is_check_filter=True)
+        _, start, end = engine.search_sets(self.R)
+        stats = engine.last_query_stats
+        self.assertNotIn("plan", stats)
+        self.assertEqual(stats["candidates"], start)
+        self.assertEqual(stats["candidates_after_filters"], end)
+        self.assertEqual(set(stats["filters"]), {"check"})
+        self.assertEqual(stats["filters"]["check"]["candidates"] - stats["filters"]["check"]["pruned"], end)
+
+    def test_estimate(self):
+        planner = QueryPlanner()
+        no_filter = planner.estimate(100, 50, False, False)
+        # filters pay off if verification is expensive and they prune most candidates
+        planner.costs["verify"] = 1.0
+        planner.pass_rates["check"] = 0.1
+        self.assertLess(planner.estimate(100, 50, True, False), planner.estimate(100, 50, False, False))
+        self.assertGreater(planner.estimate(100, 50, False, False), no_filter)
+
+    def test_estimate_filter_order(self):
+        planner = QueryPlanner()
+        planner.costs.update({"posting": 0.0, "check": 1e-3, "nn": 1e-5, "verify": 1.0})
+        planner.pass_rates.update({"check": 0.9, "nn": 0.1})
+        # the cheap and selective nn filter runs first, like in the filter chain
+        self.assertAlmostEqual(planner.estimate(0, 100, True, True), 100 * 1e-5 + 10 * 1e-3 + 9 * 1.0)
+        self.assertAlmostEqual(planner.estimate(0, 100, False, True), 100 * 1e-5 + 10 * 1.0)
+
+    def test_observe(self):
+        planner = QueryPlanner(smoothing=1.0)
+        plan = QueryPlan(SigType.WEIGHTED, True, False, 0.0, 10, 100)
+        planner.observe(plan, {
+            "candidates": 5, "selection_time": 1e-3, "candidates_after_filters": 4, "verify_time": 4e-3,
+            "filters": {"check": {"candidates": 10, "pruned": 6, "time": 2e-3, "dropped": False}},
+        })
+        self.assertAlmostEqual(planner.costs["posting"], 1e-5)
+        self.assertAlmostEqual(planner.costs["check"], 2e-4)
+        self.assertAlmostEqual(planner.pass_rates["check"], 0.4)
+        self.assertAlmostEqual(planner.costs["verify"], 1e-3)
+        self.assertAlmostEqual(planner.pass_rates["selection"], 0.5)
+        self.assertEqual(planner.plan_counts, {(SigType.WEIGHTED, True, False): 1})
+
+    def test_plan_without_lists(self):
+        # planning only needs the costs, stop token lists are not materialized
+        engine = SilkMothEngine(0.3, self.S, contain, index_stop_df=0.5, auto_plan=True)
+        engine.query_planner.sample_queries = 0
+        index = engine.inverted_index
+        self.assertTrue(index.cost_table)
+        plan, signature = engine.query_planner.plan(engine, engine._tokenize_reference(self.R))
+        self.assertFalse(index.materialized)
+        self.assertFalse(index.set_id_cache)
+        self.assertGreater(plan.estimated_cost, 0)
+        self.assertLessEqual(plan.estimated_candidates, len(self.S))
+
+        # neither for the verification sample of the warm-up queries
+        engine = SilkMothEngine(0.3, self.S, contain, index_stop_df=0.5, auto_plan=True)
+        index = engine.inverted_index
+        engine.query_planner.plan(engine, engine._tokenize_reference(self.R))
+        self.assertTrue(index.cost_table)
+        self.assertFalse(index.materialized)
+
+    def test_plan_time_charged(self):
+        engine = SilkMothEngine(0.3, self.S, contain, auto_plan=True)
+        engine.search_sets(self.R)
+        stats = engine.last_query_stats
+        self.assertGreaterEqual(stats["total_time"], stats["plan_time"] + stats["selection_time"])
+
+    def test_observe_pipelined(self):
+        # the pipelined verification records its time, so the verification cost is learned
+        engine = SilkMothEngine(0.1, self.S, contain, auto_plan=True, verify_workers=2, verify_chunk_size=1)
+        engine.query_planner.sample_queries = 0
+        engine.search_sets(self.R)
+        self.assertGreater(engine.last_query_stats["candidates_after_filters"], 1)
+        self.assertIn("verify_time", engine.last_query_stats)
+        self.assertNotEqual(engine.query_planner.costs["verify"], QueryPlanner().costs["verify"])
+        engine.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
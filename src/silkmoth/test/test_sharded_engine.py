@@ -0,0 +1,123 @@
+import random
+import unittest
+from silkmoth.silkmoth_engine import SilkMothEngine
+from silkmoth.sharded_engine import ShardedSilkMothEngine
+from silkmoth.utils import contain, jaccard_similarity, similar, edit_similarity, SigType
+
+class TestShardedEngine(unittest.TestCase):
+
+    def setUp(self):
+        # Same example from Table 2 
+        t1 = "77"
+        t2 = "Mass"
+        t3 = "Ave"
+        t4 = "5th"
+        t5 = "St"
+        t6 = "Boston"
+        t7 = "02115"
+        t8 = "MA"
+        t9 = "Seattle"
+        t10 = "WA"
+        t11 = "Chicago"
+        t12 = "IL"
+
+        self.S1 = [" ".join([t2, t3, t5, t6, t7]), " ".join([t1, t2, t4, t5, t6]),
+                    " ".join([t1, t2, t3, t4, t7])]
+        self.S2 = [" ".join([t1, t6, t8]), " ".join([t1, t4, t5, t6, t7]),
+                    " ".join([t1, t2, t3, t7, t9])]
+        self.S3 = [" ".join([t1, t2, t3, t4, t6, t8]), " ".join([t2, t3, t11, t12]),
+                    " ".join([t1, t2, t3, t5])]
+        self.S4 = [" ".join([t1, t2, t3, t8]), " ".join([t4, t5, t7, t9, t10]),
+                    " ".join([t1, t4, t5, t6, t9])]
+        self.S = [self.S1, self.S2, self.S3, self.S4]
+        self.R = [" ".join([t1, t2, t3, t6, t8]), " ".join([t4, t5, t7, t9, t10]), 
+                  " ".join([t1, t4, t5, t11, t12])]
+
+        random.seed(0)
+        words = [f"w{i}" for i in range(30)]
+        self.random_sets = [[" ".join(random.sample(words, 3)) for _ in range(random.randint(2, 5))]
+                            for _ in range(60)]
+
+    def test_pipeline_running_base_example(self):
+        with ShardedSilkMothEngine(0.7, self.S, contain, jaccard_similarity, num_shards=2) as engine:
+            search_results, _, _ = engine.search_sets(self.R)
+        self.assertEqual(len(search_results), 1)
+        i, sim = search_results[0]
+        self.assertEqual(i, 3)
+        self.assertGreaterEqual(sim, 0.7)
+
+    def test_same_results_as_single_engine(self):
+        single = SilkMothEngine(0.5, self.random_sets, similar, jaccard_similarity,
+                                sim_thresh=0.3, is_check_filter=True, is_nn_filter=True)
+        for partition in ("round_robin", "range"):
+            with ShardedSilkMothEngine(0.5, self.random_sets, similar, jaccard_similarity, sim_thresh=0.3,
+                                       is_check_filter=True, is_nn_filter=True, num_shards=3,
+                                       partition=partition) as engine:
+                for reference_set in self.random_sets[:10]:
+                    expected, expected_start, expected_end = single.search_sets(reference_set)
+                    results, start, end = engine.search_sets(reference_set)
+                    self.assertEqual(results, sorted(expected))
+                    self.assertEqual((start, end), (expected_start, expected_end))
+
+    def test_hash_partition_alias(self):
+        engine = ShardedSilkMothEngine(0.5, self.random_sets, num_shards=3, partition="hash", lazy_index=True)
+        self.assertEqual(engine.partition, "round_robin")
+        self.assertEqual(engine._partition(7), [[0, 3, 6], [1, 4], [2, 5]])
+        engine.close()
+        with self.assertRaises(ValueError):
+            ShardedSilkMothEngine(0.5, self.random_sets, partition="modulo", lazy_index=True)
+
+    def test_search_sets_multi(self):
+        single = SilkMothEngine(0.5, self.random_sets, similar)
+        with ShardedSilkMothEngine(0.9, self.random_sets, similar, num_shards=2) as engine:
+            for reference_set in self.random_sets[:5]:
+                results, _, _ = engine.search_sets_multi(reference_set, [0.5, 0.7])
+                expected, _, _ = single.search_sets_multi(reference_set, [0.5, 0.7])
+                for thresh in (0.5, 0.7):
+                    self.assertEqual(results[thresh], sorted(expected[thresh]))
+
+    def test_global_token_costs(self):
+        single = SilkMothEngine(0.5, self.random_sets)
+        with ShardedSilkMothEngine(0.5, self.random_sets, num_shards=4) as engine:
+            for token in single.inverted_index.keys():
+                self.assertEqual(engine.inverted_index.get_cost(token), single.inverted_index.get_cost(token))
+            with self.assertRaises(ValueError):
+                engine.inverted_index.get_cost("unknown")
+
+    def test_settings_are_forwarded(self):
+        with ShardedSilkMothEngine(0.7, self.S, contain, jaccard_similarity, num_shards=2) as engine:
+            engine.set_related_threshold(0.3)
+            search_results, _, _ = engine.search_sets(self.R)
+        self.assertEqual([i for i, _ in search_results], [0, 1, 2, 3])
+
+    def test_set_q(self):
+        single = SilkMothEngine(0.8, self.S, contain, edit_similarity, sim_thresh=0.7, sig_type=SigType.SKYLINE)
+        with ShardedSilkMothEngine(0.8, self.S, contain, edit_similarity, sim_thresh=0.7,
+                                   sig_type=SigType.SKYLINE, num_shards=2) as engine:
+            single.set_q(2)
+            engine.set_q(2)
+            expected, _, _ = single.search_sets(["77 Mas Ave Boston MA"])
+            search_results, _, _ = engine.search_sets(["77 Mas Ave Boston MA"])
+        self.assertEqual(search_results, sorted(expected))
+
+    def test_unknown_partition(self):
+        with self.assertRaises(ValueError):
+            ShardedSilkMothEngine(0.7, self.S, partition="random")
+
+    def test_shard_args(self):
+        single = SilkMothEngine(0.5, self.random_sets, similar, is_check_filter=True)
+        with ShardedSilkMothEngine(0.5, self.random_sets, similar, is_check_filter=True, num_shards=2,
+                                   dedup_elements=True, index_compress=True, index_stop_df=0.5,
+                                   verify_workers=2, verify_chunk_size=4) as engine:
+            for reference_set in self.random_sets[:5]:
+                expected, _, _ = single.search_sets(reference_set)
+                results, _, _ = engine.search_sets(reference_set)
+                self.assertEqual(results, sorted(expected))
+
+    def test_unsupported_args(self):
+        for args in ({"auto_plan": True}, {"keep_source_sets": True}):
+            with self.assertRaises(ValueError):
+                ShardedSilkMothEngine(0.7, self.S, num_shards=2, **args)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,6 @@
+import random
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 import unittest
 from silkmoth.verifier import Verifier, reduce_sets
 from silkmoth.inverted_index import InvertedIndex
@@ -101,4 +104,91 @@ class TestVerifier(unittest.TestCase):
     def test_mm_score(self):
         verifier = Verifier(0.7, contain, jaccard_similarity)
         mm_score = verifier.get_mm_score(self.R, self.S4)
-        self.assertEqual(round(mm_score, 3), 2.229)
\ No newline at end of file
+        self.assertEqual(round(mm_score, 3), 2.229)
+
+    def test_sparse_edges(self):
+        verifier = Verifier(0.7, contain, jaccard_similarity)
+        rows, cols, weights = verifier.get_sparse_edges(self.R, self.S4)
+        for i, j, w in zip(rows, cols, weights):
+            self.assertEqual(w, jaccard_similarity(self.R[i], self.S4[j]))
+        self.assertNotIn((1, 0), set(zip(rows.tolist(), cols.tolist())))
+
+    def test_sparse_mm_score_matches_dense(self):
+        random.seed(0)
+        vocabulary = [str(t) for t in range(40)]
+        for sim_thresh in (0.0, 0.25, 0.5):
+            sparse = Verifier(0.7, contain, jaccard_similarity, sim_thresh, dense_ratio=1.0)
+            dense = Verifier(0.7, contain, jaccard_similarity, sim_thresh, dense_ratio=0.0)
+            for _ in range(20):
+                ref = [set(random.sample(vocabulary, 3)) for _ in range(8)]
+                src = [set(random.sample(vocabulary, 3)) for _ in range(12)]
+                self.assertAlmostEqual(sparse.get_mm_score(ref, src), dense.get_mm_score(ref, src))
+
+    def test_sparse_mm_score_no_edges(self):
+        verifier = Verifier(0.7, contain, jaccard_similarity)
+        self.assertEqual(verifier.get_mm_score([{"a"}, {"b"}], [{"c"}, {"d"}, {"e"}]), 0.0)
+
+    def test_components_mm_score_matches_full_assignment(self):
+        random.seed(1)
+        verifier = Verifier(0.7, contain, jaccard_similarity, 0.3)
+        for _ in range(20):
+            # disjoint vocabularies produce several independent components
+            ref = [set(random.sample(range(g * 10, g * 10 + 10), 3)) for g in range(4) for _ in range(3)]
+            src = [set(random.sample(range(g * 10, g * 10 + 10), 3)) for g in range(4) for _ in range(4)]
+            weights = np.array([[jaccard_similarity(r, s, 0.3) for s in src] for r in ref])
+            row_ind, col_ind = linear_sum_assignment(-weights)
+            self.assertAlmostEqual(verifier.get_mm_score(ref, src), weights[row_ind, col_ind].sum())
+
+    def test_components_star(self):
+        verifier = Verifier(0.7, contain, jaccard_similarity)
+        ref = [{"a", "b"}]
+        src = [{"a"}, {"a", "b"}, {"b", "c"}]
+        self.assertEqual(verifier.get_mm_score(ref, src), 1.0)
+        components = verifier._get_components(1, *verifier.get_sparse_edges(ref, src)[:2])
+        self.assertEqual(len(components), 1)
+
+    def test_components_edit_similarity(self):
+        verifier = Verifier(0.7, contain, edit_similarity, 0.8)
+        ref = ["Boston", "Seattle", "Chicago"]
+        src = ["Bostn", "Chicago", "Berlin", "Seattle WA"]
+        self.assertAlmostEqual(verifier.get_mm_score(ref, src),
+                               edit_similarity("Boston", "Bostn") + 1.0)
+
+    def test_reduce_qgram_lists(self):
+        ref = [["Bos", "ost", "sto"], ["Sea", "eat"]]
+        src = [["Sea", "eat"], ["Chi", "hic"]]
+        r_reduced, s_reduced, count = reduce_sets(ref, src)
+        self.assertEqual(r_reduced, [["Bos", "ost", "sto"]])
+        self.assertEqual(s_reduced, [["Chi", "hic"]])
+        self.assertEqual(count, 1)
+
+    def test_reduce_alpha_isolated(self):
+        ref = [{"a", "b"}, {"c", "d"}, {"x"}]
+        src = [{"a", "b"}, {"c", "d", "e"}, {"y"}]
+        r_reduced, s_reduced, count = reduce_sets(ref, src, jaccard_similarity, 0.5)
+        self.assertEqual(r_reduced, [{"c", "d"}, {"x"}])
+        self.assertEqual(s_reduced, [{"c", "d", "e"}, {"y"}])
+        self.assertEqual(count, 1)
+
+    def test_reduce_alpha_not_forced(self):
+        # {"a", "b"} is similar to other elements, so its pairing is not forced
+        ref = [{"a", "b"}, {"a", "b", "c"}]
+        src = [{"a", "b"}, {"a", "b", "d"}]
+        r_reduced, s_reduced, count = reduce_sets(ref, src, jaccard_similarity, 0.6)
+        self.assertEqual(r_reduced, ref)
+        self.assertEqual(s_reduced, src)
+        self.assertEqual(count, 0)
+
+    def test_reduce_alpha_requires_sim_func(self):
+        with self.assertRaises(ValueError):
+            reduce_sets(self.R, self.S1, sim_thresh=0.5)
+
+    def test_reduced_alpha_same_relatedness(self):
+        random.seed(2)
+        vocabulary = [str(t) for t in range(12)]
+        plain = Verifier(0.5, similar, jaccard_similarity, 0.4)
+        reduced = Verifier(0.5, similar, jaccard_similarity, 0.4, reduction=True)
+        for _ in range(50):
+            ref = [set(random.sample(vocabulary, 2)) for _ in range(6)]
+            src = [set(random.sample(vocabulary, 2)) for _ in range(6)]
+            self.assertAlmostEqual(plain.get_relatedness(ref, src), reduced.get_relatedness(ref, src))
@@ -1,4 +1,4 @@
-from .utils import jaccard_similarity, N_edit_similarity, edit_similarity
+from .utils import jaccard_similarity, N_edit_similarity, edit_similarity, reverse_qgrams
 from ordered_set import OrderedSet
 
 def jaccard_tokenize(input_set: list) -> list:
@@ -77,6 +77,41 @@ def qgram_tokenize(input_set: list, q: int) -> list[list[str]]:
     return tokens
 
 
+class QgramRetokenizer:
+    """
+    Re-tokenizes q-gram tokenized sets with a larger q-gram size without the
+    raw sets. Every non-empty q-gram list is turned back into its (stripped)
+    string. Empty lists stay empty, since their strings are shorter than the
+    old q and thus also than the new one. Deriving a smaller q is not exact, 
+    because strings shorter than the old q are lost.
+    """
+
+    def __init__(self, q: int):
+        """
+        Initialize the re-tokenizer.
+
+        Args:
+            q (int): The new q-gram size, at least the old one
+        """
+        self.q = q
+
+    def tokenize(self, token_set: list) -> list[list[str]]:
+        """
+        Re-tokenizes a q-gram tokenized set.
+
+        Args:
+            token_set (list): Set of q-gram lists
+
+        Returns:
+            list[list[str]]: A list of lists with the new q-gram tokens.
+        """
+        q = self.q
+        tokens = []
+        for qgrams in token_set:
+            s = reverse_qgrams(list(qgrams))
+            tokens.append([s[i:i+q] for i in range(len(s) - q + 1)])
+        return tokens
+
 
 class Tokenizer:
 
@@ -108,6 +108,23 @@ def flatten_tokens(input_val):
         return " ".join(flat)
     return input_val  # assume it's already a string
 
+def element_key(elem):
+    """
+    Gives a hashable key for a tokenized or raw element. Jaccard elements are
+    token sets and edit similarity elements are ordered q-gram lists, raw 
+    elements can also be numbers or nested lists, which become tuples.
+    """
+    if isinstance(elem, str):
+        return elem
+    if isinstance(elem, (set, frozenset)):
+        return frozenset(elem)
+    if isinstance(elem, (list, tuple)):
+        if all(isinstance(e, str) for e in elem):
+            return tuple(elem)
+        return tuple(element_key(e) for e in elem)
+    # keep types apart, e.g. 1 and True or "1"
+    return (type(elem).__name__, elem)
+
 def reverse_qgrams(input_val) -> str:
     """
     Reverse qgrams back to their original text.
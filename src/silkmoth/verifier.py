@@ -1,29 +1,80 @@
 from .inverted_index import InvertedIndex
+from .utils import jaccard_similarity, element_key
+from collections import Counter, defaultdict
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
 
-def reduce_sets(reference_set: list, source_set: list) -> tuple:
+def _is_isolated(elem, key, reference_keys, reference_set, source_keys, source_set, sim_func, sim_thresh) -> bool:
+    """
+    Checks whether an element only has non-zero similarity to its identical 
+    copies in both sets. The copies then form their own connected component 
+    of the matching graph and pairing them is forced.
+    """
+    if sim_func(elem, elem, sim_thresh) < 1.0:
+        return False
+    for other_keys, other_set in ((reference_keys, reference_set), (source_keys, source_set)):
+        for other_key, other in zip(other_keys, other_set):
+            if other_key != key and sim_func(elem, other, sim_thresh) > 0:
+                return False
+    return True
+
+
+def reduce_sets(reference_set: list, source_set: list, sim_func=None, sim_thresh=0) -> tuple:
     """
     Applies the triangle inequality reduction by removing every element from 
-    both sets that has an identical match in the other set. 
+    both sets that has an identical match in the other set. Identical elements
+    are counted by hashing, so the reduction runs in linear time.
+
+    The triangle inequality argument only holds for α = 0. For α > 0 an 
+    identical pair is only removed if the element has no non-zero similarity 
+    to any other element of both sets, i.e. its optimal pairing is forced. 
+    This check needs the similarity function and costs O(|R| + |S|) 
+    similarity computations per distinct duplicated element.
 
     Args:
         reference_set: Tokenized reference set R
         source_set: Tokenized source set S
+        sim_func (callable): Similarity function phi, required for α > 0
+        sim_thresh (float): Similarity threshold alpha
 
     Returns:
         (list, list, int):  Reduced reference set, reduced source set and number
                             of identical elements.
     """
-    r_reduced = reference_set[:]
-    s_reduced = source_set[:]
-    count = 0
-    for elem in reference_set:
-        if elem in s_reduced:
-            s_reduced.remove(elem)
-            r_reduced.remove(elem)
-            count += 1
-    return (r_reduced, s_reduced, count)
+    r_keys = [element_key(elem) for elem in reference_set]
+    s_keys = [element_key(elem) for elem in source_set]
+    s_counts = Counter(s_keys)
+
+    matches = {}
+    for key, r_count in Counter(r_keys).items():
+        if key in s_counts:
+            matches[key] = min(r_count, s_counts[key])
+
+    if sim_thresh > 0:
+        if sim_func is None:
+            raise ValueError("A similarity function is required for alpha > 0")
+        first_elem = {}
+        for key, elem in zip(r_keys, reference_set):
+            first_elem.setdefault(key, elem)
+        matches = {
+            key: count for key, count in matches.items()
+            if _is_isolated(first_elem[key], key, r_keys, reference_set, s_keys, source_set, sim_func, sim_thresh)
+        }
+
+    def remove_matches(keys, elems):
+        remaining = dict(matches)
+        reduced = []
+        for key, elem in zip(keys, elems):
+            if remaining.get(key, 0) > 0:
+                remaining[key] -= 1
+            else:
+                reduced.append(elem)
+        return reduced
+
+    count = sum(matches.values())
+    return (remove_matches(r_keys, reference_set), remove_matches(s_keys, source_set), count)
 
 
 class Verifier:
@@ -39,7 +90,18 @@ class Verifier:
     library [SciPy](https://scipy.org/).
 
     Optionally, a triangle inequality-based reduction can be applied to further 
-    improve performance.
+    improve performance. For α > 0 only identical elements whose pairing is 
+    forced are removed.
+
+    For Jaccard similarity two elements can only have a non-zero weight if they
+    share a token. In that case only these edges are computed and the matching 
+    is solved on the sparse graph. The graph is further split into its 
+    connected components, which are solved independently. Single edges and 
+    stars are solved in closed form, all other components use the sparse 
+    solver or, if the component is dense, the dense assignment solver.
+
+    With an [ElementStore](element_store.md) the similarities between interned
+    elements are cached across all candidates and queries.
 
     Examples
     --------
@@ -61,7 +123,7 @@ class Verifier:
     ```
     """
 
-    def __init__(self, related_thresh, sim_metric, sim_func, sim_thresh=0, reduction=False):
+    def __init__(self, related_thresh, sim_metric, sim_func, sim_thresh=0, reduction=False, dense_ratio=0.5, element_store=None):
         """
         Initialize the verifier with some parameters.
 
@@ -71,12 +133,24 @@ class Verifier:
             sim_func (callable): Similarity function phi
             sim_thresh (float): Similarity threshold alpha
             reduction (bool): Flag to activate/deactivate triangle inequality reduction
+            dense_ratio (float): Fraction of non-zero edges above which the 
+                matching is solved on the dense weight matrix
+            element_store (ElementStore): Store of interned elements used to 
+                cache similarities, None to compute every similarity
         """
         self.related_thresh = related_thresh
         self.sim_metric = sim_metric
         self.sim_func = sim_func
         self.sim_thresh = sim_thresh
         self.reduction = reduction
+        self.dense_ratio = dense_ratio
+        self.element_store = element_store
+
+    def _similarity(self, r_elem, s_elem) -> float:
+        if self.element_store is None:
+            return self.sim_func(r_elem, s_elem, self.sim_thresh)
+        sim = self.element_store.similarity(r_elem, s_elem, self.sim_func)
+        return sim if sim >= self.sim_thresh else .0
     
     def get_mm_score(self, reference_set, source_set) -> float:
         """
@@ -96,15 +170,167 @@ class Verifier:
         if n == 0 or m == 0:
             return 0.0
 
-        weights = np.zeros((n, m), dtype=float)
+        if self.sim_func == jaccard_similarity:
+            rows, cols, weights = self.get_sparse_edges(reference_set, source_set)
+        else:
+            dense = np.zeros((n, m), dtype=float)
+            for i, r_elem in enumerate(reference_set):
+                for j, s_elem in enumerate(source_set):
+                    dense[i, j] = self._similarity(r_elem, s_elem)
+            rows, cols = np.nonzero(dense)
+            weights = dense[rows, cols]
+
+        if len(weights) == 0:
+            return 0.0
+
+        # solve every connected component on its own and sum up the results
+        matched_rows, matched_weights = [], []
+        for component in self._get_components(n, rows, cols):
+            r_ind, w = self._solve_component(rows[component], cols[component], weights[component])
+            matched_rows.append(r_ind)
+            matched_weights.append(w)
+        matched_rows = np.concatenate(matched_rows)
+        matched_weights = np.concatenate(matched_weights)
+        return float(matched_weights[np.argsort(matched_rows, kind="stable")].sum())
+
+    def _get_components(self, n, rows, cols) -> list:
+        """
+        Splits the edges of the bipartite graph into its connected components
+        using a union-find structure. Reference elements are the nodes 0..n-1 
+        and source elements the nodes n, n+1, ...
+
+        Args:
+            n (int): Size of reference set R
+            rows (np.ndarray): Row indices of the edges
+            cols (np.ndarray): Column indices of the edges
+
+        Returns:
+            list: One array of edge positions per connected component
+        """
+        parent = {}
+
+        def find(x):
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        row_list = rows.tolist()
+        col_list = cols.tolist()
+        for i, j in zip(row_list, col_list):
+            root_i, root_j = find(i), find(n + j)
+            if root_i != root_j:
+                parent[root_j] = root_i
+
+        components = defaultdict(list)
+        for e, i in enumerate(row_list):
+            components[find(i)].append(e)
+        return [np.array(edges, dtype=np.intp) for edges in components.values()]
+
+    def _solve_component(self, rows, cols, weights) -> tuple:
+        """
+        Computes the maximum weighted matching of a single connected component.
+        Single edges and stars (only one reference or one source element) are
+        solved in closed form by taking the heaviest edge, all other components 
+        are solved with the sparse or the dense assignment solver.
+
+        Args:
+            rows (np.ndarray): Row indices of the component's edges
+            cols (np.ndarray): Column indices of the component's edges
+            weights (np.ndarray): Weights of the component's edges
+
+        Returns:
+            (np.ndarray, np.ndarray):   Matched row indices and the weights of 
+                                        their matched edges.
+        """
+        r_ids = np.unique(rows)
+        c_ids = np.unique(cols)
+        if len(r_ids) == 1 or len(c_ids) == 1:
+            best = int(np.argmax(weights))
+            return rows[best:best + 1], weights[best:best + 1]
+
+        local_rows = np.searchsorted(r_ids, rows)
+        local_cols = np.searchsorted(c_ids, cols)
+        n, m = len(r_ids), len(c_ids)
+
+        if len(weights) <= self.dense_ratio * n * m:
+            row_ind, matched = self._sparse_matching(n, m, local_rows, local_cols, weights)
+        else:
+            dense = np.zeros((n, m), dtype=float)
+            dense[local_rows, local_cols] = weights
+            # use negative weights to search for minimal cost
+            row_ind, col_ind = linear_sum_assignment(-dense)
+            matched = dense[row_ind, col_ind]
+        return r_ids[row_ind], matched
+
+    def get_sparse_edges(self, reference_set, source_set) -> tuple:
+        """
+        Computes only the edges of the bipartite graph between elements that 
+        share at least one token. All other pairs have a Jaccard similarity of 
+        zero and are never evaluated.
+
+        Args:
+            reference_set (list): Tokenized reference set R
+            source_set (list): Tokenized source set S
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray):   Row indices, column indices
+                                                    and weights of all edges 
+                                                    with non-zero weight.
+        """
+        token_to_elems = defaultdict(list)
+        for j, s_elem in enumerate(source_set):
+            for token in s_elem:
+                token_to_elems[token].append(j)
+
+        rows, cols, weights = [], [], []
         for i, r_elem in enumerate(reference_set):
-            for j, s_elem in enumerate(source_set):
-                weights[i, j] = self.sim_func(r_elem, s_elem, self.sim_thresh)
+            neighbours = set()
+            for token in r_elem:
+                neighbours.update(token_to_elems.get(token, ()))
+            for j in sorted(neighbours):
+                weight = self._similarity(r_elem, source_set[j])
+                if weight > 0:
+                    rows.append(i)
+                    cols.append(j)
+                    weights.append(weight)
+        return (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp),
+                np.array(weights, dtype=float))
+
+    def _sparse_matching(self, n, m, rows, cols, weights) -> tuple:
+        """
+        Solves the maximum weighted matching on a sparse bipartite graph.
+
+        The maximization is turned into a minimum weight full matching by 
+        using the costs max(weights) + 1 - w, which are strictly positive. Each
+        reference element gets an additional dummy partner with the highest 
+        cost, so a full matching of the reference elements always exists and 
+        unmatched elements simply end up with their dummy.
+
+        Args:
+            n (int): Number of reference elements
+            m (int): Number of source elements
+            rows (np.ndarray): Row indices of the edges
+            cols (np.ndarray): Column indices of the edges
+            weights (np.ndarray): Weights of the edges
+
+        Returns:
+            (np.ndarray, np.ndarray):   Row indices and the weights of their 
+                                        matched edges (zero for dummies).
+        """
+        offset = weights.max() + 1.0
+        dummies = np.arange(n, dtype=np.intp)
+        costs = np.concatenate((offset - weights, np.full(n, offset)))
+        graph = csr_matrix(
+            (costs, (np.concatenate((rows, dummies)), np.concatenate((cols, m + dummies)))),
+            shape=(n, m + n)
+        )
+        row_ind, col_ind = min_weight_full_bipartite_matching(graph)
 
-        # use negative weights to search for minimal cost
-        cost = -weights
-        row_ind, col_ind = linear_sum_assignment(cost)
-        return float(weights[row_ind, col_ind].sum())
+        edge_weights = csr_matrix((weights, (rows, cols)), shape=(n, m + n))
+        matched = np.asarray(edge_weights[row_ind, col_ind]).ravel()
+        return row_ind, matched
 
 
     def get_relatedness(self, reference_set, source_set) -> float:
@@ -123,7 +349,9 @@ class Verifier:
         s_size = len(source_set)
         exact_matches = 0
         if self.reduction:
-            reference_set, source_set, exact_matches = reduce_sets(reference_set, source_set)
+            reference_set, source_set, exact_matches = reduce_sets(
+                reference_set, source_set, self.sim_func, self.sim_thresh
+            )
 
         mm_score = self.get_mm_score(reference_set, source_set) + exact_matches
         relatedness = self.sim_metric(r_size, s_size, mm_score)